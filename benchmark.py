@@ -0,0 +1,351 @@
+# benchmark.py
+# Offline throughput benchmark for the command handlers.
+#
+# Builds a synthetic dataset, imports main.py against it with fake
+# Interaction / Message objects (no Discord connection), and drives a mix of
+# /work, /transfer, /leaderboard, /business claim and the on_message text
+# bridge. Each storage backend runs in its own subprocess so module-level
+# state in main.py starts fresh. The store is flushed every --flush-interval
+# seconds, as flush_store does in the bot, and the loop lag seen while a flush
+# is in progress is reported separately.
+#
+#   python benchmark.py --users 10000 100000 --ops 20000 --backend json sqlite
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GUILD_ID = 1
+PREFIX = "ve"
+
+# -----------------------------
+# Fake Discord objects
+# -----------------------------
+class FakePermissions:
+    manage_guild = False
+
+
+class FakeUser:
+    def __init__(self, uid: int):
+        self.id = uid
+        self.bot = False
+        self.display_name = f"user{uid}"
+        self.mention = f"<@{uid}>"
+        self.guild_permissions = FakePermissions()
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeGuild:
+    def __init__(self, gid: int, member_ids):
+        self.id = gid
+        self.name = f"guild{gid}"
+        self._members = {uid: FakeUser(uid) for uid in member_ids}
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def get_member(self, uid: int):
+        return self._members.get(uid)
+
+
+class FakeChannel:
+    def __init__(self, cid: int):
+        self.id = cid
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FakeResponse:
+    def __init__(self):
+        self._done = False
+
+    async def send_message(self, *args, **kwargs):
+        self._done = True
+
+    async def defer(self, *args, **kwargs):
+        self._done = True
+
+    async def send_modal(self, *args, **kwargs):
+        self._done = True
+
+    def is_done(self) -> bool:
+        return self._done
+
+
+class FakeFollowup:
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeUser, guild: FakeGuild, channel: FakeChannel):
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeUser, guild: FakeGuild, channel: FakeChannel, mentions=()):
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.mentions = list(mentions)
+
+
+# -----------------------------
+# Dataset
+# -----------------------------
+def build_dataset(directory: str, n_users: int, seed: int = 1):
+    rng = random.Random(seed)
+    users = {}
+    for uid in range(1, n_users + 1):
+        user = {
+            "wallet": rng.randint(0, 50000),
+            "bank": rng.randint(0, 200000),
+            "daily_claimed": None,
+            "work_claims": {},
+            "membership": rng.random() < 0.05,
+            "xp": rng.randint(0, 99),
+            "level": rng.randint(1, 20),
+            "job": None,
+            "job_streak": 0,
+            "items": {},
+            "businesses": {},
+        }
+        if rng.random() < 0.2:
+            user["businesses"]["Bakery"] = {"cost": 5000, "profit": 500, "upkeep": 50, "tier": 1}
+        users[str(uid)] = user
+    with open(os.path.join(directory, "users.json"), "w", encoding="utf-8") as f:
+        json.dump(users, f, separators=(",", ":"))
+
+
+# -----------------------------
+# Child process: run one backend
+# -----------------------------
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def lag_ticker(loop: asyncio.AbstractEventLoop, stop: threading.Event, lags: list, interval: float = 0.005):
+    # a thread posts a callback every tick; how long the loop takes to run it
+    # is how long something blocked it, independent of what the workers await
+    def arrived(posted: float):
+        lags.append((posted, time.perf_counter() - posted))
+
+    while not stop.wait(interval):
+        try:
+            loop.call_soon_threadsafe(arrived, time.perf_counter())
+        except RuntimeError:   # loop closed
+            return
+
+
+async def flusher(main, interval: float, done: asyncio.Event, windows: list):
+    # the body of main.flush_store, on a shorter period so every run sees several flushes
+    while not done.is_set():
+        try:
+            await asyncio.wait_for(done.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        start = time.perf_counter()
+        main.ledger.flush()
+        if main.store.dirty:
+            await main.store.flush_async()
+        windows.append((start, time.perf_counter()))
+
+
+async def drive(main, n_users: int, n_ops: int, concurrency: int, seed: int, flush_interval: float) -> dict:
+    rng = random.Random(seed)
+    member_ids = range(1, min(n_users, 5000) + 1)
+    guild = FakeGuild(GUILD_ID, member_ids)
+    channels = [FakeChannel(1000 + i) for i in range(256)]
+
+    # premium guild so the text bridge is live
+    entry = main.get_server_entry(GUILD_ID)
+    entry["premium"] = {"expires": "2999-01-01T00:00:00", "owner_id": 0}
+    entry["prefix"] = PREFIX
+    main.save_server_entry(GUILD_ID, entry)
+
+    def pick_user():
+        return FakeUser(rng.randint(1, n_users))
+
+    async def op_work():
+        await main.slash_work.callback(FakeInteraction(pick_user(), guild, rng.choice(channels)))
+
+    async def op_transfer():
+        a, b = pick_user(), pick_user()
+        if a.id == b.id:
+            b = FakeUser(a.id % n_users + 1)
+        await main.slash_transfer.callback(FakeInteraction(a, guild, rng.choice(channels)), b, rng.randint(1, 50))
+
+    async def op_leaderboard():
+        await main.slash_leaderboard.callback(FakeInteraction(pick_user(), guild, rng.choice(channels)))
+
+    async def op_business_claim():
+        await main.business_claim.callback(FakeInteraction(pick_user(), guild, rng.choice(channels)))
+
+    async def op_text_bridge():
+        content = rng.choice([f"{PREFIX}bal", f"{PREFIX}work", f"{PREFIX}deposit 10", "just chatting", "hello there"])
+        await main.on_message(FakeMessage(content, pick_user(), guild, rng.choice(channels)))
+
+    ops = {
+        "work": (op_work, 30),
+        "transfer": (op_transfer, 25),
+        "leaderboard": (op_leaderboard, 10),
+        "business_claim": (op_business_claim, 10),
+        "on_message": (op_text_bridge, 25),
+    }
+    names = list(ops)
+    weights = [ops[n][1] for n in names]
+    plan = rng.choices(names, weights=weights, k=n_ops)
+    latencies = {n: [] for n in names}
+
+    stop = threading.Event()
+    lags: list = []
+    ticker = threading.Thread(target=lag_ticker, args=(asyncio.get_running_loop(), stop, lags), daemon=True)
+    queue = iter(plan)
+
+    async def worker():
+        for name in queue:
+            t = time.perf_counter()
+            await ops[name][0]()
+            latencies[name].append(time.perf_counter() - t)
+            # the fake I/O never suspends; yield so the workers really interleave
+            await asyncio.sleep(0)
+
+    done = asyncio.Event()
+    windows: list = []
+    ticker.start()
+    flushing = asyncio.get_running_loop().create_task(flusher(main, flush_interval, done, windows))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await flushing
+    stop.set()
+    ticker.join()
+    await asyncio.sleep(0)   # run the last posted tick
+    # leave nothing queued on the writer for after the loop closes
+    await main.store.flush_async()
+
+    result = {"ops": n_ops, "elapsed": elapsed, "ops_per_sec": n_ops / elapsed if elapsed else 0.0, "commands": {}}
+    for name in names:
+        samples = latencies[name]
+        result["commands"][name] = {
+            "count": len(samples),
+            "p50_ms": percentile(samples, 0.5) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000,
+        }
+    all_lags = [lag for _, lag in lags]
+    result["loop_lag_max_ms"] = max(all_lags, default=0.0) * 1000
+    result["loop_lag_p99_ms"] = percentile(all_lags, 0.99) * 1000
+    # ticks posted while a flush (snapshot + off-loop write) was running
+    flush_lags = [lag for posted, lag in lags if any(a <= posted <= b for a, b in windows)]
+    durations = [b - a for a, b in windows]
+    result["flushes"] = len(windows)
+    result["flush_p50_ms"] = percentile(durations, 0.5) * 1000
+    result["flush_max_ms"] = max(durations, default=0.0) * 1000
+    result["flush_lag_p99_ms"] = percentile(flush_lags, 0.99) * 1000
+    result["flush_lag_max_ms"] = max(flush_lags, default=0.0) * 1000
+    result["outbound"] = main.outbound.stats()
+    return result
+
+
+def run_child(args):
+    workdir = tempfile.mkdtemp(prefix="vrtex-bench-")
+    try:
+        build_dataset(workdir, args.users[0], seed=args.seed)
+        os.chdir(workdir)
+        os.environ["STORAGE_BACKEND"] = args.backend[0]
+        sys.path.insert(0, HERE)
+        if args.backend[0] == "sqlite":
+            import storage
+            db = storage.SqliteBackend("vrtex.db")
+            storage.import_json(db, {"users": "users.json", "servers": "servers.json", "economy": "economy.json"})
+            db.close()
+        t = time.perf_counter()
+        import main
+        main.prepare_state()   # what setup_hook does before the gateway connects
+        startup = time.perf_counter() - t
+        result = asyncio.run(drive(main, args.users[0], args.ops, args.concurrency, args.seed,
+                                   args.flush_interval))
+        result["startup_s"] = startup
+        result["backend"] = args.backend[0]
+        result["users"] = args.users[0]
+        # drain every writer while still inside the temp dir: paths are relative
+        main.ledger.close()
+        main.backend.close()
+        main.store.close()
+        print(json.dumps(result))
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# -----------------------------
+# Parent: fan out over backends and dataset sizes
+# -----------------------------
+def report(r: dict):
+    print(f"\n== backend={r['backend']} users={r['users']:,} ops={r['ops']:,} ==")
+    print(f"startup {r['startup_s']:.2f}s  throughput {r['ops_per_sec']:,.0f} ops/s  "
+          f"loop lag p99 {r['loop_lag_p99_ms']:.1f}ms  max {r['loop_lag_max_ms']:.1f}ms")
+    print(f"{r['flushes']} flushes  p50 {r['flush_p50_ms']:.1f}ms  max {r['flush_max_ms']:.1f}ms  "
+          f"loop lag during flushes p99 {r['flush_lag_p99_ms']:.1f}ms  max {r['flush_lag_max_ms']:.1f}ms")
+    print(f"{'command':<16}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, c in r["commands"].items():
+        print(f"{name:<16}{c['count']:>8}{c['p50_ms']:>10.3f}{c['p99_ms']:>10.3f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="VRTEX command handler benchmark")
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--ops", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--backend", nargs="+", default=["json", "sqlite"], choices=["json", "sqlite"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--flush-interval", type=float, default=0.5, help="seconds between store flushes")
+    parser.add_argument("--json", action="store_true", help="print raw JSON results")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    for n_users in args.users:
+        for backend in args.backend:
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", "--users", str(n_users),
+                   "--ops", str(args.ops), "--concurrency", str(args.concurrency),
+                   "--backend", backend, "--seed", str(args.seed), "--flush-interval", str(args.flush_interval)]
+            out = subprocess.run(cmd, capture_output=True, text=True)
+            lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+            if out.returncode != 0 or not lines:
+                print(f"\n== backend={backend} users={n_users:,} FAILED ==\n{out.stderr.strip()}")
+                continue
+            result = json.loads(lines[-1])
+            if args.json:
+                print(json.dumps(result))
+            else:
+                report(result)
+
+
+if __name__ == "__main__":
+    main_cli()
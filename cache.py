@@ -0,0 +1,102 @@
+# cache.py
+# Small in-process caches.
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Dict-backed cache whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+
+    def get(self, key, default=None):
+        hit = self._data.get(key)
+        if hit is None:
+            return default
+        if hit[0] < time.monotonic():
+            del self._data[key]
+            return default
+        return hit[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key, default=None):
+        hit = self._data.pop(key, None)
+        return default if hit is None else hit[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LRUCache:
+    """Bounded cache that evicts the least recently used entry.
+
+    With a `ttl`, entries also expire that many seconds after being set.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        hit = self._data.get(key)
+        if hit is None or (self.ttl is not None and hit[0] < time.monotonic()):
+            if hit is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return hit[1]
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        hit = self._data.pop(key, None)
+        return default if hit is None else hit[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GuildSettings:
+    """Resolved per-guild settings; premium expiry is kept as an epoch timestamp."""
+    __slots__ = ("currency_name", "currency_symbol", "prefix", "premium_expires", "cooldown_multiplier",
+                 "disabled", "version")
+
+    def __init__(self, currency_name: str, currency_symbol: str, prefix: Optional[str],
+                 premium_expires: float, cooldown_multiplier: float, disabled: FrozenSet[str], version: int):
+        self.currency_name = currency_name
+        self.currency_symbol = currency_symbol
+        self.prefix = prefix
+        self.premium_expires = premium_expires
+        self.cooldown_multiplier = cooldown_multiplier
+        self.disabled = disabled   # disabled command names (root or qualified)
+        self.version = version
+
+    @property
+    def has_premium(self) -> bool:
+        return self.premium_expires > time.time()
+
+    @property
+    def active_prefix(self) -> Optional[str]:
+        # custom text prefix only counts while premium is active
+        return self.prefix if self.has_premium else None
@@ -0,0 +1,65 @@
+# cooldowns.py
+# Per-(user, guild, action) cooldowns.
+#
+# A cooldown is an epoch-seconds deadline kept on the user record under
+# "<action>" (global actions) or "<action>:<guild id>". Records are resident,
+# so "ready / time remaining" is a dict lookup and a compare with no parsing.
+# The deadline is fixed when the cooldown starts:
+#
+#   duration = base[action] * guild multiplier * (premium multiplier if premium)
+#
+# and the write-back store persists it with the rest of the record. Expired
+# entries are dropped by prune(), driven by the maintenance scheduler.
+import sys
+import time
+from typing import Dict, Optional
+
+from records import UserRecord
+
+
+class Cooldowns:
+    def __init__(self, durations: Dict[str, float], premium_multiplier: float = 0.8):
+        self.durations = dict(durations)   # action -> base seconds
+        self.premium_multiplier = premium_multiplier
+        self._keys: Dict[tuple, str] = {}   # (action, guild id) -> interned record key
+
+    def key(self, action: str, guild_id=None) -> str:
+        k = self._keys.get((action, guild_id))
+        if k is None:
+            k = self._keys[(action, guild_id)] = sys.intern(action if guild_id is None else f"{action}:{guild_id}")
+        return k
+
+    def duration(self, action: str, guild_multiplier: float = 1.0, premium: bool = False) -> int:
+        seconds = self.durations[action] * guild_multiplier
+        if premium:
+            seconds *= self.premium_multiplier
+        return int(seconds)
+
+    def remaining(self, record: UserRecord, action: str, guild_id=None, now: Optional[float] = None) -> int:
+        """Seconds until `action` is ready again (0 when ready)."""
+        deadline = record.cooldowns.get(self.key(action, guild_id))
+        if deadline is None:
+            return 0
+        now = time.time() if now is None else now
+        return max(0, int(deadline - now))
+
+    def start(self, record: UserRecord, action: str, guild_id=None, *, guild_multiplier: float = 1.0,
+              premium: bool = False, now: Optional[float] = None) -> int:
+        """Start the cooldown for `action`; returns its deadline."""
+        now = time.time() if now is None else now
+        deadline = int(now) + self.duration(action, guild_multiplier, premium)
+        record.cooldowns[self.key(action, guild_id)] = deadline
+        return deadline
+
+    @staticmethod
+    def next_expiry(record: UserRecord) -> Optional[int]:
+        return min(record.cooldowns.values()) if record.cooldowns else None
+
+    @staticmethod
+    def prune(record: UserRecord, now: Optional[float] = None) -> int:
+        """Drop expired deadlines; returns how many were removed."""
+        now = time.time() if now is None else now
+        expired = [k for k, deadline in record.cooldowns.items() if deadline <= now]
+        for k in expired:
+            del record.cooldowns[k]
+        return len(expired)
@@ -0,0 +1,102 @@
+# launcher.py
+# Run the bot as several shard processes sharing one SQLite database.
+#
+# The shards are split into contiguous ranges, one per process. Each child
+# runs main.py with SHARD_COUNT / SHARD_IDS set, STORAGE_BACKEND=sqlite and
+# its own HTTP port (PORT + index). Children that exit are restarted with a
+# backoff.
+#
+#   python launcher.py --shards 16 --processes 4
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def shard_ranges(shards: int, processes: int) -> List[List[int]]:
+    processes = max(1, min(processes, shards))
+    per, extra = divmod(shards, processes)
+    out, start = [], 0
+    for i in range(processes):
+        size = per + (1 if i < extra else 0)
+        out.append(list(range(start, start + size)))
+        start += size
+    return out
+
+
+class Child:
+    def __init__(self, index: int, shard_ids: List[int], env: dict):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.env = env
+        self.proc = None
+        self.backoff = 1.0
+        self.started = 0.0
+
+    def start(self):
+        self.started = time.monotonic()
+        self.proc = subprocess.Popen([sys.executable, os.path.join(HERE, "main.py")], env=self.env)
+        print(f"[LAUNCHER] process {self.index} shards {self.shard_ids[0]}-{self.shard_ids[-1]} pid {self.proc.pid}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Run VRTEX as multiple shard processes")
+    parser.add_argument("--shards", type=int, required=True, help="total shard count")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--db", default=os.getenv("SQLITE_PATH", "vrtex.db"))
+    parser.add_argument("--base-port", type=int, default=int(os.getenv("PORT", "8080")))
+    args = parser.parse_args()
+
+    # create the schema once up front rather than racing on it from every child
+    sys.path.insert(0, HERE)
+    from storage import SqliteBackend
+    SqliteBackend(args.db).close()
+
+    children = []
+    for i, ids in enumerate(shard_ranges(args.shards, args.processes)):
+        env = dict(os.environ, SHARD_COUNT=str(args.shards), SHARD_IDS=f"{ids[0]}-{ids[-1]}",
+                   STORAGE_BACKEND="sqlite", SQLITE_PATH=args.db, PORT=str(args.base_port + i))
+        child = Child(i, ids, env)
+        child.start()
+        children.append(child)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for c in children:
+            if c.proc and c.proc.poll() is None:
+                c.proc.send_signal(signal.SIGINT)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping:
+        time.sleep(1.0)
+        for c in children:
+            code = c.proc.poll()
+            if code is None or stopping:
+                continue
+            # a child that stayed up for a while gets a fresh backoff
+            if time.monotonic() - c.started > 60:
+                c.backoff = 1.0
+            print(f"[LAUNCHER] process {c.index} exited with {code}; restarting in {c.backoff:.0f}s")
+            time.sleep(c.backoff)
+            c.backoff = min(c.backoff * 2, 60.0)
+            c.start()
+
+    for c in children:
+        try:
+            c.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            c.proc.kill()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,200 @@
+# leaderboard.py
+# Incrementally maintained wealth ranking.
+#
+# RankIndex keeps (-total, user_id) keys in a list of sorted buckets, with a
+# Fenwick tree over the bucket sizes. Updates, top-N pages and "my rank" are
+# all O(log n) (plus a bounded memmove inside one bucket), so nothing ever
+# rescans or resorts the whole user table.
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+Entry = Tuple[str, int]   # (user_id, wallet + bank)
+
+
+class RankIndex:
+    LOAD = 512   # target bucket size; buckets split at 2 * LOAD
+
+    def __init__(self, items: Iterable[Entry] = ()):
+        self._scores: Dict[str, int] = dict(items)
+        keys = sorted((-total, uid) for uid, total in self._scores.items())
+        self._buckets: List[List[tuple]] = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes: List[tuple] = [b[-1] for b in self._buckets]
+        self._rebuild_tree()
+
+    # Fenwick tree over bucket lengths
+    def _rebuild_tree(self):
+        tree = [len(b) for b in self._buckets]
+        for i in range(len(tree)):
+            j = i | (i + 1)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, i: int, delta: int):
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i |= i + 1
+
+    def _prefix(self, i: int) -> int:
+        # number of entries in buckets [0, i)
+        total = 0
+        while i > 0:
+            total += self._tree[i - 1]
+            i &= i - 1
+        return total
+
+    def _locate(self, pos: int) -> Tuple[int, int]:
+        # (bucket, offset) of the entry at 0-based position `pos`
+        tree = self._tree
+        i = 0
+        step = 1 << len(tree).bit_length()
+        while step:
+            j = i + step
+            if j <= len(tree) and tree[j - 1] <= pos:
+                pos -= tree[j - 1]
+                i = j
+            step >>= 1
+        return i, pos
+
+    def _insert(self, key: tuple):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            bucket = self._buckets[i]
+            bucket.append(key)
+            self._maxes[i] = key
+        else:
+            bucket = self._buckets[i]
+            insort(bucket, key)
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[i:i + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[i:i + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def _remove(self, key: tuple):
+        i = bisect_left(self._maxes, key)
+        bucket = self._buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+            self._rebuild_tree()
+
+    def update(self, user_id: str, total: int):
+        old = self._scores.get(user_id)
+        if old == total:
+            return
+        if old is not None:
+            self._remove((-old, user_id))
+        self._scores[user_id] = total
+        self._insert((-total, user_id))
+
+    def discard(self, user_id: str):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._remove((-old, user_id))
+
+    def score(self, user_id: str) -> Optional[int]:
+        return self._scores.get(user_id)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """1-based position of `user_id`, or None if unranked."""
+        total = self._scores.get(user_id)
+        if total is None:
+            return None
+        key = (-total, user_id)
+        i = bisect_left(self._maxes, key)
+        return self._prefix(i) + bisect_left(self._buckets[i], key) + 1
+
+    def page(self, offset: int, limit: int) -> List[Entry]:
+        out: List[Entry] = []
+        if offset >= len(self._scores) or limit <= 0:
+            return out
+        i, j = self._locate(offset)
+        while i < len(self._buckets) and len(out) < limit:
+            for neg, uid in self._buckets[i][j:j + limit - len(out)]:
+                out.append((uid, -neg))
+            i, j = i + 1, 0
+        return out
+
+    def top(self, limit: int) -> List[Entry]:
+        return self.page(0, limit)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+
+class LeaderboardIndex:
+    """Global ranking plus per-guild rankings built from guild member sets."""
+
+    def __init__(self):
+        self.loaded = False
+        self.ranking = RankIndex()
+        self._guilds: Dict[str, RankIndex] = {}
+        self._member_of: Dict[str, Set[str]] = {}   # user_id -> guild ids with a built index
+
+    def load(self, balances: Iterable[Entry]):
+        self.ranking = RankIndex(balances)
+        self._guilds.clear()
+        self._member_of.clear()
+        self.loaded = True
+
+    def update(self, user_id: str, total: int):
+        self.ranking.update(user_id, total)
+        for gid in self._member_of.get(user_id, ()):
+            self._guilds[gid].update(user_id, total)
+
+    def guild(self, guild_id: str) -> Optional[RankIndex]:
+        return self._guilds.get(guild_id)
+
+    def build_guild(self, guild_id: str, member_ids: Iterable[str]) -> RankIndex:
+        self.drop_guild(guild_id)
+        members = list(member_ids)
+        for uid in members:
+            self._member_of.setdefault(uid, set()).add(guild_id)
+        scores = self.ranking._scores
+        idx = self._guilds[guild_id] = RankIndex((uid, scores[uid]) for uid in members if uid in scores)
+        return idx
+
+    def add_member(self, guild_id: str, user_id: str):
+        idx = self._guilds.get(guild_id)
+        if idx is None:
+            return
+        self._member_of.setdefault(user_id, set()).add(guild_id)
+        total = self.ranking.score(user_id)
+        if total is not None:
+            idx.update(user_id, total)
+
+    def remove_member(self, guild_id: str, user_id: str):
+        idx = self._guilds.get(guild_id)
+        if idx is None:
+            return
+        idx.discard(user_id)
+        gids = self._member_of.get(user_id)
+        if gids:
+            gids.discard(guild_id)
+            if not gids:
+                del self._member_of[user_id]
+
+    def drop_guild(self, guild_id: str):
+        idx = self._guilds.pop(guild_id, None)
+        if idx is None:
+            return
+        for uid, gids in list(self._member_of.items()):
+            gids.discard(guild_id)
+            if not gids:
+                del self._member_of[uid]
@@ -0,0 +1,179 @@
+# ledger.py
+# Append-only commit log with periodic checkpoints.
+#
+# Every committed user transaction appends one JSON line to
+# ledger/ledger.jsonl holding the full state it committed:
+#     {"seq": n, "ts": t, "reason": r,
+#      "users": {user_id: record dict}, "orders": {order_id: row or null},
+#      "delta": {user_id: [wallet delta, bank delta]}}
+# "delta" is only there for the audit trail. A checkpoint
+# (ledger/checkpoint.json) records that the write-back documents were durable
+# as of some seq; it is written after a flush that started with no
+# transaction in flight, and the live log is then rotated into
+# ledger/ledger-<seq>.jsonl, which stays on disk as the audit trail. On
+# startup every entry after the checkpoint is replayed. Entries carry whole
+# records, so replay restores cooldowns, items, businesses and market escrow
+# along with balances, and replaying an entry twice is harmless.
+#
+# When several shard processes share one SQLite database the database is the
+# source of truth: each process keeps its own ledger directory as an audit
+# trail only (resume() + rotate(), no checkpoints or replay).
+import glob
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from persistence import atomic_write_json
+
+Users = Dict[str, dict]              # user_id -> record dict
+Orders = Dict[str, Optional[list]]   # order id -> order row, None once gone
+
+
+class Ledger:
+    def __init__(self, directory: str = "ledger"):
+        self.directory = directory
+        self.checkpoint_path = os.path.join(directory, "checkpoint.json")
+        self.log_path = os.path.join(directory, "ledger.jsonl")
+        self.seq = 0
+        self.checkpoint_seq = 0
+        self._log = None
+
+    # -----------------------------
+    # Recovery
+    # -----------------------------
+    def _segments(self) -> List[Tuple[int, str]]:
+        out = []
+        for path in glob.glob(os.path.join(self.directory, "ledger-*.jsonl")):
+            try:
+                out.append((int(os.path.basename(path)[7:-6]), path))
+            except ValueError:
+                continue
+        return sorted(out)
+
+    def _replay(self, path: str, users: Users, orders: Orders, after: int) -> int:
+        """Fold the entries after seq `after` into users / orders; returns the intact length of the file."""
+        intact = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break   # torn final line from a crash mid-append
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                intact += len(line)
+                if isinstance(entry, list):
+                    # balance-only line from before full-state logging: seq only
+                    self.seq = max(self.seq, entry[0])
+                    continue
+                seq = entry["seq"]
+                self.seq = max(self.seq, seq)
+                if seq <= after:
+                    continue
+                users.update(entry.get("users") or ())
+                orders.update(entry.get("orders") or ())
+        return intact
+
+    def _replay_log(self, users: Users, orders: Orders, after: int):
+        if not os.path.exists(self.log_path):
+            return
+        intact = self._replay(self.log_path, users, orders, after)
+        if os.path.getsize(self.log_path) > intact:
+            # cut the torn tail, or the next append would be glued onto it
+            # and lost along with it on the following recovery
+            os.truncate(self.log_path, intact)
+
+    def recover(self) -> Optional[Tuple[Users, Orders]]:
+        """State committed after the last checkpoint, or None if there is no checkpoint yet."""
+        os.makedirs(self.directory, exist_ok=True)
+        users: Users = {}
+        orders: Orders = {}
+        checkpoint = None
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            self.seq = self.checkpoint_seq = checkpoint["seq"]
+        # segments rotated after the checkpoint was taken still need replaying
+        for last_seq, path in self._segments():
+            if checkpoint is None:
+                self.seq = max(self.seq, last_seq)
+            elif last_seq > self.checkpoint_seq:
+                self._replay(path, users, orders, self.checkpoint_seq)
+        self._replay_log(users, orders, self.checkpoint_seq)
+        self._open()
+        if checkpoint is None:
+            return None
+        return users, orders
+
+    def resume(self):
+        """Open the log for appending without replaying it (audit-only mode)."""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        if segments:
+            self.seq = segments[-1][0]
+        self._replay_log({}, {}, self.seq)
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    # -----------------------------
+    # Appends
+    # -----------------------------
+    def commit(self, users: Dict[str, tuple], orders: Orders, reason: str):
+        """Log one committed transaction.
+
+        `users` maps user_id -> (record before, record after); `orders` maps
+        order id -> the order row written (None if it was deleted).
+        """
+        if not users and not orders:
+            return
+        self.seq += 1
+        entry = {"seq": self.seq, "ts": round(time.time(), 3), "reason": reason}
+        if users:
+            entry["users"] = {uid: after.to_dict() for uid, (_before, after) in users.items()}
+            delta = {uid: [after.wallet - before.wallet, after.bank - before.bank]
+                     for uid, (before, after) in users.items()
+                     if after.wallet != before.wallet or after.bank != before.bank}
+            if delta:
+                entry["delta"] = delta
+        if orders:
+            entry["orders"] = {str(oid): row for oid, row in orders.items()}
+        self._log.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+        self._log.write("\n")
+        # hand the bytes to the OS right away; fsync happens in flush()
+        self._log.flush()
+
+    def flush(self):
+        if self._log:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    # -----------------------------
+    # Checkpoints
+    # -----------------------------
+    def rotate(self):
+        """Move the live log into a segment (kept as the audit trail)."""
+        self.flush()
+        self._log.close()
+        if os.path.getsize(self.log_path):
+            os.replace(self.log_path, os.path.join(self.directory, f"ledger-{self.seq}.jsonl"))
+        self._open()
+
+    def checkpoint(self, seq: int):
+        """Record that every entry up to `seq` is in the durable documents.
+
+        The caller must have written the documents from a state that contained
+        exactly the transactions logged up to `seq` (see main.checkpoint_ledger).
+        """
+        self.rotate()
+        atomic_write_json(self.checkpoint_path, {"seq": seq, "ts": int(time.time())})
+        self.checkpoint_seq = seq
+
+    def close(self):
+        if self._log:
+            self.flush()
+            self._log.close()
+            self._log = None
@@ -0,0 +1,114 @@
+# locks.py
+# Per-key asyncio locks, and a gate for stopping all of them at once.
+#
+# Locks are created on first use and dropped again once nobody holds or waits
+# for them, so the table only ever contains keys that are currently busy.
+# Several keys are always acquired in sorted order, which rules out deadlocks
+# between overlapping multi-key holders (e.g. A->B and B->A transfers).
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Hashable, Optional
+
+
+class KeyedLocks:
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._refs: Dict[Hashable, int] = {}
+
+    def _checkout(self, key) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return lock
+
+    def _checkin(self, key):
+        refs = self._refs[key] - 1
+        if refs:
+            self._refs[key] = refs
+        else:
+            del self._refs[key]
+            del self._locks[key]
+
+    def locked(self, key) -> bool:
+        lock = self._locks.get(key)
+        return bool(lock and lock.locked())
+
+    @asynccontextmanager
+    async def hold(self, *keys):
+        ordered = sorted(set(keys))
+        held = []
+        try:
+            for key in ordered:
+                lock = self._checkout(key)
+                try:
+                    await lock.acquire()
+                except BaseException:
+                    self._checkin(key)
+                    raise
+                held.append(key)
+            yield
+        finally:
+            for key in reversed(held):
+                self._locks[key].release()
+                self._checkin(key)
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class TxnGate:
+    """Lets any number of transactions run, or quiesces them all for one task.
+
+    Transactions enter through shared(); exclusive() waits until none is in
+    flight and keeps new ones out until it exits. A waiting exclusive holder
+    closes the gate straight away, so a steady stream of transactions can't
+    starve it. shared() is re-entrant within a task, so a transaction nested
+    in another never waits on a gate its outer one is holding open.
+    """
+
+    def __init__(self):
+        self._active = 0
+        self._closed: Optional[asyncio.Future] = None   # set while exclusive() is waiting or held
+        self._idle: Optional[asyncio.Future] = None
+        self._holder = ContextVar(f"txn_gate_{id(self)}", default=None)   # task inside shared()
+
+    async def _wait_open(self):
+        while self._closed is not None:
+            await asyncio.shield(self._closed)
+
+    @asynccontextmanager
+    async def shared(self):
+        task = asyncio.current_task()
+        if self._holder.get() is task:
+            yield
+            return
+        await self._wait_open()
+        self._active += 1
+        token = self._holder.set(task)
+        try:
+            yield
+        finally:
+            self._holder.reset(token)
+            self._active -= 1
+            if not self._active and self._idle is not None and not self._idle.done():
+                self._idle.set_result(None)
+
+    @asynccontextmanager
+    async def exclusive(self):
+        await self._wait_open()
+        loop = asyncio.get_running_loop()
+        self._closed = loop.create_future()
+        try:
+            if self._active:
+                self._idle = loop.create_future()
+                await self._idle
+            yield
+        finally:
+            self._idle = None
+            closed, self._closed = self._closed, None
+            closed.set_result(None)
+
+    def __len__(self):
+        return self._active
@@ -1,8 +1,18 @@
 # main.py
-from web_server import keep_alive
-
-# start keep-alive server
-keep_alive()
+from web_server import EconomyAPI, create_app, start_web_server
+from store import DocumentStore
+from persistence import STORAGE_LATENCY
+from storage import open_backend
+from records import UserRecord
+from market import ASK, BID, Market, Order
+from locks import KeyedLocks, TxnGate
+from leaderboard import LeaderboardIndex
+from ledger import Ledger
+from cache import LRUCache, TTLCache, GuildSettings
+from outbound import SendScheduler
+from scheduler import ExpiryScheduler
+from cooldowns import Cooldowns
+from metrics import REGISTRY
 
 import discord
 from discord.ext import commands, tasks
@@ -12,7 +22,15 @@ import os
 import json
 import datetime
 import random
+import re
 import asyncio
+import functools
+import gc
+import hashlib
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import Optional, List, Dict
 
 # -----------------------------
@@ -22,9 +40,86 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 TEAM_IDS = [int(x) for x in os.getenv("TEAM_IDS", "").split(",") if x.strip().isdigit()]
 TOPGG_LINK = os.getenv("TOPGG_LINK", "")
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", "30"))   # seconds between write-backs
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")   # json | sqlite
+SQLITE_PATH = os.getenv("SQLITE_PATH", "vrtex.db")
+LEDGER_DIR = os.getenv("LEDGER_DIR", "ledger")
+LEDGER_COMPACT_MINUTES = float(os.getenv("LEDGER_COMPACT_MINUTES", "15"))
+BUSINESS_PERIOD = float(os.getenv("BUSINESS_PERIOD", "3600"))   # seconds per business payout period
+BUSINESS_MAX_PERIODS = int(os.getenv("BUSINESS_MAX_PERIODS", "24"))  # unclaimed periods that accrue before income stops
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "15"))  # seconds between maintenance passes
+MAINTENANCE_BATCH = int(os.getenv("MAINTENANCE_BATCH", "500"))  # expirations handled per pass
+PREMIUM_KEY_TTL = float(os.getenv("PREMIUM_KEY_TTL_DAYS", "7")) * 86400  # unused activation keys expire after this
+DEFER_AFTER = float(os.getenv("DEFER_AFTER", "1.5"))   # seconds before an unanswered interaction is deferred (Discord allows 3)
+LEAN_INTENTS = os.getenv("LEAN_INTENTS", "0") == "1"   # skip the members/presences intents and member cache
+NAME_CACHE_SIZE = int(os.getenv("NAME_CACHE_SIZE", "50000"))   # (guild, user) display names kept
+NAME_CACHE_TTL = float(os.getenv("NAME_CACHE_TTL", "3600"))   # seconds before a cached display name is refetched
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))   # rendered list embeds kept
+GUILD_CACHE_TTL = float(os.getenv("GUILD_CACHE_TTL", "300"))   # seconds a resolved guild settings entry stays fresh
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # seconds between event-loop lag samples
+LOOP_LAG_UNHEALTHY = float(os.getenv("LOOP_LAG_UNHEALTHY", "1.0"))  # lag above this fails /healthz
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")   # enables /admin/* endpoints when set
+
+def parse_shard_ids(spec: str) -> Optional[List[int]]:
+    """"0-3,8" -> [0, 1, 2, 3, 8]; empty -> None."""
+    ids = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        ids.update(range(int(lo), int(hi or lo) + 1))
+    return sorted(ids) or None
+
+# SHARD_COUNT alone: one process runs every shard. SHARD_IDS as well: this
+# process runs only those shards and shares state with the other processes
+# through the SQLite database (see launcher.py).
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS", ""))
+SHARED_STATE = SHARD_IDS is not None
+if SHARED_STATE and not SHARD_COUNT:
+    raise RuntimeError("SHARD_IDS requires SHARD_COUNT")
+if SHARED_STATE and STORAGE_BACKEND.lower() != "sqlite":
+    raise RuntimeError("multi-process sharding needs STORAGE_BACKEND=sqlite for shared state")
+
+# -----------------------------
+# Metrics
+# -----------------------------
+COMMAND_CALLS = REGISTRY.counter("vrtex_commands_total", "Command invocations", ("command", "source", "outcome"))
+COMMAND_LATENCY = REGISTRY.histogram("vrtex_command_seconds", "Command handler latency", ("command", "source"))
+LOOP_LAG = REGISTRY.gauge("vrtex_event_loop_lag_seconds", "Most recent event-loop lag sample")
+LOOP_LAG_HIST = REGISTRY.histogram("vrtex_event_loop_lag_hist_seconds", "Event-loop lag samples")
+COMMAND_DEFERRED = REGISTRY.counter("vrtex_commands_deferred_total", "Interactions deferred by the response guard", ("command", "reason"))
+MAINTENANCE_JOBS = REGISTRY.counter("vrtex_maintenance_jobs_total", "Expirations handled by the maintenance loop", ("kind",))
+
+class EconomyTree(app_commands.CommandTree):
+    """Command tree that refuses commands a server has disabled."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.guild is None or interaction.type is not discord.InteractionType.application_command:
+            return True
+        command = interaction.command
+        if command is None or not command_disabled(interaction.guild.id, command.qualified_name):
+            return True
+        await interaction.response.send_message(f"⚠️ The command `{command.qualified_name}` is currently disabled on this server.", ephemeral=True)
+        return False
 
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents, case_insensitive=True)  # text commands mostly handled manually
+if LEAN_INTENTS:
+    # no member list or presences: names come from the display-name cache instead
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.message_content = True   # text-prefix bridge
+    bot_options = dict(member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False)
+else:
+    intents = discord.Intents.all()
+    bot_options = {}
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, case_insensitive=True, tree_cls=EconomyTree,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **bot_options)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, case_insensitive=True, tree_cls=EconomyTree, **bot_options)  # text commands mostly handled manually
 tree = bot.tree
 
 # -----------------------------
@@ -38,7 +133,8 @@ FILES = {
     "jobs": "jobs.json",
     "market": "market.json",
     "quests": "quests.json",
-    "economy": "economy.json"
+    "economy": "economy.json",
+    "meta": "meta.json"
 }
 
 for fname in FILES.values():
@@ -46,130 +142,333 @@ for fname in FILES.values():
         with open(fname, "w", encoding="utf-8") as f:
             json.dump({}, f)
 
-def load_json(file_key: str) -> dict:
-    path = FILES[file_key]
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                return data
-            with open(path, "w", encoding="utf-8") as fw:
-                json.dump({}, fw)
-            return {}
-    except Exception:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({}, f)
-        return {}
+# documents are parsed once and served from memory and written back by
+# flush_store and ledger checkpoints. "users" holds records that are only ever
+# replaced (see user_txn), so a flush re-encodes just the records that changed
+store = DocumentStore(FILES, flush_interval=STORE_FLUSH_INTERVAL, flat_docs=("users",))
 
-def save_json(file_key: str, data: dict):
-    path = FILES[file_key]
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
+# users / servers / economy live behind the configured backend
+backend = open_backend(STORAGE_BACKEND, store, SQLITE_PATH)
+
+@tasks.loop(seconds=STORE_FLUSH_INTERVAL)
+async def flush_store():
+    ledger.flush()
+    if store.dirty:
+        with STORAGE_LATENCY.time(op="flush", doc="*"):
+            await store.flush_async()
+
+# -----------------------------
+# Commit ledger (append-only log of committed state + crash recovery)
+# -----------------------------
+if SHARED_STATE:
+    # one audit log per process; the shared database is the source of truth
+    ledger = Ledger(os.path.join(LEDGER_DIR, f"shards-{SHARD_IDS[0]}-{SHARD_IDS[-1]}"))
+else:
+    ledger = Ledger(LEDGER_DIR)
+
+# documents holding state the ledger logs; a checkpoint writes them out
+LEDGER_DOCS = ("users", "market")
+
+def recover_ledger():
+    if SHARED_STATE:
+        # replaying one process's log over the shared database would undo the others' writes
+        ledger.resume()
+        return
+    # committed state from the log wins over a write-back that never reached disk
+    state = ledger.recover()
+    if state is None:
+        # first run with a ledger: the documents as loaded are the baseline
+        ledger.checkpoint(ledger.seq)
+        return
+    users, orders = state
+    fixed = 0
+    for uid, data in users.items():
+        record = UserRecord.from_dict(data)
+        if backend.get_user(uid) != record:
+            backend.put_user(uid, record)
+            fixed += 1
+    for order_id, row in orders.items():
+        backend.restore_order(int(order_id), row)
+    if fixed or orders:
+        print(f"💾 Ledger replay restored {fixed} user record(s) and {len(orders)} market order(s)")
+
+async def checkpoint_ledger():
+    # the flush snapshot must hold exactly the transactions logged up to `seq`,
+    # so take it with the gate closed; the writes themselves run with it open
+    async with txn_gate.exclusive():
+        seq = ledger.seq
+        ledger.flush()
+        written = store.flush_async(also=LEDGER_DOCS)
+    with STORAGE_LATENCY.time(op="flush", doc="*"):
+        ok = await written
+    if ok:
+        ledger.checkpoint(seq)
+
+@tasks.loop(minutes=LEDGER_COMPACT_MINUTES)
+async def compact_ledger():
+    if SHARED_STATE:
+        ledger.rotate()
+        return
+    await checkpoint_ledger()
 
 # -----------------------------
 # User helpers
 # -----------------------------
-async def get_user(user_id: int) -> dict:
-    users = load_json("users")
+async def get_user(user_id: int) -> UserRecord:
     sid = str(user_id)
-    if sid not in users:
-        users[sid] = {
-            "wallet": 0,
-            "bank": 0,
-            "daily_claimed": None,
-            "work_claims": {},   # per-guild last work timestamp ISO
-            "membership": False,
-            "xp": 0,
-            "level": 1,
-            "job": None,
-            "job_streak": 0,
-            "items": {},
-            "businesses": {}
-        }
-        save_json("users", users)
-    return users[sid]
+    user = backend.get_user(sid)
+    if user is None:
+        user = backend.create_user(sid)
+        track_balance(sid, user)
+    return user
 
-async def update_user(user_id: int, data: dict):
-    users = load_json("users")
+async def update_user(user_id: int, user: UserRecord):
     sid = str(user_id)
-    if sid not in users:
-        users[sid] = {}
-    users[sid].update(data)
-    save_json("users", users)
+    backend.put_user(sid, user)
+    track_balance(sid, user)
+
+# -----------------------------
+# Leaderboard index (kept in step with every user write)
+# -----------------------------
+leaderboard = LeaderboardIndex()
+
+def get_leaderboard() -> LeaderboardIndex:
+    if not leaderboard.loaded:
+        leaderboard.load(backend.iter_balances())
+    return leaderboard
+
+def track_balance(sid: str, user: UserRecord):
+    if leaderboard.loaded:
+        leaderboard.update(sid, user.total)
+
+def global_ranking():
+    # with shared state other processes write too, so rank straight off the database index
+    if SHARED_STATE:
+        return backend.ranking()
+    return get_leaderboard().ranking
+
+def guild_member_ids(guild: discord.Guild):
+    if LEAN_INTENTS:
+        return iter(seen_members.get(guild.id, ()))
+    return (str(m.id) for m in guild.members)
+
+def guild_ranking(guild: discord.Guild):
+    if SHARED_STATE:
+        return backend.ranking(guild_member_ids(guild))
+    idx = leaderboard.guild(str(guild.id))
+    if idx is None:
+        idx = get_leaderboard().build_guild(str(guild.id), guild_member_ids(guild))
+    return idx
+
+# -----------------------------
+# Display names. In lean-intents mode there is no member cache, so names
+# for leaderboard rows live in a bounded LRU cache with a TTL, filled from
+# the members we see in commands and by batched query_members fetches.
+# Server leaderboards then rank the members seen using the bot.
+# -----------------------------
+name_cache = LRUCache(NAME_CACHE_SIZE, ttl=NAME_CACHE_TTL)
+seen_members: Dict[int, set] = {}   # guild id -> user ids seen (lean mode only)
+QUERY_MEMBERS_BATCH = 100   # gateway limit per request
+
+def note_member(guild: Optional[discord.Guild], user) -> None:
+    if guild is None:
+        return
+    name_cache.set((guild.id, user.id), user.display_name)
+    if LEAN_INTENTS:
+        uid = str(user.id)
+        members = seen_members.setdefault(guild.id, set())
+        if uid not in members:
+            members.add(uid)
+            leaderboard.add_member(str(guild.id), uid)
+
+async def display_names(guild: Optional[discord.Guild], user_ids) -> Dict[str, str]:
+    """user id -> display name, falling back to "User <id>"."""
+    names: Dict[str, str] = {}
+    missing: List[int] = []
+    for uid in user_ids:
+        key = (guild.id if guild else None, int(uid))
+        name = name_cache.get(key)
+        if name is None and guild is not None:
+            member = guild.get_member(int(uid))
+            if member is not None:
+                name = member.display_name
+                name_cache.set(key, name)
+            elif LEAN_INTENTS:
+                missing.append(int(uid))
+        if name:
+            names[uid] = name
+    for i in range(0, len(missing), QUERY_MEMBERS_BATCH):
+        chunk = missing[i:i + QUERY_MEMBERS_BATCH]
+        try:
+            found = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=False)
+        except (asyncio.TimeoutError, discord.ClientException) as e:
+            print(f"[WARN] query_members failed for guild {guild.id}: {e}")
+            break
+        for member in found:
+            names[str(member.id)] = member.display_name
+            name_cache.set((guild.id, member.id), member.display_name)
+        for uid in set(chunk) - {m.id for m in found}:
+            name_cache.set((guild.id, uid), "")   # left the guild; don't ask again until the TTL runs out
+    for uid in user_ids:
+        names.setdefault(uid, f"User {uid}")
+    return names
+
+# per-user locks for read-modify-write sequences on balances
+user_locks = KeyedLocks()
+# every user_txn passes through here; a ledger checkpoint closes it briefly
+txn_gate = TxnGate()
+# order writes made inside the running user_txn, logged with its commit
+txn_orders: ContextVar[Optional[dict]] = ContextVar("txn_orders", default=None)
+
+@asynccontextmanager
+async def user_txn(*user_ids: int, reason: str = "adjust"):
+    """Lock users, yield their records and persist them when the block exits cleanly.
+
+    `async with user_txn(a) as user` yields one record; with several ids a list
+    is yielded in the order given. Locks are taken in sorted id order so
+    overlapping transactions can't deadlock. The block edits working copies:
+    on commit the changed ones replace the stored records, and an exception
+    inside the block just drops them, so a stored record is never edited in
+    place (flushes encode them off the loop). On commit the changed records,
+    and any market orders written through save_order / drop_order, are
+    appended to the ledger as one entry under `reason`. The backend
+    transaction keeps the read-modify-write atomic against other shard
+    processes sharing the database.
+    """
+    async with txn_gate.shared(), user_locks.hold(*(str(u) for u in user_ids)), backend.transaction():
+        stored = [await get_user(u) for u in user_ids]
+        users = [u.copy() for u in stored]
+        orders = {}
+        token = txn_orders.set(orders)
+        try:
+            yield users[0] if len(users) == 1 else users
+        finally:
+            txn_orders.reset(token)
+        changed = {}
+        for uid, user, before in zip(user_ids, users, stored):
+            if user != before:
+                await update_user(uid, user)
+                changed[str(uid)] = (before, user)
+        ledger.commit(changed, orders, reason)
 
 async def is_plus(user_id: int) -> bool:
     u = await get_user(user_id)
-    return u.get("membership", False)
-
-def create_user(user_id):
-    users = load_users()
-    users[user_id] = {
-        "wallet": 1000,
-        "bank": 0,
-        "inventory": []
-    }
-    save_users(users)
+    return u.membership
 
 # -----------------------------
 # Server helpers (premium, prefix, disabled commands)
 # -----------------------------
 def get_server_entry(guild_id: int) -> dict:
-    servers = load_json("servers")
-    gk = str(guild_id)
-    if gk not in servers:
-        servers[gk] = {
+    # defaults aren't stored until something is saved with save_server_entry
+    entry = backend.get_server(str(guild_id))
+    if entry is None:
+        entry = {
             "premium": None,        # { "expires": iso, "owner_id": int }
             "prefix": None,         # text prefix string when premium active
             "disabled_commands": [],# list of command names disabled on this server
             "pending_keys": {}      # key -> purchaser_id mappings for activation
         }
-        save_json("servers", servers)
-    return servers[gk]
+    return entry
 
 def save_server_entry(guild_id: int, data: dict):
-    servers = load_json("servers")
-    servers[str(guild_id)] = servers.get(str(guild_id), {})
-    servers[str(guild_id)].update(data)
-    save_json("servers", servers)
+    gk = str(guild_id)
+    entry = backend.get_server(gk)
+    if entry is None:
+        entry = {}
+    if entry is not data:
+        entry.update(data)
+    backend.put_server(gk, entry)
+    invalidate_guild(guild_id)
 
 def server_has_premium(guild_id: int) -> bool:
-    entry = get_server_entry(guild_id)
-    prem = entry.get("premium")
-    if not prem:
-        return False
-    try:
-        exp = datetime.datetime.fromisoformat(prem.get("expires"))
-        return exp > datetime.datetime.utcnow()
-    except Exception:
-        return False
+    return guild_settings(guild_id).has_premium
 
 def get_server_prefix(guild_id: int) -> Optional[str]:
-    entry = get_server_entry(guild_id)
-    if server_has_premium(guild_id):
-        return entry.get("prefix")
-    return None
+    return guild_settings(guild_id).active_prefix
+
+# commands that can't be disabled, so a server can always turn things back on
+ALWAYS_ENABLED = frozenset({"help", "settings", "settings_toggle"})
+
+def command_disabled(guild_id: int, qualified_name: str) -> bool:
+    """True if the command, or the group it belongs to, is disabled in the guild."""
+    disabled = guild_settings(guild_id).disabled
+    if not disabled:
+        return False
+    root = qualified_name.split(" ", 1)[0]
+    return root not in ALWAYS_ENABLED and (root in disabled or qualified_name in disabled)
 
 # -----------------------------
 # Economy helpers
 # -----------------------------
+ECONOMY_DEFAULTS = {
+    "currency_name": "Coins",
+    "currency_symbol": "$",
+    "starting_balance": 0,
+    "tax_rate": 0
+}
+
 def get_guild_economy(guild_id: int) -> dict:
-    econ = load_json("economy")
-    gid = str(guild_id)
-    if gid not in econ:
-        econ[gid] = {
-            "currency_name": "Coins",
-            "currency_symbol": "$",
-            "starting_balance": 0,
-            "tax_rate": 0
-        }
-        save_json("economy", econ)
-    return econ[gid]
+    # defaults aren't stored until something is saved with set_guild_economy
+    econ = backend.get_economy(str(guild_id))
+    if econ is None:
+        econ = dict(ECONOMY_DEFAULTS)
+    return econ
 
 def set_guild_economy(guild_id: int, data: dict):
-    econ = load_json("economy")
-    econ[str(guild_id)] = econ.get(str(guild_id), {})
-    econ[str(guild_id)].update(data)
-    save_json("economy", econ)
+    gid = str(guild_id)
+    econ = backend.get_economy(gid)
+    if econ is None:
+        econ = dict(ECONOMY_DEFAULTS)
+    if econ is not data:
+        econ.update(data)
+    backend.put_economy(gid, econ)
+    invalidate_guild(guild_id)
+
+# -----------------------------
+# Guild settings cache (currency, prefix, premium expiry)
+# -----------------------------
+guild_cache = TTLCache(GUILD_CACHE_TTL)
+guild_versions: Dict[str, int] = {}   # bumped on every invalidation
+
+def iso_ts(value) -> float:
+    # stored timestamps are naive UTC ISO strings; unreadable ones count as long past
+    try:
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp()
+    except Exception:
+        return 0.0
+
+def premium_expiry_ts(entry: dict) -> float:
+    prem = entry.get("premium")
+    if not prem:
+        return 0.0
+    return iso_ts(prem.get("expires"))
+
+def guild_settings(guild_id: int) -> GuildSettings:
+    gk = str(guild_id)
+    cached = guild_cache.get(gk)
+    if cached is not None:
+        return cached
+    entry = get_server_entry(guild_id)
+    econ = get_guild_economy(guild_id)
+    cached = GuildSettings(
+        econ.get("currency_name", "Coins"),
+        econ.get("currency_symbol", ""),
+        entry.get("prefix"),
+        premium_expiry_ts(entry),
+        float(econ.get("cooldown_multiplier", 1.0)),
+        frozenset(entry.get("disabled_commands") or ()),
+        guild_versions.get(gk, 0),
+    )
+    guild_cache.set(gk, cached)
+    return cached
+
+def invalidate_guild(guild_id: int):
+    gk = str(guild_id)
+    guild_cache.pop(gk)
+    guild_versions[gk] = guild_versions.get(gk, 0) + 1
+
+def currency_symbol(guild: Optional[discord.Guild]) -> str:
+    return guild_settings(guild.id).currency_symbol if guild else "$"
 
 # -----------------------------
 # Utility
@@ -189,16 +488,204 @@ def readable_time_delta(sec: int) -> str:
 # -----------------------------
 # Leveling helper
 # -----------------------------
-async def add_xp(user_id: int, amount: int):
-    user = await get_user(user_id)
-    user['xp'] = user.get('xp', 0) + amount
-    leveled = False
-    if user['xp'] >= user.get('level', 1) * 100:
-        user['xp'] -= user.get('level', 1) * 100
-        user['level'] = user.get('level', 1) + 1
-        leveled = True
-    await update_user(user_id, user)
-    return leveled
+def level_for(level: int, xp: int):
+    """(level, leftover xp) after spending `xp` on level-ups from `level`.
+
+    Level L -> L+1 costs L*100 XP, so going from l to m costs
+    50 * (m*(m-1) - l*(l-1)): the reachable level is the largest m with
+    m*(m-1) <= l*(l-1) + xp // 50, found with one integer square root.
+    """
+    budget = level * (level - 1) + xp // 50
+    new = (1 + math.isqrt(1 + 4 * budget)) // 2
+    return new, xp - 50 * (new * (new - 1) - level * (level - 1))
+
+def apply_xp(user: UserRecord, amount: int) -> int:
+    # mutate an already-locked user record; returns the number of levels gained
+    level, user.xp = level_for(user.level, user.xp + amount)
+    gained = level - user.level
+    user.level = level
+    return gained
+
+# -----------------------------
+# Reward pipeline: everything an earning command changes (wallet, XP and
+# levels, items, cooldown, stats, quest rewards) is applied to the record
+# inside one user transaction, so it costs one read and one persist.
+# -----------------------------
+class Reward:
+    """What an action pays out; built by the command from the locked record."""
+    __slots__ = ("coins", "xp", "items")
+
+    def __init__(self, coins: int = 0, xp: int = 0, items: Optional[Dict[str, int]] = None):
+        self.coins = coins   # may be negative; the wallet doesn't go below zero
+        self.xp = xp
+        self.items = items or {}
+
+class RewardResult:
+    __slots__ = ("remaining", "reward", "coins", "levels", "level", "quests")
+
+    def __init__(self):
+        self.remaining = 0     # cooldown left; nothing was granted
+        self.reward: Optional[Reward] = None   # what was granted, if anything
+        self.coins = 0         # actual wallet change, quest rewards included
+        self.levels = 0
+        self.level = 0
+        self.quests: List[dict] = []   # quests completed by this action
+
+def apply_reward(user: UserRecord, reward: Reward, stat: str, result: RewardResult):
+    before = user.wallet
+    user.wallet = max(0, user.wallet + reward.coins)
+    for item, count in reward.items.items():
+        user.add_item(item, count)
+    xp = reward.xp
+    done = user.stats[stat] = user.stats.get(stat, 0) + 1
+    for quest in QUESTS_BY_STAT.get(stat, ()):
+        key = f"quest:{quest['id']}"
+        if done >= quest["goal"] and key not in user.stats:
+            user.stats[key] = 1
+            user.wallet += quest.get("coins", 0)
+            xp += quest.get("xp", 0)
+            if quest.get("item"):
+                user.add_item(quest["item"])
+            result.quests.append(quest)
+    result.levels = apply_xp(user, xp)
+    result.level = user.level
+    result.coins = user.wallet - before
+    result.reward = reward
+
+async def grant_reward(user_id: int, reason: str, build, *, guild: Optional[discord.Guild] = None,
+                       cooldown: Optional[str] = None) -> RewardResult:
+    """Run `build(user) -> Optional[Reward]` and apply it in one transaction.
+
+    With `cooldown`, nothing happens while that action's cooldown is running
+    (result.remaining) and the cooldown restarts when a reward is granted.
+    `reason` labels the ledger entry and is the stat counted for quests.
+    `build` returning None grants nothing.
+    """
+    result = RewardResult()
+    async with user_txn(user_id, reason=reason) as user:
+        if cooldown:
+            result.remaining = cooldown_left(user, cooldown, guild)
+            if result.remaining:
+                return result
+        reward = build(user)
+        if reward is None:
+            return result
+        if cooldown:
+            start_cooldown(user_id, user, cooldown, guild)
+        apply_reward(user, reward, reason, result)
+    return result
+
+def describe_reward(result: RewardResult, guild: Optional[discord.Guild]) -> str:
+    """Level-up and quest lines to append to a reward message."""
+    sym = currency_symbol(guild)
+    lines = []
+    if result.levels:
+        lines.append(f"🎉 You leveled up to level {result.level}!")
+    for quest in result.quests:
+        prize = f"{quest['coins']}{sym}" if quest.get("coins") else f"**{quest['item']}**"
+        lines.append(f"🏆 Quest complete: {quest['name']} — {prize}")
+    return "".join("\n" + line for line in lines)
+
+# -----------------------------
+# Cooldowns: deadlines live on the (resident) user record, see cooldowns.py
+# -----------------------------
+cooldowns = Cooldowns({
+    "work": 3600,       # per guild
+    "adventure": 900,   # per guild
+    "promote": 4 * 3600,
+    "daily": 86400,
+}, premium_multiplier=0.8)   # the "-20% cooldown" premium perk
+COOLDOWN_MULTIPLIER_RANGE = (0.25, 4.0)   # per-guild multiplier bounds for /settings_cooldowns
+
+def has_perks(user: UserRecord, guild: Optional[discord.Guild]) -> bool:
+    # premium perks apply to VRTEX+ members and in premium servers
+    return user.membership or (guild is not None and server_has_premium(guild.id))
+
+def cooldown_left(user: UserRecord, action: str, guild: Optional[discord.Guild] = None) -> int:
+    return cooldowns.remaining(user, action, guild.id if guild else None)
+
+def start_cooldown(user_id, user: UserRecord, action: str, guild: Optional[discord.Guild] = None) -> int:
+    multiplier = guild_settings(guild.id).cooldown_multiplier if guild else 1.0
+    deadline = cooldowns.start(user, action, guild.id if guild else None,
+                               guild_multiplier=multiplier, premium=has_perks(user, guild))
+    maintenance.schedule("cooldowns", str(user_id), deadline)
+    return deadline
+
+# -----------------------------
+# Maintenance scheduler (premium expiry, stale keys, cooldown pruning)
+# -----------------------------
+maintenance = ExpiryScheduler()
+user_seed: Optional[List[str]] = None   # users not yet scanned for cooldown deadlines
+
+def schedule_premium(guild_id, entry: dict):
+    if entry.get("premium"):
+        maintenance.schedule("premium", str(guild_id), premium_expiry_ts(entry))
+
+def schedule_keys(guild_id, entry: dict):
+    created = [iso_ts(k.get("created")) for k in (entry.get("pending_keys") or {}).values()]
+    if created:
+        maintenance.schedule("keys", str(guild_id), min(created) + PREMIUM_KEY_TTL)
+
+def schedule_cooldowns(user_id, user: UserRecord):
+    due = cooldowns.next_expiry(user)
+    if due is not None:
+        maintenance.schedule("cooldowns", str(user_id), due)
+
+def expire_premium(gk: str):
+    entry = backend.get_server(gk)
+    if not entry or not entry.get("premium"):
+        return
+    if premium_expiry_ts(entry) > time.time():
+        schedule_premium(gk, entry)   # renewed since it was scheduled
+        return
+    entry["premium"] = None
+    save_server_entry(int(gk), entry)
+    print(f"[MAINTENANCE] premium expired for guild {gk}")
+
+def expire_keys(gk: str):
+    entry = backend.get_server(gk)
+    if not entry:
+        return
+    pending = entry.get("pending_keys") or {}
+    cutoff = time.time() - PREMIUM_KEY_TTL
+    live = {k: v for k, v in pending.items() if iso_ts(v.get("created")) > cutoff}
+    if len(live) != len(pending):
+        entry["pending_keys"] = live
+        save_server_entry(int(gk), entry)
+    schedule_keys(gk, entry)
+
+async def prune_cooldowns(uid: str):
+    async with user_txn(int(uid), reason="maintenance") as user:
+        cooldowns.prune(user)
+    schedule_cooldowns(uid, user)
+
+@tasks.loop(seconds=MAINTENANCE_INTERVAL)
+async def run_maintenance():
+    global user_seed
+    if user_seed is None:
+        for gk, entry in backend.iter_servers():
+            schedule_premium(gk, entry)
+            schedule_keys(gk, entry)
+        user_seed = [uid for uid, _ in backend.iter_balances()]
+    # existing records are scanned a batch at a time; new stamps schedule themselves
+    if user_seed:
+        batch = user_seed[-MAINTENANCE_BATCH:]
+        del user_seed[-MAINTENANCE_BATCH:]
+        for uid in batch:
+            user = backend.get_user(uid)
+            if user:
+                schedule_cooldowns(uid, user)
+    for kind, key in maintenance.pop_due(time.time(), MAINTENANCE_BATCH):
+        try:
+            if kind == "premium":
+                expire_premium(key)
+            elif kind == "keys":
+                expire_keys(key)
+            elif kind == "cooldowns":
+                await prune_cooldowns(key)
+        except Exception as e:
+            print(f"[MAINTENANCE] {kind} {key} failed: {e!r}")
+        MAINTENANCE_JOBS.inc(kind=kind)
 
 # -----------------------------
 # Premium helpers (key generation / purchase simulation)
@@ -269,6 +756,50 @@ SHOP_ITEMS = {
     }
 }
 
+MAX_BUY_QUANTITY = 1000
+QUANTITY_TOKEN = re.compile(r"[x×]?(\d+)[x×]?", re.IGNORECASE)
+
+def shop_key(name: str) -> str:
+    return "".join(name.lower().split())
+
+# lookup key (name, plural, emoji) -> (item id, unit price), built once
+SHOP_INDEX: Dict[str, tuple] = {}
+for _item, _data in SHOP_ITEMS.items():
+    SHOP_INDEX[shop_key(_item)] = (_item, _data["price"])
+    SHOP_INDEX.setdefault(shop_key(_item) + "s", (_item, _data["price"]))
+    SHOP_INDEX[_data["emoji"]] = (_item, _data["price"])
+
+def parse_shop_order(spec: str, quantity: int = 1) -> Dict[str, int]:
+    """"food x3, water 2, phone" -> {"food": 3, "water": 2, "phone": 1}.
+
+    `quantity` applies to entries that don't carry their own count.
+    Raises ValueError with a user-facing message.
+    """
+    order: Dict[str, int] = {}
+    for part in spec.split(","):
+        words = part.split()
+        if not words:
+            continue
+        count = quantity
+        # a count may lead or trail the name: "3 food", "food x3"
+        for i in ((len(words) - 1, 0) if len(words) > 1 else ()):
+            m = QUANTITY_TOKEN.fullmatch(words[i])
+            if m:
+                count = int(m.group(1))
+                del words[i]
+                break
+        hit = SHOP_INDEX.get(shop_key("".join(words)))
+        if hit is None:
+            raise ValueError(f"`{' '.join(words)}` doesn't exist in the shop.")
+        if count < 1:
+            raise ValueError("Quantity must be at least 1.")
+        order[hit[0]] = order.get(hit[0], 0) + count
+        if order[hit[0]] > MAX_BUY_QUANTITY:
+            raise ValueError(f"You can buy at most {MAX_BUY_QUANTITY} of one item at a time.")
+    if not order:
+        raise ValueError("Tell me what to buy, e.g. `food x3, water 2`.")
+    return order
+
 # -----------------------------
 # Premium purchase (placeholder) & activation commands
 # -----------------------------
@@ -287,14 +818,14 @@ async def premium(interaction: discord.Interaction, action: str, key: Optional[s
         # simulate payment: generate key and DM purchaser
         months = 1  # default; you can extend to choose monthly/yearly
         key = generate_premium_key()
-        servers = load_json("servers")
-        servers[str(interaction.guild.id)] = servers.get(str(interaction.guild.id), {})
-        servers[str(interaction.guild.id)].setdefault("pending_keys", {})[key] = {
+        entry = get_server_entry(interaction.guild.id)
+        entry.setdefault("pending_keys", {})[key] = {
             "purchaser": interaction.user.id,
             "months": months,
             "created": utc_now().isoformat()
         }
-        save_json("servers", servers)
+        save_server_entry(interaction.guild.id, entry)
+        schedule_keys(interaction.guild.id, entry)
         # DM the buyer
         await deliver_premium_key_dm(interaction.user, key, months=months)
         await interaction.response.send_message("✅ Payment processed (simulated). A one-time key has been sent to your DMs. Use `/premium activate <key>` in this server to activate.", ephemeral=True)
@@ -308,12 +839,11 @@ async def premium(interaction: discord.Interaction, action: str, key: Optional[s
         if not key:
             await interaction.response.send_message("You must pass your activation key. Example: `/premium activate ABC123...`", ephemeral=True)
             return
-        servers = load_json("servers")
-        entry = servers.get(str(interaction.guild.id), {})
+        entry = get_server_entry(interaction.guild.id)
         pending = entry.get("pending_keys", {})
         kinfo = pending.get(key)
-        if not kinfo:
-            await interaction.response.send_message("❌ Invalid or already-used key.", ephemeral=True)
+        if not kinfo or iso_ts(kinfo.get("created")) + PREMIUM_KEY_TTL <= time.time():
+            await interaction.response.send_message("❌ Invalid, expired or already-used key.", ephemeral=True)
             return
         # mark premium: set expiry based on months purchased (simple monthly)
         months = kinfo.get("months", 1)
@@ -324,8 +854,8 @@ async def premium(interaction: discord.Interaction, action: str, key: Optional[s
         # remove the key from pending
         pending.pop(key, None)
         entry["pending_keys"] = pending
-        servers[str(interaction.guild.id)] = entry
-        save_json("servers", servers)
+        save_server_entry(interaction.guild.id, entry)
+        schedule_premium(interaction.guild.id, entry)
         await interaction.response.send_message(f"🎉 Server premium activated! Expires: {expires}. Default text prefix set to `ve`. Use `/settings` to customize.", ephemeral=True)
         return
 
@@ -357,13 +887,12 @@ async def premium_grant(interaction: discord.Interaction, guild_id: int, months:
     if interaction.user.id != OWNER_ID:
         await interaction.response.send_message("Only the bot owner can use this.", ephemeral=True)
         return
-    servers = load_json("servers")
-    entry = servers.get(str(guild_id), {})
+    entry = get_server_entry(guild_id)
     expires = (utc_now() + datetime.timedelta(days=30*months)).isoformat()
     entry["premium"] = {"expires": expires, "owner_id": interaction.user.id}
     entry["prefix"] = "ve"
-    servers[str(guild_id)] = entry
-    save_json("servers", servers)
+    save_server_entry(guild_id, entry)
+    schedule_premium(guild_id, entry)
     await interaction.response.send_message(f"Granted premium to server {guild_id} until {expires}.", ephemeral=True)
 
 # -----------------------------
@@ -407,8 +936,7 @@ class SettingsView(View):
 
     @discord.ui.button(label="Commands toggle", style=discord.ButtonStyle.secondary)
     async def toggle_btn(self, interaction: discord.Interaction, button: Button):
-        servers = load_json("servers")
-        entry = servers.get(str(self.guild.id), {})
+        entry = get_server_entry(self.guild.id)
         disabled = entry.get("disabled_commands", [])
         # present a simple message listing disabled commands and how to toggle them via command (for brevity)
         await interaction.response.send_message(f"Disabled commands on this server: {disabled or 'None'}. Use `/settings toggle <command>` to toggle.", ephemeral=True)
@@ -456,7 +984,7 @@ async def settings(interaction: discord.Interaction):
     econ = get_guild_economy(interaction.guild.id)
     prem = guild_entry.get("premium")
     prefix = guild_entry.get("prefix") or "Not set"
-    embed.add_field(name="Current", value=f"Currency: **{econ.get('currency_name')} {econ.get('currency_symbol','')}**\nStarting balance: **{econ.get('starting_balance',0)}**\nTax: **{econ.get('tax_rate',0)}%**\nPremium: **{'Active' if server_has_premium(interaction.guild.id) else 'Not active'}**\nPrefix: **{prefix}**", inline=False)
+    embed.add_field(name="Current", value=f"Currency: **{econ.get('currency_name')} {econ.get('currency_symbol','')}**\nStarting balance: **{econ.get('starting_balance',0)}**\nTax: **{econ.get('tax_rate',0)}%**\nPremium: **{'Active' if server_has_premium(interaction.guild.id) else 'Not active'}**\nPrefix: **{prefix}**\nCooldowns: **x{econ.get('cooldown_multiplier', 1.0):g}**", inline=False)
     view = SettingsView(interaction.guild)
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
@@ -468,8 +996,12 @@ async def settings_toggle(interaction: discord.Interaction, command_name: str):
         await interaction.response.send_message("Use in a server.", ephemeral=True); return
     if not (interaction.user.guild_permissions.manage_guild or interaction.user.id in TEAM_IDS or interaction.user.id == OWNER_ID):
         await interaction.response.send_message("You need Manage Server permission.", ephemeral=True); return
-    servers = load_json("servers")
-    entry = servers.get(str(interaction.guild.id), {})
+    command_name = " ".join(command_name.lower().split())
+    if command_name not in {cmd.qualified_name for cmd in tree.walk_commands()}:
+        await interaction.response.send_message(f"❌ Unknown command `{command_name}`.", ephemeral=True); return
+    if command_name in ALWAYS_ENABLED:
+        await interaction.response.send_message(f"❌ `{command_name}` can't be disabled.", ephemeral=True); return
+    entry = get_server_entry(interaction.guild.id)
     disabled = entry.get("disabled_commands", [])
     if command_name in disabled:
         disabled.remove(command_name)
@@ -478,23 +1010,38 @@ async def settings_toggle(interaction: discord.Interaction, command_name: str):
         disabled.append(command_name)
         msg = f"Disabled {command_name}"
     entry["disabled_commands"] = disabled
-    servers[str(interaction.guild.id)] = entry
-    save_json("servers", servers)
+    save_server_entry(interaction.guild.id, entry)
     await interaction.response.send_message(f"✅ {msg}", ephemeral=True)
 
+@tree.command(name="settings_cooldowns", description="Scale command cooldowns on this server")
+@app_commands.describe(multiplier="1.0 = default, 0.5 = half as long, 2.0 = twice as long")
+async def settings_cooldowns(interaction: discord.Interaction, multiplier: float):
+    if not interaction.guild:
+        await interaction.response.send_message("Use in a server.", ephemeral=True); return
+    if not (interaction.user.guild_permissions.manage_guild or interaction.user.id in TEAM_IDS or interaction.user.id == OWNER_ID):
+        await interaction.response.send_message("You need Manage Server permission.", ephemeral=True); return
+    low, high = COOLDOWN_MULTIPLIER_RANGE
+    if not low <= multiplier <= high:
+        await interaction.response.send_message(f"Multiplier must be between {low} and {high}.", ephemeral=True); return
+    set_guild_economy(interaction.guild.id, {"cooldown_multiplier": multiplier})
+    await interaction.response.send_message(f"✅ Cooldowns on this server are now x{multiplier:g} (applies from the next use).", ephemeral=True)
+
 # -----------------------------
 # Help command (slash) - custom embed listing commands & categories
 # -----------------------------
 @tree.command(name="help", description="Show VRTEX Economy help & commands")
 async def help_cmd(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=cached_embed("help", None, 0, render_help), ephemeral=False)
+
+def render_help() -> discord.Embed:
     embed = discord.Embed(title="💠 VRTEX Economy — Help", description="Slash commands are available below. If you have VRTEX+ you may also use a custom text prefix.", color=discord.Color.from_rgb(88,101,242))
-    embed.add_field(name="Quick", value="/balance  /work  /profile  /settings  /premium activate", inline=False)
+    embed.add_field(name="Quick", value="/balance  /work  /daily  /profile  /settings  /premium activate", inline=False)
     embed.add_field(name="Economy (examples)", value="`/balance` — check balances\n`/deposit <amt>` — deposit to bank\n`/withdraw <amt>` — withdraw\n`/transfer <user> <amt>` — send money", inline=False)
     embed.add_field(name="Games & Jobs", value="`/work` `/applyjob` `/jobs` `/promote`", inline=False)
-    embed.add_field(name="Business & Market", value="`/business buy` `/business list` `/market list`", inline=False)
+    embed.add_field(name="Business & Market", value="`/business buy` `/business list` `/market list` `/market buy` `/market sell`", inline=False)
     embed.add_field(name="Adventure & Quests", value="`/adventure` `/quests` `/achievements`", inline=False)
     embed.add_field(name="Premium perks", value="+25% work income, x2 daily, -20% cooldown, custom prefix, exclusive items", inline=False)
-    await interaction.response.send_message(embed=embed, ephemeral=False)
+    return embed
 
 # -----------------------------
 # Core economy slash commands (and underlying helpers used by both slash & text)
@@ -504,36 +1051,104 @@ def make_embed(title: str, description: str = None, color=None):
     e = discord.Embed(title=title, description=description or "", color=c)
     return e
 
+# -----------------------------
+# Rendered embed cache & page navigation
+# -----------------------------
+# Embeds are only read once built, so the same object can be sent again.
+embed_cache = LRUCache(EMBED_CACHE_SIZE)
+
+def cached_embed(command: str, guild: Optional[discord.Guild], page: int, build, stamp=None) -> discord.Embed:
+    """Return `build()`'s embed, rendered once per (command, guild settings version, page).
+
+    Pass guild=None for embeds that don't depend on guild settings. `stamp`
+    identifies the underlying data for lists that change (e.g. a leaderboard
+    page's entries).
+    """
+    gid = guild.id if guild else None
+    version = guild_settings(gid).version if gid else 0
+    key = (command, gid, version, page, stamp)
+    embed = embed_cache.get(key)
+    if embed is None:
+        embed = build()
+        embed_cache.set(key, embed)
+    return embed
+
+def page_count(total: int, per_page: int) -> int:
+    return max(1, -(-total // per_page))
+
+class PageView(View):
+    """Previous / next buttons; pages are rendered only when shown."""
+
+    def __init__(self, owner_id: int, pages: int, render, page: int = 0):
+        super().__init__(timeout=180)
+        self.owner_id = owner_id
+        self.pages = pages
+        self.render = render   # async: page number (0-based) -> Embed
+        self.page = page
+        self._sync()
+
+    def _sync(self):
+        self.prev_btn.disabled = self.page <= 0
+        self.next_btn.disabled = self.page >= self.pages - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("Only the person who ran the command can turn pages.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction):
+        self._sync()
+        await interaction.response.edit_message(embed=await self.render(self.page), view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def prev_btn(self, interaction: discord.Interaction, button: Button):
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_btn(self, interaction: discord.Interaction, button: Button):
+        self.page = min(self.pages - 1, self.page + 1)
+        await self._show(interaction)
+
+async def send_pages(interaction: discord.Interaction, pages: int, render, page: int = 0, content: str = None):
+    page = min(max(0, page), pages - 1)
+    if pages > 1:
+        view = PageView(interaction.user.id, pages, render, page)
+        await interaction.response.send_message(content, embed=await render(page), view=view)
+    else:
+        await interaction.response.send_message(content, embed=await render(page))
+
 async def send_balance_embed_ctx(ctx_or_inter, member: discord.Member):
-    if isinstance(ctx_or_inter, discord.Interaction):
+    if not isinstance(ctx_or_inter, discord.Message):
         guild = ctx_or_inter.guild
         author = member
         # use response
-        econ = get_guild_economy(guild.id) if guild else {"currency_symbol":"$"}
-        name = econ.get("currency_name","Coins")
-        sym = econ.get("currency_symbol","")
+        gs = guild_settings(guild.id) if guild else None
+        name = gs.currency_name if gs else "Coins"
+        sym = gs.currency_symbol if gs else "$"
         user = await get_user(member.id)
-        wallet = user.get("wallet",0); bank = user.get("bank",0)
+        wallet = user.wallet; bank = user.bank
         embed = make_embed(f"{member.display_name}'s Balance", None, None)
         embed.add_field(name=f"{name} (Wallet)", value=f"{wallet} {sym}", inline=True)
         embed.add_field(name=f"{name} (Bank)", value=f"{bank} {sym}", inline=True)
-        embed.add_field(name="Membership", value="VRTEX+" if user.get("membership") else "Normal", inline=False)
+        embed.add_field(name="Membership", value="VRTEX+" if user.membership else "Normal", inline=False)
         await ctx_or_inter.response.send_message(embed=embed)
     else:
         # ctx_or_inter is message
         msg = ctx_or_inter
         guild = msg.guild
         member = member or msg.author
-        econ = get_guild_economy(guild.id) if guild else {"currency_symbol":"$"}
-        name = econ.get("currency_name","Coins")
-        sym = econ.get("currency_symbol","")
+        gs = guild_settings(guild.id) if guild else None
+        name = gs.currency_name if gs else "Coins"
+        sym = gs.currency_symbol if gs else "$"
         user = await get_user(member.id)
-        wallet = user.get("wallet",0); bank = user.get("bank",0)
+        wallet = user.wallet; bank = user.bank
         embed = make_embed(f"{member.display_name}'s Balance", None, None)
         embed.add_field(name=f"{name} (Wallet)", value=f"{wallet} {sym}", inline=True)
         embed.add_field(name=f"{name} (Bank)", value=f"{bank} {sym}", inline=True)
-        embed.add_field(name="Membership", value="VRTEX+" if user.get("membership") else "Normal", inline=False)
-        await msg.channel.send(embed=embed)
+        embed.add_field(name="Membership", value="VRTEX+" if user.membership else "Normal", inline=False)
+        outbound.post(msg.channel, embed=embed)
 
 @tree.command(name="balance", description="Check your wallet & bank")
 @app_commands.describe(member="Member to check")
@@ -545,27 +1160,29 @@ async def slash_balance(interaction: discord.Interaction, member: Optional[disco
 @tree.command(name="deposit", description="Deposit money into your bank")
 @app_commands.describe(amount="Amount to deposit")
 async def slash_deposit(interaction: discord.Interaction, amount: int):
-    user = await get_user(interaction.user.id)
-    if amount <= 0 or amount > user.get("wallet",0):
+    async with user_txn(interaction.user.id, reason="deposit") as user:
+        ok = 0 < amount <= user.wallet
+        if ok:
+            user.wallet -= amount
+            user.bank += amount
+    if not ok:
         await interaction.response.send_message("❌ Invalid deposit amount or insufficient wallet funds.", ephemeral=True)
         return
-    user['wallet'] -= amount
-    user['bank'] = user.get('bank',0) + amount
-    await update_user(interaction.user.id, user)
-    await interaction.response.send_message(f"✅ Deposited {amount}{get_guild_economy(interaction.guild.id).get('currency_symbol','')} into your bank.")
+    await interaction.response.send_message(f"✅ Deposited {amount}{currency_symbol(interaction.guild)} into your bank.")
 
 # withdraw
 @tree.command(name="withdraw", description="Withdraw money from your bank")
 @app_commands.describe(amount="Amount to withdraw")
 async def slash_withdraw(interaction: discord.Interaction, amount: int):
-    user = await get_user(interaction.user.id)
-    if amount <= 0 or amount > user.get("bank",0):
+    async with user_txn(interaction.user.id, reason="withdraw") as user:
+        ok = 0 < amount <= user.bank
+        if ok:
+            user.bank -= amount
+            user.wallet += amount
+    if not ok:
         await interaction.response.send_message("❌ Invalid withdraw amount or insufficient bank funds.", ephemeral=True)
         return
-    user['bank'] -= amount
-    user['wallet'] = user.get('wallet',0) + amount
-    await update_user(interaction.user.id, user)
-    await interaction.response.send_message(f"✅ Withdrawn {amount}{get_guild_economy(interaction.guild.id).get('currency_symbol','')} to your wallet.")
+    await interaction.response.send_message(f"✅ Withdrawn {amount}{currency_symbol(interaction.guild)} to your wallet.")
 
 # transfer
 @tree.command(name="transfer", description="Send money to another user")
@@ -573,52 +1190,58 @@ async def slash_withdraw(interaction: discord.Interaction, amount: int):
 async def slash_transfer(interaction: discord.Interaction, member: discord.Member, amount: int):
     if member.id == interaction.user.id:
         await interaction.response.send_message("❌ You cannot transfer to yourself.", ephemeral=True); return
-    sender = await get_user(interaction.user.id)
-    receiver = await get_user(member.id)
-    if amount <= 0 or amount > sender.get('wallet',0):
+    async with user_txn(interaction.user.id, member.id, reason="transfer") as (sender, receiver):
+        ok = 0 < amount <= sender.wallet
+        if ok:
+            sender.wallet -= amount
+            receiver.wallet += amount
+    if not ok:
         await interaction.response.send_message("❌ Invalid transfer amount or insufficient balance.", ephemeral=True); return
-    sender['wallet'] -= amount
-    receiver['wallet'] = receiver.get('wallet',0) + amount
-    await update_user(interaction.user.id, sender)
-    await update_user(member.id, receiver)
-    await interaction.response.send_message(f"✅ Transferred {amount}{get_guild_economy(interaction.guild.id).get('currency_symbol','')} to {member.mention}!")
+    await interaction.response.send_message(f"✅ Transferred {amount}{currency_symbol(interaction.guild)} to {member.mention}!")
 
 # leaderboard
+LEADERBOARD_PAGE = 10
+
 @tree.command(name="leaderboard", description="View the richest users")
-async def slash_leaderboard(interaction: discord.Interaction):
-    users = load_json("users")
-    ranking = []
-    for uid, data in users.items():
-        total = data.get('wallet', 0) + data.get('bank', 0)
-        ranking.append((uid, total))
-    ranking.sort(key=lambda x: x[1], reverse=True)
-    embed = make_embed("💰 Top Richest Users", None, None)
+@app_commands.describe(server="Only rank members of this server", page="Page number")
+async def slash_leaderboard(interaction: discord.Interaction, server: bool = False, page: int = 1):
     guild = interaction.guild
-    count = 0
-    for uid, total in ranking:
-        if count >= 10:
-            break
-        try:
-            member = guild.get_member(int(uid)) if guild else None
-            name = member.display_name if member else f"User {uid}"
-        except Exception:
-            name = f"User {uid}"
-        embed.add_field(name=name, value=f"Total: {total}{get_guild_economy(guild.id).get('currency_symbol','')}", inline=False)
-        count += 1
-    await interaction.response.send_message(embed=embed)
+    local = bool(server and guild)
+    index = guild_ranking(guild) if local else global_ranking()
+    pages = page_count(len(index), LEADERBOARD_PAGE)
+
+    async def render(p: int) -> discord.Embed:
+        offset = p * LEADERBOARD_PAGE
+        ranking = index.page(offset, LEADERBOARD_PAGE)
+        names = await display_names(guild, [uid for uid, _ in ranking])
+
+        def build():
+            embed = make_embed(f"💰 Richest in {guild.name}" if local else "💰 Top Richest Users", None, None)
+            sym = currency_symbol(guild)
+            for pos, (uid, total) in enumerate(ranking, offset + 1):
+                embed.add_field(name=f"#{pos} {names[uid]}", value=f"Total: {total}{sym}", inline=False)
+            embed.set_footer(text=f"Page {p + 1}/{pages}")
+            return embed
+        # the page's entries and names are the cache stamp: any change on the page re-renders
+        stamp = (pages, tuple(ranking), tuple(names[uid] for uid, _ in ranking))
+        return cached_embed("leaderboard:guild" if local else "leaderboard", guild, p, build, stamp)
+
+    my_rank = index.rank(str(interaction.user.id))
+    content = f"Your rank: **#{my_rank}** of {len(index)}" if my_rank else None
+    await send_pages(interaction, pages, render, page - 1, content)
 
 # profile
 @tree.command(name="profile", description="View your or another user's profile")
 @app_commands.describe(member="Member to view")
 async def slash_profile(interaction: discord.Interaction, member: Optional[discord.Member] = None):
     member = member or interaction.user
+    note_member(interaction.guild, member)
     user = await get_user(member.id)
-    econ = get_guild_economy(interaction.guild.id) if interaction.guild else {"currency_symbol":"$"}
     embed = make_embed(f"{member.display_name}'s Profile", None, None)
-    embed.add_field(name="Balance", value=f"{user.get('wallet',0)+user.get('bank',0)}{econ.get('currency_symbol','')}", inline=False)
-    embed.add_field(name="Level & XP", value=f"Level {user.get('level',1)} (XP: {user.get('xp',0)})", inline=False)
-    embed.add_field(name="Job", value=user.get('job') or "Unemployed", inline=False)
-    embed.add_field(name="Businesses", value=", ".join(user.get('businesses',{}).keys()) or "None", inline=False)
+    embed.add_field(name="Balance", value=f"{user.total}{currency_symbol(interaction.guild)}", inline=False)
+    embed.add_field(name="Level & XP", value=f"Level {user.level} (XP: {user.xp})", inline=False)
+    embed.add_field(name="Job", value=user.job or "Unemployed", inline=False)
+    embed.add_field(name="Businesses", value=", ".join(user.businesses) or "None", inline=False)
     await interaction.response.send_message(embed=embed)
 
 # -----------------------------
@@ -626,55 +1249,55 @@ async def slash_profile(interaction: discord.Interaction, member: Optional[disco
 # -----------------------------
 @bot.tree.command(name="shop", description="View all available real-life items")
 async def shop(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=cached_embed("shop", interaction.guild, 0, lambda: render_shop(interaction.guild)))
+
+def render_shop(guild: Optional[discord.Guild]) -> discord.Embed:
     embed = discord.Embed(
         title="🛒 VRTEX Shop",
         description="Buy useful real-life items to improve your economy",
         color=discord.Color.blue()
     )
+    sym = currency_symbol(guild)
 
     for item, data in SHOP_ITEMS.items():
         embed.add_field(
             name=f"{data['emoji']} {item.title()}",
-            value=f"💰 **{data['price']:,} coins**\n{data['description']}",
+            value=f"💰 **{data['price']:,}{sym}**\n{data['description']}",
             inline=False
         )
 
     embed.set_footer(text="Use /buy <item> to purchase an item")
-    await interaction.response.send_message(embed=embed)
+    return embed
 
-@bot.tree.command(name="buy", description="Buy an item from the shop")
-async def buy(interaction: discord.Interaction, item: str):
-    item = item.lower()
-
-    if item not in SHOP_ITEMS:
-        await interaction.response.send_message(
-            "❌ That item doesn't exist in the shop.",
-            ephemeral=True
-        )
+@bot.tree.command(name="buy", description="Buy items from the shop")
+@app_commands.describe(item="Item name, or several at once: food x3, water 2", quantity="How many to buy")
+async def buy(interaction: discord.Interaction, item: str, quantity: int = 1):
+    try:
+        order = parse_shop_order(item, quantity)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
         return
 
-    user_id = str(interaction.user.id)
-    users = load_users()
-
-    if user_id not in users:
-        create_user(user_id)
-        users = load_users()
+    price = sum(SHOP_ITEMS[name]["price"] * count for name, count in order.items())
 
-    price = SHOP_ITEMS[item]["price"]
+    # the whole basket is paid for and delivered in one transaction
+    async with user_txn(interaction.user.id, reason="shop_buy") as user:
+        affordable = user.wallet >= price
+        if affordable:
+            user.wallet -= price
+            for name, count in order.items():
+                user.add_item(name, count)
 
-    if users[user_id]["wallet"] < price:
+    if not affordable:
         await interaction.response.send_message(
-            "❌ You don't have enough coins.",
+            f"❌ You don't have enough coins (need **{price:,}**).",
             ephemeral=True
         )
         return
 
-    users[user_id]["wallet"] -= price
-    users[user_id]["inventory"].append(item)
-    save_users(users)
-
+    bought = ", ".join(f"**{count}× {name.title()}**" for name, count in order.items())
     await interaction.response.send_message(
-        f"✅ You bought **{item.title()}** for **{price:,} coins**!"
+        f"✅ You bought {bought} for **{price:,} coins**!"
     )
 
 # -----------------------------
@@ -682,39 +1305,40 @@ async def buy(interaction: discord.Interaction, item: str):
 # -----------------------------
 @tree.command(name="work", description="Work to earn coins (1-hour cooldown)")
 async def slash_work(interaction: discord.Interaction):
-    user = await get_user(interaction.user.id)
     if not interaction.guild:
         await interaction.response.send_message("Work can only be used in servers.", ephemeral=True); return
-    guild_id = str(interaction.guild.id)
-    last_claims = user.get("work_claims", {})
-    now = utc_now()
-    last_iso = last_claims.get(guild_id)
-    # cooldown base 3600 sec
-    cooldown = 3600
-    if last_iso:
-        try:
-            last_dt = datetime.datetime.fromisoformat(last_iso)
-            delta = (now - last_dt).total_seconds()
-            if delta < cooldown:
-                await interaction.response.send_message(f"❌ You can work again in **{readable_time_delta(cooldown - delta)}**", ephemeral=True)
-                return
-        except Exception:
-            pass
-    reward = 1000
-    # premium perks: if user is VRTEX+, apply +25%
-    if await is_plus(interaction.user.id):
-        reward = int(reward * 1.25)
-    # server premium perk: -20% cooldown: if server premium, reduce cooldown (not reward here)
-    user['wallet'] = user.get('wallet', 0) + reward
-    last_claims[guild_id] = now.isoformat()
-    user['work_claims'] = last_claims
-    await update_user(interaction.user.id, user)
-    leveled = await add_xp(interaction.user.id, 20)
-    msg = f"✅ You worked and earned **{reward}{get_guild_economy(interaction.guild.id).get('currency_symbol','')}**!"
-    if leveled:
-        msg += "\n🎉 You leveled up!"
+    guild = interaction.guild
+
+    def pay(user: UserRecord) -> Reward:
+        reward = 1000
+        # premium perks: if user is VRTEX+, apply +25%
+        if user.membership:
+            reward = int(reward * 1.25)
+        return Reward(coins=reward, xp=20)
+
+    result = await grant_reward(interaction.user.id, "work", pay, guild=guild, cooldown="work")
+    if result.remaining:
+        await interaction.response.send_message(f"❌ You can work again in **{readable_time_delta(result.remaining)}**", ephemeral=True)
+        return
+    msg = f"✅ You worked and earned **{result.reward.coins}{currency_symbol(guild)}**!" + describe_reward(result, guild)
     await interaction.response.send_message(msg)
 
+DAILY_REWARD = 500
+
+@tree.command(name="daily", description="Claim your daily reward")
+async def slash_daily(interaction: discord.Interaction):
+    async with user_txn(interaction.user.id, reason="daily") as user:
+        remaining = cooldown_left(user, "daily")
+        if not remaining:
+            # premium perk: x2 daily
+            reward = DAILY_REWARD * 2 if has_perks(user, interaction.guild) else DAILY_REWARD
+            user.wallet += reward
+            start_cooldown(interaction.user.id, user, "daily")
+    if remaining:
+        await interaction.response.send_message(f"❌ Your next daily reward is ready in **{readable_time_delta(remaining)}**", ephemeral=True)
+        return
+    await interaction.response.send_message(f"🎁 You claimed your daily **{reward}{currency_symbol(interaction.guild)}**!")
+
 # Job-related commands (simplified)
 JOBS = {
     "cashier": {"pay": 500, "chance_promote": 0.2},
@@ -724,10 +1348,13 @@ JOBS = {
 
 @tree.command(name="jobs", description="List available jobs")
 async def slash_jobs(interaction: discord.Interaction):
-    embed = make_embed("💼 Jobs", None, None)
-    for name, info in JOBS.items():
-        embed.add_field(name=name.title(), value=f"Pay: {info['pay']} | Promote chance: {int(info['chance_promote']*100)}%", inline=False)
-    await interaction.response.send_message(embed=embed)
+    def build():
+        embed = make_embed("💼 Jobs", None, None)
+        sym = currency_symbol(interaction.guild)
+        for name, info in JOBS.items():
+            embed.add_field(name=name.title(), value=f"Pay: {info['pay']}{sym} | Promote chance: {int(info['chance_promote']*100)}%", inline=False)
+        return embed
+    await interaction.response.send_message(embed=cached_embed("jobs", interaction.guild, 0, build))
 
 @tree.command(name="applyjob", description="Apply for a job")
 @app_commands.describe(job_name="Job name")
@@ -735,36 +1362,45 @@ async def slash_applyjob(interaction: discord.Interaction, job_name: str):
     job_name = job_name.lower().strip()
     if job_name not in JOBS:
         await interaction.response.send_message("❌ Job not found.", ephemeral=True); return
-    user = await get_user(interaction.user.id)
-    user['job'] = job_name
-    user['job_streak'] = 0
-    await update_user(interaction.user.id, user)
+    async with user_txn(interaction.user.id) as user:
+        user.job = job_name
+        user.job_streak = 0
     await interaction.response.send_message(f"✅ You are now employed as **{job_name.title()}**.")
 
 @tree.command(name="quitjob", description="Leave your current job")
 async def slash_quitjob(interaction: discord.Interaction):
-    user = await get_user(interaction.user.id)
-    if not user.get("job"):
+    async with user_txn(interaction.user.id) as user:
+        had_job = bool(user.job)
+        if had_job:
+            user.job = None
+            user.job_streak = 0
+    if not had_job:
         await interaction.response.send_message("You don't have a job.", ephemeral=True); return
-    user['job'] = None
-    user['job_streak'] = 0
-    await update_user(interaction.user.id, user)
     await interaction.response.send_message("You left your job.")
 
 @tree.command(name="promote", description="Attempt an automatic promotion")
 async def slash_promote(interaction: discord.Interaction):
-    user = await get_user(interaction.user.id)
-    job = user.get("job")
+    promoted = False
+    remaining = 0
+    async with user_txn(interaction.user.id) as user:
+        job = user.job
+        if job:
+            remaining = cooldown_left(user, "promote")
+        if job and not remaining:
+            start_cooldown(interaction.user.id, user, "promote")
+            info = JOBS.get(job, {})
+            chance = info.get("chance_promote", 0.1)
+            if random.random() < chance:
+                # promotion effect: increase pay (we'll simulate by increasing stored 'job_rank' or similar)
+                user.job_rank += 1
+                promoted = True
     if not job:
         await interaction.response.send_message("You have no job.", ephemeral=True); return
-    info = JOBS.get(job, {})
-    chance = info.get("chance_promote", 0.1)
-    if random.random() < chance:
-        # promotion effect: increase pay (we'll simulate by increasing stored 'job_rank' or similar)
-        user.setdefault("job_rank", 1)
-        user["job_rank"] += 1
-        await update_user(interaction.user.id, user)
-        await interaction.response.send_message(f"🎉 Congratulations — you were promoted! New rank: {user['job_rank']}")
+    if remaining:
+        await interaction.response.send_message(f"❌ You can ask for a promotion again in **{readable_time_delta(remaining)}**", ephemeral=True)
+        return
+    if promoted:
+        await interaction.response.send_message(f"🎉 Congratulations — you were promoted! New rank: {user.job_rank}")
     else:
         await interaction.response.send_message("No promotion this time. Keep working!")
 
@@ -778,6 +1414,33 @@ DEFAULT_BUSINESSES = {
     # tier 3-5 may be unlocked by premium when implementing expansion
 }
 
+def business_accrual(info: dict, now: float):
+    """(payout, periods, seconds to next period) for one owned business.
+
+    Income accrues lazily: nothing runs in the background, a claim just
+    counts whole periods since `last_claimed` (capped at BUSINESS_MAX_PERIODS).
+    Businesses bought before accrual existed have one period ready.
+    """
+    last = info.get("last_claimed")
+    if last is None:
+        last = now - BUSINESS_PERIOD
+    periods = min(int((now - last) // BUSINESS_PERIOD), BUSINESS_MAX_PERIODS)
+    net = max(0, info.get("profit", 0) - info.get("upkeep", 0))
+    wait = BUSINESS_PERIOD - (now - last) % BUSINESS_PERIOD
+    return net * periods, periods, wait
+
+def collect_business(info: dict, now: float) -> int:
+    """Pay out the accrued periods and move `last_claimed` forward."""
+    payout, periods, _ = business_accrual(info, now)
+    last = info.get("last_claimed", now - BUSINESS_PERIOD)
+    if periods >= BUSINESS_MAX_PERIODS:
+        # the cap was hit: time beyond it is forfeited
+        info["last_claimed"] = int(now)
+    elif periods:
+        # keep the partial period that is already under way
+        info["last_claimed"] = int(last + periods * BUSINESS_PERIOD)
+    return payout
+
 # ✅ Create the group properly
 business_group = app_commands.Group(
     name="business",
@@ -789,10 +1452,13 @@ business_group = app_commands.Group(
 # -----------------------------
 @business_group.command(name="list", description="Show available businesses")
 async def business_list(interaction: discord.Interaction):
-    embed = make_embed("🏠 Available Businesses", None, None)
-    for name, info in DEFAULT_BUSINESSES.items():
-        embed.add_field(name=name, value=f"Cost: {info['cost']} | Profit: {info['profit']}", inline=False)
-    await interaction.response.send_message(embed=embed)
+    def build():
+        embed = make_embed("🏠 Available Businesses", None, None)
+        sym = currency_symbol(interaction.guild)
+        for name, info in DEFAULT_BUSINESSES.items():
+            embed.add_field(name=name, value=f"Cost: {info['cost']}{sym} | Profit: {info['profit']}{sym} | Upkeep: {info['upkeep']}{sym}", inline=False)
+        return embed
+    await interaction.response.send_message(embed=cached_embed("business_list", interaction.guild, 0, build))
 
 # -----------------------------
 # Buy a business
@@ -804,17 +1470,21 @@ async def business_buy(interaction: discord.Interaction, name: str):
     if name not in DEFAULT_BUSINESSES:
         await interaction.response.send_message("❌ Business not found.", ephemeral=True)
         return
-    user = await get_user(interaction.user.id)
-    if name in user.get("businesses", {}):
+    cost = DEFAULT_BUSINESSES[name]['cost']
+    async with user_txn(interaction.user.id, reason="business_buy") as user:
+        owned = name in user.businesses
+        affordable = user.wallet >= cost
+        if not owned and affordable:
+            user.wallet -= cost
+            business = DEFAULT_BUSINESSES[name].copy()
+            business["last_claimed"] = int(time.time())
+            user.businesses[name] = business
+    if owned:
         await interaction.response.send_message("❌ You already own this business.", ephemeral=True)
         return
-    cost = DEFAULT_BUSINESSES[name]['cost']
-    if user.get('wallet', 0) < cost:
+    if not affordable:
         await interaction.response.send_message("❌ Not enough money.", ephemeral=True)
         return
-    user['wallet'] -= cost
-    user.setdefault('businesses', {})[name] = DEFAULT_BUSINESSES[name].copy()
-    await update_user(interaction.user.id, user)
     await interaction.response.send_message(f"✅ You bought **{name}**!")
 
 # -----------------------------
@@ -822,13 +1492,28 @@ async def business_buy(interaction: discord.Interaction, name: str):
 # -----------------------------
 @business_group.command(name="claim", description="Claim profits from your businesses")
 async def business_claim(interaction: discord.Interaction):
-    user = await get_user(interaction.user.id)
     total = 0
-    for b, info in user.get('businesses', {}).items():
-        total += info.get('profit', 0)
-    user['wallet'] = user.get('wallet', 0) + total
-    await update_user(interaction.user.id, user)
-    await interaction.response.send_message(f"✅ Claimed {total}{get_guild_economy(interaction.guild.id).get('currency_symbol','')} from your businesses.")
+    next_wait = None
+    now = time.time()
+    businesses = None
+
+    def collect(user: UserRecord) -> Optional[Reward]:
+        nonlocal total, next_wait, businesses
+        businesses = user.businesses
+        for info in businesses.values():
+            total += collect_business(info, now)
+            wait = business_accrual(info, now)[2]
+            next_wait = wait if next_wait is None else min(next_wait, wait)
+        return Reward(coins=total) if total else None
+
+    result = await grant_reward(interaction.user.id, "business_claim", collect, guild=interaction.guild)
+    if not businesses:
+        await interaction.response.send_message("❌ You don't own any businesses.", ephemeral=True)
+        return
+    if not total:
+        await interaction.response.send_message(f"⏳ Nothing to claim yet — next payout in **{readable_time_delta(next_wait)}**.", ephemeral=True)
+        return
+    await interaction.response.send_message(f"✅ Claimed {total}{currency_symbol(interaction.guild)} from your businesses." + describe_reward(result, interaction.guild))
 
 # -----------------------------
 # Business info
@@ -844,7 +1529,14 @@ async def business_info(interaction: discord.Interaction, name: str):
     embed = make_embed(f"{name} Info", None, None)
     embed.add_field(name="Cost", value=str(info['cost']), inline=True)
     embed.add_field(name="Profit", value=str(info['profit']), inline=True)
+    embed.add_field(name="Upkeep", value=str(info['upkeep']), inline=True)
     embed.add_field(name="Tier", value=str(info['tier']), inline=True)
+    owned = (await get_user(interaction.user.id)).businesses.get(name)
+    if owned:
+        payout, periods, wait = business_accrual(owned, time.time())
+        embed.add_field(name="Ready to claim",
+                        value=f"{payout} ({periods}/{BUSINESS_MAX_PERIODS} periods) — next in {readable_time_delta(wait)}",
+                        inline=False)
     await interaction.response.send_message(embed=embed)
 
 # ✅ Register the group
@@ -852,40 +1544,288 @@ tree.add_command(business_group)
 # -----------------------------
 # Marketplace & inventory (simplified)
 # -----------------------------
+INVENTORY_PAGE = 15
+
 @tree.command(name="inventory", description="Check your items")
-async def slash_inventory(interaction: discord.Interaction):
+@app_commands.describe(page="Page number")
+async def slash_inventory(interaction: discord.Interaction, page: int = 1):
     user = await get_user(interaction.user.id)
-    items = user.get("items", {})
-    if not items:
+    if not user.items:
         await interaction.response.send_message("Your inventory is empty.", ephemeral=True); return
-    txt = "\n".join(f"{k}: {v}" for k,v in items.items())
-    await interaction.response.send_message(f"📦 Your items:\n{txt}")
+    names = sorted(user.items)
+    counts = dict(user.items)   # snapshot; the view may outlive this call
+    pages = page_count(len(names), INVENTORY_PAGE)
+
+    async def render(p: int) -> discord.Embed:
+        chunk = names[p * INVENTORY_PAGE:(p + 1) * INVENTORY_PAGE]
+        embed = make_embed("📦 Your items", "\n".join(f"{k}: {counts[k]}" for k in chunk))
+        embed.set_footer(text=f"Page {p + 1}/{pages}")
+        return embed
+
+    await send_pages(interaction, pages, render, page - 1)
 
 @tree.command(name="use", description="Use an item")
 @app_commands.describe(item="Item name")
 async def slash_use(interaction: discord.Interaction, item: str):
-    user = await get_user(interaction.user.id)
-    items = user.get("items", {})
-    if items.get(item,0) <= 0:
+    async with user_txn(interaction.user.id) as user:
+        # example item effect: if "xp_potion" then add xp
+        has_item = user.take_item(item)
+    if not has_item:
         await interaction.response.send_message("You don't have that item.", ephemeral=True); return
-    # example item effect: if "xp_potion" then add xp
-    items[item] -= 1
-    user['items'] = items
-    await update_user(interaction.user.id, user)
     await interaction.response.send_message(f"Used one {item}. (No special effect implemented for demo)")
 
-@tree.command(name="sell", description="Sell an item")
-@app_commands.describe(item="Item name", price="Price to sell for")
-async def slash_sell(interaction: discord.Interaction, item: str, price: int):
-    user = await get_user(interaction.user.id)
-    items = user.get("items", {})
-    if items.get(item,0) <= 0:
-        await interaction.response.send_message("You don't have that item.", ephemeral=True); return
-    items[item] -= 1
-    user['wallet'] = user.get('wallet',0) + price
-    user['items'] = items
-    await update_user(interaction.user.id, user)
-    await interaction.response.send_message(f"Sold {item} for {price}.")
+# -----------------------------
+# Player marketplace (order book)
+# -----------------------------
+MARKET_PAGE = 10
+MARKET_MAX_PRICE = 10 ** 9
+MARKET_MAX_ORDERS = int(os.getenv("MARKET_MAX_ORDERS", "50"))   # open orders per user
+LOOT_ITEMS = ("mysterious_gem",)
+
+market = Market()
+market_lock = asyncio.Lock()   # one order at a time per process
+
+class MarketStale(Exception):
+    """Another process changed the order book after it was read."""
+
+def sync_market():
+    # the backend's change counter moves when another shard process trades;
+    # catch up on just the orders it touched, reloading only if the log is gone
+    version = backend.market_version()
+    if market.loaded and version == market.version:
+        return
+    changes = backend.market_changes(market.version) if market.loaded and market.version is not None else None
+    if changes is None:
+        market.load(backend.iter_orders())
+    else:
+        market.apply(changes)
+    market.version = version
+
+def save_order(order: Order):
+    """Insert (no id yet) or update an order inside the running user_txn."""
+    if order.id is None:
+        backend.insert_order(order)
+    else:
+        backend.update_order(order)
+    txn_orders.get()[order.id] = order.to_dict()
+
+def drop_order(order_id: int):
+    backend.delete_order(order_id)
+    txn_orders.get()[order_id] = None
+
+def market_item(name: str) -> Optional[str]:
+    hit = SHOP_INDEX.get(shop_key(name))
+    if hit is not None:
+        return hit[0]
+    key = "_".join(name.lower().split())
+    return key if key in LOOT_ITEMS else None
+
+def check_order(price: int, quantity: int) -> Optional[str]:
+    if not 0 < price <= MARKET_MAX_PRICE:
+        return "Price must be a positive number."
+    if not 0 < quantity <= MAX_BUY_QUANTITY:
+        return f"Quantity must be between 1 and {MAX_BUY_QUANTITY}."
+    return None
+
+async def place_order(user_id: int, side: str, item: str, price: int, quantity: int):
+    """Match an order against the book and rest any remainder.
+
+    Bids escrow coins and asks escrow items when placed; fills execute at the
+    resting order's price. The taker and every maker it trades with are
+    settled in one transaction. Returns (fills, resting order or None, error).
+    """
+    uid = str(user_id)
+    async with market_lock:
+        for _ in range(3):
+            sync_market()
+            if market.user_order_count(uid) >= MARKET_MAX_ORDERS:
+                return [], None, f"You already have {MARKET_MAX_ORDERS} open orders."
+            fills = market.match(side, item, uid, price, quantity)
+            filled = sum(f.quantity for f in fills)
+            rest = quantity - filled
+            if rest and market.crosses(side, item, price, fills):
+                # the remainder would trade with the taker's own order; don't place it
+                if not fills:
+                    return [], None, "That order would trade with one of your own open orders."
+                rest = 0
+            makers = sorted({f.maker.user_id for f in fills})
+            error = None
+            resting = None
+            try:
+                async with user_txn(user_id, *map(int, makers), reason=f"market_{side}") as users:
+                    if backend.market_version() != market.version:
+                        raise MarketStale()
+                    users = users if isinstance(users, list) else [users]
+                    records = dict(zip([uid] + makers, users))
+                    taker = records[uid]
+                    proceeds = sum(f.price * f.quantity for f in fills)
+                    if side == BID:
+                        charge = proceeds + price * rest
+                        if taker.wallet < charge:
+                            error = f"You need **{charge:,}** coins to place this order."
+                        else:
+                            taker.wallet -= charge
+                            if filled:
+                                taker.add_item(item, filled)
+                            for f in fills:
+                                records[f.maker.user_id].wallet += f.price * f.quantity
+                    else:
+                        if not taker.take_item(item, filled + rest):
+                            error = f"You don't have {filled + rest}× {item}."
+                        else:
+                            taker.wallet += proceeds
+                            for f in fills:
+                                records[f.maker.user_id].add_item(item, f.quantity)
+                    if error is None:
+                        updated, closed = market.settle(fills)
+                        for order in updated:
+                            save_order(order)
+                        for order in closed:
+                            drop_order(order.id)
+                        if rest:
+                            resting = Order(None, side, item, uid, price, rest)
+                            save_order(resting)
+                            market.add(resting)
+                        market.version = backend.market_version()
+            except MarketStale:
+                continue
+            except BaseException:
+                # the book may be ahead of what was committed; reload it next time
+                market.loaded = False
+                raise
+            if error:
+                return [], None, error
+            return fills, resting, None
+    return [], None, "The market is busy, try again."
+
+async def cancel_order(user_id: int, order_id: int) -> Optional[Order]:
+    uid = str(user_id)
+    async with market_lock:
+        for _ in range(3):
+            sync_market()
+            order = market.orders.get(order_id)
+            if order is None or order.user_id != uid:
+                return None
+            try:
+                async with user_txn(user_id, reason="market_cancel") as user:
+                    if backend.market_version() != market.version:
+                        raise MarketStale()
+                    # release the escrow
+                    if order.side == BID:
+                        user.wallet += order.price * order.quantity
+                    else:
+                        user.add_item(order.item, order.quantity)
+                    drop_order(order.id)
+                    market.remove(order)
+                    market.version = backend.market_version()
+            except MarketStale:
+                continue
+            except BaseException:
+                market.loaded = False
+                raise
+            return order
+    return None
+
+def describe_trade(side: str, item: str, quantity: int, fills, resting: Optional[Order], sym: str) -> str:
+    filled = sum(f.quantity for f in fills)
+    value = sum(f.price * f.quantity for f in fills)
+    parts = []
+    if filled:
+        verb = "Bought" if side == BID else "Sold"
+        parts.append(f"✅ {verb} **{filled}× {item}** for **{value:,}{sym}**.")
+    if resting:
+        verb = "buy" if side == BID else "sell"
+        parts.append(f"📋 Order **#{resting.id}** to {verb} **{resting.quantity}× {item}** at "
+                     f"**{resting.price:,}{sym}** each is open.")
+    dropped = quantity - filled - (resting.quantity if resting else 0)
+    if dropped:
+        parts.append(f"↩️ The other **{dropped}** weren't placed: they would have traded with your own open order.")
+    return "\n".join(parts)
+
+market_group = app_commands.Group(name="market", description="Player marketplace")
+
+async def market_trade(interaction: discord.Interaction, side: str, item: str, price: int, quantity: int):
+    item_id = market_item(item)
+    if item_id is None:
+        await interaction.response.send_message("❌ That item can't be traded.", ephemeral=True); return
+    problem = check_order(price, quantity)
+    if problem:
+        await interaction.response.send_message(f"❌ {problem}", ephemeral=True); return
+    fills, resting, error = await place_order(interaction.user.id, side, item_id, price, quantity)
+    if error:
+        await interaction.response.send_message(f"❌ {error}", ephemeral=True); return
+    await interaction.response.send_message(describe_trade(side, item_id, quantity, fills, resting, currency_symbol(interaction.guild)))
+
+@market_group.command(name="sell", description="Sell items to other players")
+@app_commands.describe(item="Item name", price="Lowest price per item", quantity="How many to sell")
+async def market_sell(interaction: discord.Interaction, item: str, price: int, quantity: int = 1):
+    await market_trade(interaction, ASK, item, price, quantity)
+
+@market_group.command(name="buy", description="Buy items from other players")
+@app_commands.describe(item="Item name", price="Highest price per item", quantity="How many to buy")
+async def market_buy(interaction: discord.Interaction, item: str, price: int, quantity: int = 1):
+    await market_trade(interaction, BID, item, price, quantity)
+
+@market_group.command(name="list", description="Browse open orders")
+@app_commands.describe(item="Item to show the order book for", page="Page number")
+async def market_list(interaction: discord.Interaction, item: Optional[str] = None, page: int = 1):
+    sync_market()
+    page = max(1, page)
+    offset = (page - 1) * MARKET_PAGE
+    sym = currency_symbol(interaction.guild)
+    if item is None:
+        embed = make_embed("🏪 Market", None, None)
+        for name, ask, bid, n_asks, n_bids in market.summary(offset, MARKET_PAGE):
+            best_ask = f"{ask:,}{sym}" if ask is not None else "—"
+            best_bid = f"{bid:,}{sym}" if bid is not None else "—"
+            embed.add_field(name=name, value=f"Sell from {best_ask} ({n_asks}) | Buy up to {best_bid} ({n_bids})", inline=False)
+        pages = max(1, -(-len(market.books) // MARKET_PAGE))
+        embed.set_footer(text=f"Page {page}/{pages} — /market list <item> for the order book")
+        await interaction.response.send_message(embed=embed); return
+    item_id = market_item(item)
+    if item_id is None:
+        await interaction.response.send_message("❌ That item can't be traded.", ephemeral=True); return
+    embed = make_embed(f"🏪 {item_id} order book", None, None)
+    asks = market.page(item_id, ASK, offset, MARKET_PAGE)
+    bids = market.page(item_id, BID, offset, MARKET_PAGE)
+    embed.add_field(name="Selling (cheapest first)",
+                    value="\n".join(f"#{o.id}: {o.quantity}× at {o.price:,}{sym}" for o in asks) or "—", inline=True)
+    embed.add_field(name="Buying (highest first)",
+                    value="\n".join(f"#{o.id}: {o.quantity}× at {o.price:,}{sym}" for o in bids) or "—", inline=True)
+    depth = max(market.depth(item_id, ASK), market.depth(item_id, BID))
+    embed.set_footer(text=f"Page {page}/{max(1, -(-depth // MARKET_PAGE))}")
+    await interaction.response.send_message(embed=embed)
+
+@market_group.command(name="orders", description="Your open orders")
+@app_commands.describe(page="Page number")
+async def market_orders(interaction: discord.Interaction, page: int = 1):
+    sync_market()
+    uid = str(interaction.user.id)
+    page = max(1, page)
+    orders = market.user_orders(uid, (page - 1) * MARKET_PAGE, MARKET_PAGE)
+    if not orders:
+        await interaction.response.send_message("You have no open orders.", ephemeral=True); return
+    sym = currency_symbol(interaction.guild)
+    lines = [f"#{o.id}: {'buy' if o.side == BID else 'sell'} {o.quantity}× {o.item} at {o.price:,}{sym}" for o in orders]
+    total = market.user_order_count(uid)
+    lines.append(f"Page {page}/{-(-total // MARKET_PAGE)}")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+@market_group.command(name="cancel", description="Cancel one of your open orders")
+@app_commands.describe(order_id="Order number")
+async def market_cancel(interaction: discord.Interaction, order_id: int):
+    order = await cancel_order(interaction.user.id, order_id)
+    if order is None:
+        await interaction.response.send_message("❌ You have no open order with that number.", ephemeral=True); return
+    await interaction.response.send_message(f"🗑️ Order #{order.id} cancelled; its escrow was returned.", ephemeral=True)
+
+tree.add_command(market_group)
+
+@tree.command(name="sell", description="List an item for sale on the market")
+@app_commands.describe(item="Item name", price="Price per item", quantity="How many to sell")
+async def slash_sell(interaction: discord.Interaction, item: str, price: int, quantity: int = 1):
+    # selling goes through the order book: coins only ever come from a buyer
+    await market_trade(interaction, ASK, item, price, quantity)
 
 # -----------------------------
 # Adventure & quests (simplified)
@@ -896,41 +1836,161 @@ async def slash_adventure(interaction: discord.Interaction):
     outcomes = [
         ("Found coins", 500),
         ("Found nothing", 0),
-        ("Found item", "mysterious_gem"),
+        ("Found item", LOOT_ITEMS[0]),
         ("Ambushed and lost coins", -200)
     ]
-    pick = random.choice(outcomes)
-    user = await get_user(interaction.user.id)
-    if isinstance(pick[1], int):
-        change = pick[1]
-        if change >= 0:
-            user['wallet'] = user.get('wallet',0) + change
-            await update_user(interaction.user.id, user)
-            await interaction.response.send_message(f"🧭 {pick[0]}: {change}{get_guild_economy(interaction.guild.id).get('currency_symbol','')}")
-        else:
-            user['wallet'] = max(0, user.get('wallet',0) + change)
-            await update_user(interaction.user.id, user)
-            await interaction.response.send_message(f"🧭 {pick[0]}: {change}{get_guild_economy(interaction.guild.id).get('currency_symbol','')}")
+    label, found = random.choice(outcomes)
+    guild = interaction.guild
+    reward = Reward(coins=found) if isinstance(found, int) else Reward(items={found: 1})
+    result = await grant_reward(interaction.user.id, "adventure", lambda user: reward, guild=guild, cooldown="adventure")
+    if result.remaining:
+        await interaction.response.send_message(f"❌ You can adventure again in **{readable_time_delta(result.remaining)}**", ephemeral=True)
+        return
+    if isinstance(found, int):
+        msg = f"🧭 {label}: {found}{currency_symbol(guild)}"
     else:
-        item = pick[1]
-        user.setdefault('items', {}).setdefault(item, 0)
-        user['items'][item] += 1
-        await update_user(interaction.user.id, user)
-        await interaction.response.send_message(f"🧭 {pick[0]}: gained **{item}**!")
+        msg = f"🧭 {label}: gained **{found}**!"
+    await interaction.response.send_message(msg + describe_reward(result, guild))
+
+# simplified static quests, completed once each; progress is the record's stats[stat]
+QUESTS = (
+    {"id": "first_steps", "name": "First Steps", "stat": "work", "goal": 5, "coins": 1000},
+    {"id": "treasure_hunter", "name": "Treasure Hunter", "stat": "adventure", "goal": 3, "item": LOOT_ITEMS[0]},
+)
+QUESTS_BY_STAT: Dict[str, List[dict]] = {}
+for _quest in QUESTS:
+    QUESTS_BY_STAT.setdefault(_quest["stat"], []).append(_quest)
 
 @tree.command(name="quests", description="Show current quests")
 async def slash_quests(interaction: discord.Interaction):
-    # simplified static quests
-    embed = make_embed("🧭 Quests", "Active quests & rewards")
-    embed.add_field(name="First Steps", value="Do /work 5 times — Reward: 1000", inline=False)
-    embed.add_field(name="Treasure Hunter", value="Do /adventure 3 times — Reward: item", inline=False)
-    await interaction.response.send_message(embed=embed)
+    def build():
+        embed = make_embed("🧭 Quests", "Active quests & rewards")
+        for quest in QUESTS:
+            prize = quest["coins"] if quest.get("coins") else quest["item"]
+            embed.add_field(name=quest["name"], value=f"Do /{quest['stat']} {quest['goal']} times — Reward: {prize}", inline=False)
+        return embed
+    await interaction.response.send_message(embed=cached_embed("quests", None, 0, build))
 
 @tree.command(name="achievements", description="Show achievements")
 async def slash_achievements(interaction: discord.Interaction):
     # placeholder achievements
     await interaction.response.send_message("🏆 Achievements: Beginner, Worker, Explorer (demo)")
 
+# -----------------------------
+# Instrumentation: wrap every app command callback once all are registered.
+# The text bridge calls the same callbacks, so it is measured too.
+# -----------------------------
+def instrument_command(name: str, callback):
+    @functools.wraps(callback)
+    async def wrapper(interaction, *args, **kwargs):
+        source = "text" if isinstance(interaction, DummyInteraction) else "slash"
+        outcome = "ok"
+        start = time.perf_counter()
+        try:
+            return await callback(interaction, *args, **kwargs)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            COMMAND_LATENCY.observe(time.perf_counter() - start, command=name, source=source)
+            COMMAND_CALLS.inc(command=name, source=source, outcome=outcome)
+    return wrapper
+
+# -----------------------------
+# Response guard: Discord drops interactions that aren't acknowledged within
+# 3 seconds. Heavy commands defer up front; everything else is deferred by a
+# timer after DEFER_AFTER seconds. Once deferred, response.send_message goes
+# out as a followup, so handlers don't need to know either way. A deferral is
+# as private as the command's normal reply; a reply whose visibility differs
+# (say an ephemeral error from a public command) replaces the placeholder.
+# -----------------------------
+# commands that can reload or scan shared state before replying
+HEAVY_COMMANDS = frozenset({"leaderboard", "sell", "market sell", "market buy", "market list", "market orders", "market cancel"})
+# commands whose normal reply is private; a deferral must be private too
+EPHEMERAL_COMMANDS = frozenset({"premium", "premium_grant", "settings", "settings_toggle", "settings_cooldowns",
+                                "market orders", "market cancel"})
+
+class GuardedResponse:
+    """Wraps Interaction.response (or DummyResp); unknown attributes pass through."""
+    __slots__ = ("_interaction", "_response", "_followup", "_lock", "_ephemeral", "_placeholder", "deferred")
+
+    def __init__(self, interaction, ephemeral: bool = False):
+        self._interaction = interaction
+        self._response = interaction.response
+        self._followup = interaction.followup
+        self._lock = asyncio.Lock()   # a deferral and the first reply must not interleave
+        self._ephemeral = ephemeral   # visibility of the deferral's "thinking" message
+        self._placeholder = False     # that message is still showing
+        self.deferred = False
+
+    async def defer_now(self) -> bool:
+        async with self._lock:
+            if self._response.is_done():
+                return False
+            await self._response.defer(ephemeral=self._ephemeral, thinking=True)
+            self.deferred = self._placeholder = True
+            return True
+
+    async def send_message(self, content=None, **kwargs):
+        async with self._lock:
+            if not self.deferred:
+                return await self._response.send_message(content, **kwargs)
+            kwargs.pop("delete_after", None)
+            if self._placeholder and bool(kwargs.get("ephemeral")) != self._ephemeral:
+                # the first followup would take over the placeholder and its
+                # visibility; remove it so the reply keeps the one it asked for
+                await self._interaction.delete_original_response()
+            self._placeholder = False
+        await self._followup.send(content, **{k: v for k, v in kwargs.items() if v is not None})
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+class GuardedInteraction:
+    """Interaction proxy whose response is a GuardedResponse."""
+    __slots__ = ("_interaction", "response")
+
+    def __init__(self, interaction, ephemeral: bool = False):
+        self._interaction = interaction
+        self.response = GuardedResponse(interaction, ephemeral)
+
+    def __getattr__(self, name):
+        return getattr(self._interaction, name)
+
+def guard_response(name: str, callback):
+    heavy = name in HEAVY_COMMANDS
+    ephemeral = name in EPHEMERAL_COMMANDS
+
+    @functools.wraps(callback)
+    async def wrapper(interaction, *args, **kwargs):
+        guarded = GuardedInteraction(interaction, ephemeral)
+        if heavy and await guarded.response.defer_now():
+            COMMAND_DEFERRED.inc(command=name, reason="heavy")
+            return await callback(guarded, *args, **kwargs)
+
+        def late():
+            if not guarded.response.is_done():
+                asyncio.ensure_future(defer_late())
+
+        async def defer_late():
+            try:
+                if await guarded.response.defer_now():
+                    COMMAND_DEFERRED.inc(command=name, reason="slow")
+            except discord.HTTPException as e:
+                print(f"[WARN] could not defer /{name}: {e}")
+
+        timer = asyncio.get_running_loop().call_later(DEFER_AFTER, late)
+        try:
+            return await callback(guarded, *args, **kwargs)
+        finally:
+            timer.cancel()
+    return wrapper
+
+for _cmd in tree.walk_commands():
+    if isinstance(_cmd, app_commands.Command):
+        _callback = guard_response(_cmd.qualified_name, _cmd._callback)
+        _cmd._callback = instrument_command(_cmd.qualified_name, _callback)
+
 # -----------------------------
 # Local text-prefix command bridge for premium servers
 # We manually parse messages that start with the server's configured prefix
@@ -945,19 +2005,24 @@ TEXT_COMMAND_MAP = {
     "withdraw": "withdraw",
     "transfer": "transfer",
     "work": "work",
+    "daily": "daily",
     "vework": "work",
     "profile": "profile",
     "veprofile": "profile",
     "leaderboard": "leaderboard",
     "veleaderboard": "leaderboard",
     "inventory": "inventory",
+    "shop": "shop",
+    "buy": "buy",
     "use": "use",
     "sell": "sell",
     "adventure": "adventure",
     "quests": "quests",
     "achievements": "achievements",
     "business": "business",   # needs parsing of subcommands
-    "market": "market",       # not fully implemented
+    "vebusiness": "business",
+    "market": "market",
+    "vemarket": "market",
     "settings": "settings"
 }
 
@@ -966,162 +2031,241 @@ def split_args(content: str) -> List[str]:
     parts = content.strip().split()
     return parts
 
+# channel sends from the text bridge are queued, rate limited and coalesced
+outbound = SendScheduler()
+
+# -----------------------------
+# Interaction adapter for text commands (defined once, reused per message)
+# -----------------------------
+class DummyResp:
+    """Stands in for Interaction.response; replies are queued for the message's channel."""
+    __slots__ = ("msg", "sent")
+
+    def __init__(self, msg: discord.Message):
+        self.msg = msg
+        self.sent = False
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        # ephemeral and views are ignored in channels
+        if embed is not None or content is not None:
+            outbound.post(self.msg.channel, content, embed=embed)
+        self.sent = True
+
+    send = send_message
+
+    async def defer(self, **kwargs):
+        # nothing to acknowledge for a message; the reply arrives via followup (this object)
+        self.sent = True
+
+    def is_done(self) -> bool:
+        return self.sent
+
+class DummyInteraction:
+    """Mimics enough of discord.Interaction for the slash callbacks."""
+    __slots__ = ("guild", "user", "channel", "message", "response")
+
+    def __init__(self, message: discord.Message):
+        self.guild = message.guild
+        self.user = message.author
+        self.channel = message.channel
+        self.message = message
+        self.response = DummyResp(message)
+
+    @property
+    def followup(self) -> DummyResp:
+        return self.response
+
+    async def delete_original_response(self):
+        # a deferred text command never posted anything to delete
+        pass
+
+def make_dummy_interaction_from_message(message: discord.Message) -> DummyInteraction:
+    return DummyInteraction(message)
+
+# -----------------------------
+# Argument parsers: (message, args) -> kwargs for the callback (or a coroutine
+# returning them, for parsers that have to look something up)
+# -----------------------------
+class TextUsageError(Exception):
+    """Raised by a parser; the message is sent back to the channel."""
+
+def no_args(message: discord.Message, args: List[str]) -> dict:
+    return {}
+
+def amount_arg(message: discord.Message, args: List[str]) -> dict:
+    if not args:
+        raise TextUsageError("Provide amount.")
+    try:
+        return {"amount": int(args[0])}
+    except ValueError:
+        raise TextUsageError("Invalid amount.")
+
+def author_member(message: discord.Message, args: List[str]) -> dict:
+    return {"member": message.author}
+
+def mentioned_or_author(message: discord.Message, args: List[str]) -> dict:
+    return {"member": message.mentions[0] if message.mentions else message.author}
+
+MENTION_ID = re.compile(r"<@!?(\d+)>|(\d+)")
+
+async def transfer_args(message: discord.Message, args: List[str]) -> dict:
+    if len(args) < 2:
+        raise TextUsageError("Usage: <prefix>transfer @user amount")
+    try:
+        amount = int(args[-1])
+    except ValueError:
+        raise TextUsageError("Could not parse target or amount.")
+    if message.mentions:
+        return {"member": message.mentions[0], "amount": amount}
+    # a bare id: without the members intent the cache is empty, so ask the API
+    found = MENTION_ID.fullmatch(args[0])
+    if not found:
+        raise TextUsageError("Could not parse target or amount.")
+    uid = int(found.group(1) or found.group(2))
+    guild = message.guild
+    target = guild.get_member(uid)
+    if target is None:
+        try:
+            target = await guild.fetch_member(uid)
+        except discord.NotFound:
+            raise TextUsageError("That user isn't in this server.")
+        except discord.HTTPException:
+            raise TextUsageError("Could not look up that user, try again.")
+        note_member(guild, target)
+    return {"member": target, "amount": amount}
+
+def item_arg(message: discord.Message, args: List[str]) -> dict:
+    if not args:
+        raise TextUsageError("Provide item name.")
+    return {"item": " ".join(args)}
+
+def sell_args(message: discord.Message, args: List[str]) -> dict:
+    if len(args) < 2:
+        raise TextUsageError("Usage: <prefix>sell item price")
+    try:
+        return {"item": " ".join(args[:-1]), "price": int(args[-1])}
+    except ValueError:
+        raise TextUsageError("Invalid price.")
+
+def page_arg(message: discord.Message, args: List[str]) -> dict:
+    if args and args[0].isdigit():
+        return {"page": int(args[0])}
+    return {}
+
+def raw_args(message: discord.Message, args: List[str]) -> dict:
+    return {"args": args}
+
+BUSINESS_USAGE = "Usage: business list | buy <name> | claim | info <name>"
+
+async def business_text(interaction, args: List[str]):
+    # text form of the /business group: <prefix>business <sub> [name]
+    sub = args[0].lower() if args else ""
+    name = " ".join(args[1:])
+    if sub == "list":
+        await business_list.callback(interaction)
+    elif sub == "claim":
+        await business_claim.callback(interaction)
+    elif sub == "buy" and name:
+        await business_buy.callback(interaction, name)
+    elif sub == "info" and name:
+        await business_info.callback(interaction, name)
+    else:
+        outbound.post(interaction.channel, BUSINESS_USAGE)
+
+MARKET_USAGE = ("Usage: market list [item] [page] | buy <item> <price> [qty] | "
+                "sell <item> <price> [qty] | orders [page] | cancel <id>")
+
+async def market_text(interaction, args: List[str]):
+    # text form of the /market group
+    sub = args[0].lower() if args else ""
+    rest = args[1:]
+    try:
+        numbers = [int(a) for a in rest[1:]]
+        if sub == "list":
+            item = rest[0] if rest and not rest[0].isdigit() else None
+            page = int(rest[-1]) if rest and rest[-1].isdigit() else 1
+            await market_list.callback(interaction, item, page)
+        elif sub in ("buy", "sell") and rest and 1 <= len(numbers) <= 2:
+            cb = market_buy if sub == "buy" else market_sell
+            await cb.callback(interaction, rest[0], *numbers)
+        elif sub == "orders":
+            await market_orders.callback(interaction, int(rest[0]) if rest else 1)
+        elif sub == "cancel" and len(rest) == 1:
+            await market_cancel.callback(interaction, int(rest[0].lstrip("#")))
+        else:
+            outbound.post(interaction.channel, MARKET_USAGE)
+    except ValueError:
+        outbound.post(interaction.channel, MARKET_USAGE)
+
+# command name -> (callback, argument parser)
+TEXT_HANDLERS = {
+    "balance": (slash_balance.callback, author_member),
+    "deposit": (slash_deposit.callback, amount_arg),
+    "withdraw": (slash_withdraw.callback, amount_arg),
+    "transfer": (slash_transfer.callback, transfer_args),
+    "work": (slash_work.callback, no_args),
+    "profile": (slash_profile.callback, mentioned_or_author),
+    "leaderboard": (slash_leaderboard.callback, page_arg),
+    "inventory": (slash_inventory.callback, page_arg),
+    "shop": (shop.callback, no_args),
+    "buy": (buy.callback, item_arg),
+    "use": (slash_use.callback, item_arg),
+    "sell": (slash_sell.callback, sell_args),
+    "adventure": (slash_adventure.callback, no_args),
+    "daily": (slash_daily.callback, no_args),
+    "quests": (slash_quests.callback, no_args),
+    "achievements": (slash_achievements.callback, no_args),
+    "business": (business_text, raw_args),
+    "market": (market_text, raw_args),
+    "settings": (settings.callback, no_args),
+}
+
+# alias -> (callback, parser), resolved once at import
+TEXT_DISPATCH = {alias: TEXT_HANDLERS.get(name) for alias, name in TEXT_COMMAND_MAP.items()}
+
 @bot.event
 async def on_message(message: discord.Message):
-    # ignore bots
-    if message.author.bot:
+    # fast path: everything here is attribute access and cached lookups
+    guild = message.guild
+    if guild is None or message.author.bot:
         return
-    # handle text prefix commands only in guilds
-    if not message.guild:
+    prefix = get_server_prefix(guild.id)
+    if not prefix or not message.content.startswith(prefix):
         return
-    prefix = get_server_prefix(message.guild.id)
-    if not prefix:
-        # no prefix enabled for this server (non-premium), do not treat text commands
+    parts = split_args(message.content[len(prefix):])
+    if not parts:
         return
-    # prefix may be multi-char; check start
-    if not message.content.startswith(prefix):
-        # also support prefix with mention of bot optionally? not necessary
+    cmd = parts[0].lower()
+    if cmd not in TEXT_DISPATCH:
         return
-    # parse
-    content = message.content[len(prefix):].strip()
-    if not content:
+    entry = TEXT_DISPATCH[cmd]
+    if entry is None:
+        outbound.post(message.channel, "Command mapping not implemented yet.")
         return
-    parts = split_args(content)
-    cmd = parts[0].lower()
-    args = parts[1:]
-    # map cmd
-    mapped = TEXT_COMMAND_MAP.get(cmd)
-    if not mapped:
-        # maybe subcommands like vebusiness buy
-        if cmd in ("vebusiness", "business"):
-            # parse subcommand
-            if len(args) == 0:
-                await message.channel.send("Usage: business list | buy <name> | claim | info <name>")
-                return
-            sub = args[0].lower()
-            if sub in ("list",):
-                # call slash-like handler
-                # call business_list
-                await business_list._callback(await make_dummy_interaction_from_message(message))
-                return
-            if sub == "buy" and len(args) >= 2:
-                name = " ".join(args[1:])
-                # make a dummy interaction to call same handler
-                inter = await make_dummy_interaction_from_message(message)
-                await business_buy._callback(inter, name)
-                return
+    # "<name> <first arg>" also catches disabled group subcommands such as "business claim"
+    name = TEXT_COMMAND_MAP[cmd]
+    qualified = f"{name} {parts[1].lower()}" if len(parts) > 1 else name
+    if command_disabled(guild.id, qualified):
+        blocked = qualified if qualified in guild_settings(guild.id).disabled else name
+        outbound.post(message.channel, f"⚠️ The command `{blocked}` is currently disabled on this server.")
         return
-    # Now dispatch mapped command by calling corresponding handler via app_commands or direct functions
+    callback, parser = entry
     try:
-        inter = await make_dummy_interaction_from_message(message)
-        # mapping to call
-        if mapped == "balance":
-            await slash_balance._callback(inter, member=message.author)
-        elif mapped == "deposit":
-            if not args:
-                await message.channel.send("Provide amount.")
-            else:
-                try:
-                    amt = int(args[0])
-                    await slash_deposit._callback(inter, amount=amt)
-                except Exception:
-                    await message.channel.send("Invalid amount.")
-        elif mapped == "withdraw":
-            if not args:
-                await message.channel.send("Provide amount.")
-            else:
-                try:
-                    amt = int(args[0])
-                    await slash_withdraw._callback(inter, amount=amt)
-                except Exception:
-                    await message.channel.send("Invalid amount.")
-        elif mapped == "transfer":
-            if len(args) < 2:
-                await message.channel.send("Usage: <prefix>transfer @user amount")
-            else:
-                # try to resolve user mention or id
-                target = None
-                try:
-                    if message.mentions:
-                        target = message.mentions[0]
-                        amt = int(args[-1])
-                    else:
-                        target = message.guild.get_member(int(args[0]))
-                        amt = int(args[1])
-                    await slash_transfer._callback(inter, member=target, amount=amt)
-                except Exception:
-                    await message.channel.send("Could not parse target or amount.")
-        elif mapped == "work":
-            await slash_work._callback(inter)
-        elif mapped == "profile":
-            # optional mention
-            target = message.author
-            if message.mentions:
-                target = message.mentions[0]
-            await slash_profile._callback(inter, member=target)
-        elif mapped == "leaderboard":
-            await slash_leaderboard._callback(inter)
-        elif mapped == "inventory":
-            await slash_inventory._callback(inter)
-        elif mapped == "use":
-            if not args:
-                await message.channel.send("Provide item name.")
-            else:
-                item = " ".join(args)
-                await slash_use._callback(inter, item=item)
-        elif mapped == "sell":
-            if len(args) < 2:
-                await message.channel.send("Usage: <prefix>sell item price")
-            else:
-                item = " ".join(args[:-1])
-                try:
-                    price = int(args[-1])
-                    await slash_sell._callback(inter, item=item, price=price)
-                except Exception:
-                    await message.channel.send("Invalid price.")
-        elif mapped == "adventure":
-            await slash_adventure._callback(inter)
-        elif mapped == "quests":
-            await slash_quests._callback(inter)
-        elif mapped == "achievements":
-            await slash_achievements._callback(inter)
-        elif mapped == "settings":
-            await settings._callback(inter)
-        else:
-            await message.channel.send("Command mapping not implemented yet.")
+        kwargs = parser(message, parts[1:])
+        if asyncio.iscoroutine(kwargs):
+            kwargs = await kwargs
+    except TextUsageError as e:
+        outbound.post(message.channel, str(e))
+        return
+    note_member(guild, message.author)
+    start = time.perf_counter()
+    try:
+        await callback(DummyInteraction(message), **kwargs)
     except Exception as e:
         # debugging
-        await message.channel.send(f"Error dispatching command: {e}")
-
-# helper: build a fake Interaction-like object for calling slash callbacks from text
-async def make_dummy_interaction_from_message(message: discord.Message):
-    """
-    Create a very small object that mimics enough of discord.Interaction for our callbacks.
-    We supply `guild`, `user`, `channel`, and wrappers to send a response via message.channel.send.
-    """
-    class DummyResp:
-        def __init__(self, msg: discord.Message):
-            self.msg = msg
-            self.sent = False
-        async def send(self, *args, **kwargs):
-            # emulate Interaction.response.send_message by replying in channel
-            # ephemeral ignored
-            content = kwargs.get("content")
-            embed = kwargs.get("embed")
-            view = kwargs.get("view")
-            if embed is not None:
-                await self.msg.channel.send(embed=embed)
-            elif content is not None:
-                await self.msg.channel.send(content)
-            self.sent = True
-    class DummyInteraction:
-        def __init__(self, message):
-            self.guild = message.guild
-            self.user = message.author
-            self.channel = message.channel
-            self.message = message
-            self.response = DummyResp(message)
-    return DummyInteraction(message)
+        outbound.post(message.channel, f"Error dispatching command: {e}")
+    finally:
+        COMMAND_LATENCY.observe(time.perf_counter() - start, command=f"bridge:{cmd}", source="text")
 
 # -----------------------------
 # Robust command-block safety: check disabled commands
@@ -1131,16 +2275,11 @@ async def global_command_block(ctx):
     # allow dms
     if ctx.guild is None:
         return True
-    # allow help always
-    if ctx.command and ctx.command.name in ("help",):
-        return True
-    servers = load_json("servers")
-    server_entry = servers.get(str(ctx.guild.id), {})
-    disabled = server_entry.get("disabled_commands", [])
-    cmd_name = ctx.command.name if ctx.command else None
+    # help and settings are always allowed (ALWAYS_ENABLED)
+    cmd_name = ctx.command.qualified_name if ctx.command else None
     if not cmd_name:
         return True
-    if cmd_name in disabled:
+    if command_disabled(ctx.guild.id, cmd_name):
         try:
             await ctx.send(f"⚠️ The command `{cmd_name}` is currently disabled on this server.")
         except Exception:
@@ -1150,27 +2289,161 @@ async def global_command_block(ctx):
     return True
 
 # -----------------------------
-# On ready
+# Keep per-guild leaderboards in step with membership
+# -----------------------------
+@bot.listen("on_interaction")
+async def note_interaction_member(interaction: discord.Interaction):
+    note_member(interaction.guild, interaction.user)
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    leaderboard.add_member(str(member.guild.id), str(member.id))
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    leaderboard.remove_member(str(member.guild.id), str(member.id))
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    leaderboard.drop_guild(str(guild.id))
+
+# -----------------------------
+# Event-loop lag monitor & health
+# -----------------------------
+loop_lag_seen = 0.0   # monotonic time of the last lag sample
+lag_task: Optional[asyncio.Task] = None
+
+async def monitor_loop_lag():
+    # a sleep that wakes up late means something blocked the loop
+    global loop_lag_seen
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_HIST.observe(lag)
+        loop_lag_seen = time.monotonic()
+
+def health_status():
+    latency = bot.latency
+    lag = LOOP_LAG.get()
+    monitor_age = time.monotonic() - loop_lag_seen if loop_lag_seen else None
+    detail = {
+        "gateway_ready": bot.is_ready(),
+        "gateway_closed": bot.is_closed(),
+        "gateway_latency": latency if math.isfinite(latency) else None,
+        "loop_lag": lag,
+        "loop_monitor_age": monitor_age,
+        "outbound_queue": outbound.queue_depth,
+        "shards": SHARD_IDS or (list(range(SHARD_COUNT)) if SHARD_COUNT else None),
+    }
+    healthy = (
+        detail["gateway_ready"] and not detail["gateway_closed"]
+        and lag < LOOP_LAG_UNHEALTHY
+        and monitor_age is not None and monitor_age < LOOP_LAG_INTERVAL * 4 + LOOP_LAG_UNHEALTHY
+    )
+    detail["status"] = "ok" if healthy else "degraded"
+    return healthy, detail
+
+REGISTRY.gauge("vrtex_outbound_queue_depth", "Queued text-bridge messages", lambda: outbound.queue_depth)
+REGISTRY.gauge("vrtex_outbound_latency_p99_seconds", "p99 enqueue-to-send latency", lambda: outbound.latency_quantile(0.99))
+REGISTRY.gauge("vrtex_leaderboard_users", "Users in the leaderboard index", lambda: len(leaderboard.ranking))
+REGISTRY.gauge("vrtex_active_user_locks", "Users with an open transaction", lambda: len(user_locks))
+REGISTRY.gauge("vrtex_maintenance_scheduled", "Pending expirations in the maintenance heap", lambda: len(maintenance))
+REGISTRY.gauge("vrtex_embed_cache_entries", "Rendered embeds in the LRU cache", lambda: len(embed_cache))
+REGISTRY.gauge("vrtex_embed_cache_hits", "Embed cache hits since start", lambda: embed_cache.hits)
+REGISTRY.gauge("vrtex_embed_cache_misses", "Embed cache misses since start", lambda: embed_cache.misses)
+REGISTRY.gauge("vrtex_name_cache_entries", "Display names in the LRU name cache", lambda: len(name_cache))
+REGISTRY.gauge("vrtex_guild_cache_entries", "Cached guild settings", lambda: len(guild_cache))
+REGISTRY.gauge("vrtex_gateway_latency_seconds", "Gateway heartbeat latency", lambda: bot.latency)
+
+# -----------------------------
+# HTTP API (served in-loop straight from the in-memory state)
+# -----------------------------
+class BotEconomyAPI(EconomyAPI):
+    def balance(self, user_id: str) -> Optional[dict]:
+        user = backend.get_user(user_id)
+        if user is None:
+            return None
+        wallet, bank = user.wallet, user.bank
+        return {"user_id": user_id, "wallet": wallet, "bank": bank, "total": wallet + bank,
+                "rank": global_ranking().rank(user_id)}
+
+    def leaderboard(self, limit: int, offset: int, guild_id: Optional[str]) -> Optional[list]:
+        if guild_id:
+            guild = bot.get_guild(int(guild_id)) if guild_id.isdigit() else None
+            if guild is None:
+                return None
+            index = guild_ranking(guild)
+        else:
+            index = global_ranking()
+        return [{"rank": offset + i + 1, "user_id": uid, "total": total}
+                for i, (uid, total) in enumerate(index.page(offset, limit))]
+
+    def user_record(self, user_id: str) -> Optional[dict]:
+        user = backend.get_user(user_id)
+        return user.to_dict() if user is not None else None
+
+    def guild_settings(self, guild_id: str) -> Optional[dict]:
+        if not guild_id.isdigit():
+            return None
+        gs = guild_settings(int(guild_id))
+        return {"guild_id": guild_id, "currency_name": gs.currency_name, "currency_symbol": gs.currency_symbol,
+                "premium": gs.has_premium, "premium_expires": gs.premium_expires or None,
+                "prefix": gs.active_prefix}
+
+    async def flush(self) -> dict:
+        dirty = store.dirty
+        ledger.flush()
+        await store.flush_async()
+        return {"flushed": dirty, "ledger_seq": ledger.seq}
+
+web_runner = None
+
+def prepare_state():
+    """One-time state setup before serving commands: ledger recovery and the rank index."""
+    recover_ledger()
+    if not SHARED_STATE:
+        get_leaderboard()
+    # the loaded documents live as long as the process; keep full collections
+    # from rescanning them (each scan is a stall on the loop and the writers)
+    gc.freeze()
+
+def tree_hash() -> str:
+    payload = [cmd.to_dict(tree) for cmd in tree.get_commands()]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+async def sync_tree():
+    # commands are global; one process uploading them is enough, and only when they changed
+    if SHARED_STATE and 0 not in SHARD_IDS:
+        return
+    digest = tree_hash()
+    if backend.get_meta("tree_hash") == digest:
+        print("🌳 Command tree unchanged; skipping sync")
+        return
+    await tree.sync()
+    backend.put_meta("tree_hash", digest)
+    print(f"🌳 Synced {len(tree.get_commands())} commands")
+
+@bot.event
+async def setup_hook():
+    # runs once per process, after login and before the gateway connects
+    global web_runner, lag_task
+    prepare_state()
+    flush_store.start()
+    compact_ledger.start()
+    run_maintenance.start()
+    lag_task = asyncio.get_running_loop().create_task(monitor_loop_lag())
+    web_runner = await start_web_server(create_app(health_status, BotEconomyAPI(), ADMIN_TOKEN), WEB_HOST, WEB_PORT)
+    print(f"🌐 HTTP server listening on {WEB_HOST}:{WEB_PORT}")
+    await sync_tree()
+
+# -----------------------------
+# On ready (fires again on every reconnect, so it only logs)
 # -----------------------------
 @bot.event
 async def on_ready():
-    await tree.sync()  # register slash commands globally (or restrict later)
-    print(f"✅ Logged in as {bot.user} (id: {bot.user.id})")
-    print("💾 JSON storage ready")
-    # ensure economy file entries exist for guilds bot is in
-    econ = load_json("economy")
-    updated = False
-    for g in bot.guilds:
-        if str(g.id) not in econ:
-            econ[str(g.id)] = {
-                "currency_name": "Coins",
-                "currency_symbol": "$",
-                "starting_balance": 0,
-                "tax_rate": 0
-            }
-            updated = True
-    if updated:
-        save_json("economy", econ)
+    print(f"✅ Logged in as {bot.user} (id: {bot.user.id})" + (f" shards {SHARD_IDS}" if SHARED_STATE else ""))
 
 # -----------------------------
 # Run bot
@@ -1179,5 +2452,11 @@ if __name__ == "__main__":
     if not TOKEN:
         print("ERROR: DISCORD_TOKEN environment variable not set.")
     else:
-        bot.run(TOKEN)
+        try:
+            bot.run(TOKEN)
+        finally:
+            # write back anything still dirty on shutdown
+            ledger.close()
+            backend.close()
+            store.close()
 
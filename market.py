@@ -0,0 +1,223 @@
+# market.py
+# Player-to-player order book.
+#
+# Every item has two sides: asks (sell orders) sorted by (price, order id)
+# and bids (buy orders) sorted by (-price, order id), i.e. price-time
+# priority. Both sides are RankIndex instances from leaderboard.py, so
+# inserts, cancels, best-price lookups and page(offset, limit) are O(log n).
+# Open orders are also indexed by owner for "my orders".
+#
+# The Market object only keeps the books; escrow (coins for bids, items for
+# asks) and settlement are done by the caller inside a user transaction.
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from leaderboard import RankIndex
+
+ASK = "ask"
+BID = "bid"
+
+
+class Order:
+    __slots__ = ("id", "side", "item", "user_id", "price", "quantity", "created")
+
+    def __init__(self, order_id: Optional[int], side: str, item: str, user_id: str, price: int, quantity: int,
+                 created: Optional[int] = None):
+        self.id = order_id          # assigned by the storage backend on insert
+        self.side = side
+        self.item = item
+        self.user_id = user_id
+        self.price = price          # per unit
+        self.quantity = quantity    # still open
+        self.created = int(time.time()) if created is None else created
+
+    def to_dict(self) -> list:
+        # compact row form; also what the JSON encoder hook writes for market.json
+        return [self.id, self.side, self.item, self.user_id, self.price, self.quantity, self.created]
+
+    @classmethod
+    def from_row(cls, row) -> "Order":
+        order_id, side, item, user_id, price, quantity, created = row
+        return cls(int(order_id), side, item, str(user_id), int(price), int(quantity), int(created))
+
+    def __repr__(self):
+        return f"Order({self.id}, {self.side}, {self.item!r}, {self.quantity}@{self.price})"
+
+
+class Fill:
+    """One match between the incoming order and a resting (maker) order."""
+    __slots__ = ("maker", "quantity", "price")
+
+    def __init__(self, maker: Order, quantity: int, price: int):
+        self.maker = maker
+        self.quantity = quantity
+        self.price = price   # executes at the maker's price
+
+
+class OrderBook:
+    __slots__ = ("asks", "bids")
+
+    def __init__(self):
+        self.asks = RankIndex()   # score -price -> key (price, id)
+        self.bids = RankIndex()   # score  price -> key (-price, id)
+
+    def side(self, side: str) -> RankIndex:
+        return self.asks if side == ASK else self.bids
+
+    def add(self, order: Order):
+        self.side(order.side).update(order.id, -order.price if order.side == ASK else order.price)
+
+    def remove(self, order: Order):
+        self.side(order.side).discard(order.id)
+
+    def best(self, side: str) -> Optional[int]:
+        """Best price on `side`, or None when empty."""
+        top = self.side(side).top(1)
+        if not top:
+            return None
+        return -top[0][1] if side == ASK else top[0][1]
+
+    def __len__(self):
+        return len(self.asks) + len(self.bids)
+
+
+class Market:
+    def __init__(self):
+        self.orders: Dict[int, Order] = {}
+        self.books: Dict[str, OrderBook] = {}
+        self.by_user: Dict[str, Set[int]] = {}
+        self.loaded = False
+        self.version = None   # backend change counter this state was loaded at
+
+    def load(self, orders: Iterable[Order]):
+        self.orders.clear()
+        self.books.clear()
+        self.by_user.clear()
+        for order in orders:
+            self.add(order)
+        self.loaded = True
+
+    def apply(self, changes: Iterable[Tuple[int, Optional[Order]]]):
+        """Bring changed orders up to date (None: the order is gone)."""
+        for order_id, order in changes:
+            current = self.orders.get(order_id)
+            if current is not None:
+                self.remove(current)
+            if order is not None:
+                self.add(order)
+
+    # -----------------------------
+    # Book maintenance
+    # -----------------------------
+    def add(self, order: Order):
+        self.orders[order.id] = order
+        book = self.books.get(order.item)
+        if book is None:
+            book = self.books[order.item] = OrderBook()
+        book.add(order)
+        self.by_user.setdefault(order.user_id, set()).add(order.id)
+
+    def remove(self, order: Order):
+        self.orders.pop(order.id, None)
+        book = self.books.get(order.item)
+        if book is not None:
+            book.remove(order)
+            if not len(book):
+                del self.books[order.item]
+        ids = self.by_user.get(order.user_id)
+        if ids is not None:
+            ids.discard(order.id)
+            if not ids:
+                del self.by_user[order.user_id]
+
+    # -----------------------------
+    # Matching
+    # -----------------------------
+    def match(self, side: str, item: str, user_id: str, price: int, quantity: int) -> List[Fill]:
+        """Plan fills for an incoming order without changing the book.
+
+        Walks the opposite side from the best price while it crosses `price`.
+        Matching stops at the taker's own resting order (self-trade
+        prevention); the caller must then not rest a remainder that still
+        crosses(), or the book would be left crossed.
+        """
+        book = self.books.get(item)
+        if book is None:
+            return []
+        opposite = book.side(BID if side == ASK else ASK)
+        fills: List[Fill] = []
+        offset = 0
+        while quantity > 0:
+            chunk = opposite.page(offset, 32)
+            if not chunk:
+                break
+            for order_id, _ in chunk:
+                maker = self.orders[order_id]
+                if (side == ASK and maker.price < price) or (side == BID and maker.price > price):
+                    return fills
+                if maker.user_id == user_id:
+                    return fills
+                qty = min(quantity, maker.quantity)
+                fills.append(Fill(maker, qty, maker.price))
+                quantity -= qty
+                if not quantity:
+                    return fills
+            offset += len(chunk)
+        return fills
+
+    def crosses(self, side: str, item: str, price: int, fills: List[Fill] = ()) -> bool:
+        """Would an order at `price` still trade if it rested once `fills` are settled?"""
+        book = self.books.get(item)
+        if book is None:
+            return False
+        consumed = {f.maker.id for f in fills if f.quantity >= f.maker.quantity}
+        for order_id, _ in book.side(BID if side == ASK else ASK).page(0, len(consumed) + 1):
+            if order_id in consumed:
+                continue
+            maker = self.orders[order_id]
+            return maker.price >= price if side == ASK else maker.price <= price
+        return False
+
+    def settle(self, fills: List[Fill]) -> Tuple[List[Order], List[Order]]:
+        """Apply planned fills to the book; returns (updated, closed) maker orders."""
+        updated, closed = [], []
+        for fill in fills:
+            maker = fill.maker
+            maker.quantity -= fill.quantity
+            if maker.quantity <= 0:
+                self.remove(maker)
+                closed.append(maker)
+            else:
+                updated.append(maker)
+        return updated, closed
+
+    # -----------------------------
+    # Browsing
+    # -----------------------------
+    def page(self, item: str, side: str, offset: int, limit: int) -> List[Order]:
+        book = self.books.get(item)
+        if book is None:
+            return []
+        return [self.orders[oid] for oid, _ in book.side(side).page(offset, limit)]
+
+    def depth(self, item: str, side: str) -> int:
+        book = self.books.get(item)
+        return len(book.side(side)) if book is not None else 0
+
+    def user_orders(self, user_id: str, offset: int, limit: int) -> List[Order]:
+        ids = sorted(self.by_user.get(user_id, ()))
+        return [self.orders[oid] for oid in ids[offset:offset + limit]]
+
+    def user_order_count(self, user_id: str) -> int:
+        return len(self.by_user.get(user_id, ()))
+
+    def summary(self, offset: int, limit: int) -> List[Tuple[str, Optional[int], Optional[int], int, int]]:
+        """(item, best ask, best bid, asks, bids) per traded item, by item name."""
+        out = []
+        for item in sorted(self.books)[offset:offset + limit]:
+            book = self.books[item]
+            out.append((item, book.best(ASK), book.best(BID), len(book.asks), len(book.bids)))
+        return out
+
+    def __len__(self):
+        return len(self.orders)
@@ -0,0 +1,178 @@
+# outbound.py
+# Per-channel outbound message queue with local rate-limit tracking.
+#
+# Channel sends are queued per channel and drained by one worker task per
+# busy channel. Each channel has a token bucket matching Discord's per-channel
+# limit, and there is one global bucket on top, so bursts wait locally
+# instead of running into 429s. Queued items that are ready at the same time
+# are coalesced into one message (content joined by newlines, embeds
+# appended) as long as the result stays within Discord's limits.
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+MAX_CONTENT = 2000
+MAX_EMBEDS = 10
+
+
+class RateBucket:
+    __slots__ = ("capacity", "per", "tokens", "updated")
+
+    def __init__(self, capacity: int, per: float):
+        self.capacity = capacity
+        self.per = per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.per / self.capacity
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if not wait:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0.0 and self.tokens >= self.capacity
+
+
+class _Item:
+    __slots__ = ("content", "embeds", "future", "enqueued")
+
+    def __init__(self, content: Optional[str], embeds: List, future: Optional[asyncio.Future]):
+        self.content = content
+        self.embeds = embeds
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class SendScheduler:
+    def __init__(self, per_channel: int = 5, per_channel_window: float = 5.0,
+                 global_rate: int = 50, global_window: float = 1.0):
+        self.per_channel = per_channel
+        self.per_channel_window = per_channel_window
+        self._global = RateBucket(global_rate, global_window)
+        self._queues: Dict[int, Deque[_Item]] = {}
+        self._buckets: Dict[int, RateBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # metrics
+        self.sent_messages = 0
+        self.sent_items = 0
+        self.failed_items = 0
+        self.latencies: Deque[float] = deque(maxlen=2048)
+
+    def _enqueue(self, channel, content, embed, embeds, future) -> None:
+        items = list(embeds or ())
+        if embed is not None:
+            items.append(embed)
+        key = channel.id
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        queue.append(_Item(content, items, future))
+        if key not in self._workers:
+            self._workers[key] = asyncio.get_running_loop().create_task(self._drain(channel))
+
+    def post(self, channel, content: Optional[str] = None, *, embed=None, embeds=None):
+        """Queue a message without waiting for delivery (eligible for coalescing)."""
+        self._enqueue(channel, content, embed, embeds, None)
+
+    async def send(self, channel, content: Optional[str] = None, *, embed=None, embeds=None):
+        """Queue a message and wait until the batch containing it has been sent."""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(channel, content, embed, embeds, future)
+        return await future
+
+    @staticmethod
+    def _take_batch(queue: Deque[_Item]) -> List[_Item]:
+        batch = [queue.popleft()]
+        length = len(batch[0].content or "")
+        n_embeds = len(batch[0].embeds)
+        while queue:
+            nxt = queue[0]
+            extra = len(nxt.content or "")
+            if length and extra:
+                extra += 1   # joining newline
+            if length + extra > MAX_CONTENT or n_embeds + len(nxt.embeds) > MAX_EMBEDS:
+                break
+            batch.append(queue.popleft())
+            length += extra
+            n_embeds += len(nxt.embeds)
+        return batch
+
+    async def _drain(self, channel):
+        key = channel.id
+        queue = self._queues[key]
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = RateBucket(self.per_channel, self.per_channel_window)
+        try:
+            while queue:
+                await bucket.acquire()
+                await self._global.acquire()
+                batch = self._take_batch(queue)
+                content = "\n".join(i.content for i in batch if i.content) or None
+                embeds = [e for i in batch for e in i.embeds]
+                try:
+                    if embeds:
+                        msg = await channel.send(content, embeds=embeds)
+                    else:
+                        msg = await channel.send(content)
+                except Exception as e:
+                    self.failed_items += len(batch)
+                    for item in batch:
+                        if item.future is not None and not item.future.done():
+                            item.future.set_exception(e)
+                    if not any(i.future is not None for i in batch):
+                        print(f"[OUTBOUND] send to channel {key} failed: {e!r}")
+                    continue
+                now = time.monotonic()
+                self.sent_messages += 1
+                self.sent_items += len(batch)
+                for item in batch:
+                    self.latencies.append(now - item.enqueued)
+                    if item.future is not None and not item.future.done():
+                        item.future.set_result(msg)
+        finally:
+            self._workers.pop(key, None)
+            if not queue:
+                self._queues.pop(key, None)
+            if len(self._buckets) > 4096:
+                for k in [k for k, b in self._buckets.items() if b.idle and k not in self._workers]:
+                    del self._buckets[k]
+
+    # -----------------------------
+    # Metrics
+    # -----------------------------
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in list(self._queues.values()))
+
+    def latency_quantile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(list(self.latencies))
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "busy_channels": len(self._workers),
+            "sent_messages": self.sent_messages,
+            "sent_items": self.sent_items,
+            "coalesced_items": self.sent_items - self.sent_messages,
+            "failed_items": self.failed_items,
+            "latency_p50": self.latency_quantile(0.5),
+            "latency_p99": self.latency_quantile(0.99),
+        }
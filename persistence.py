@@ -0,0 +1,203 @@
+# persistence.py
+# Crash-safe, non-blocking JSON persistence.
+#
+# Documents are encoded and written on a small thread pool so the event loop
+# (and every shard heartbeat on it) never waits on disk. Each write goes to a
+# temp file that is fsynced and then renamed over the target, so a crash
+# leaves either the old or the new document, never a truncated one.
+#
+# Workers only ever see detached snapshots (see snapshot()): the live
+# documents keep changing on the loop, and encoding one from another thread
+# would write a mix of before and after states.
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Tuple
+
+from metrics import REGISTRY
+
+# timed where the work happens: the writer job here, the backends in storage.py
+STORAGE_LATENCY = REGISTRY.histogram("vrtex_storage_seconds", "Storage reads, writes, transactions and flushes",
+                                     ("op", "doc"))
+
+
+def _detach(value):
+    to_dict = getattr(value, "to_dict", None)
+    if to_dict is not None:
+        return to_dict()   # typed records / orders return fresh containers
+    if isinstance(value, dict):
+        return {k: _detach(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_detach(v) for v in value]
+    return value
+
+
+def snapshot(doc: dict, flat: bool = False) -> dict:
+    """Detached copy of a live document, safe to encode off the loop.
+
+    `flat` documents hold typed records or parsed dicts that are replaced,
+    never edited in place, so only the top level is copied and the records
+    are serialized by the worker.
+    """
+    if flat:
+        return dict(doc)
+    return _detach(doc)
+
+
+def _default(obj):
+    # typed records (records.UserRecord) serialize through their own to_dict()
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_dict()
+
+
+ENCODE_SLICE = 512   # top-level entries per encoder call
+
+
+def _dumps(data) -> str:
+    # compact output keeps the C encoder fast path
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def encode_json(data: dict) -> Iterator[bytes]:
+    """Compact UTF-8 JSON for `data`, in chunks."""
+    if len(data) <= ENCODE_SLICE:
+        yield _dumps(data).encode("utf-8")
+        return
+    # the C encoder holds the GIL for a whole call, so one call over the users
+    # document would stall the event loop until it finished; encode it in
+    # slices and let the loop run in between. The slices are cut lazily: a
+    # list of every (key, value) pair would be enough new objects to start a
+    # full GC pass, which also holds the GIL. Nor are they joined into one
+    # string, which would hold it for the length of the copy
+    entries = iter(data.items())
+    sep = b"{"
+    while True:
+        part = dict(islice(entries, ENCODE_SLICE))
+        if not part:
+            break
+        yield sep + _dumps(part)[1:-1].encode("utf-8")
+        sep = b","
+    yield b"}"
+
+
+def atomic_write(path: str, chunks: Iterable[bytes]):
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    # make the rename itself durable
+    try:
+        dfd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dfd)
+    except OSError:
+        pass
+    finally:
+        os.close(dfd)
+
+
+def atomic_write_json(path: str, data: dict):
+    atomic_write(path, encode_json(data))
+
+
+# update() value for an entry that was removed from the document
+DELETED = object()
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def _join(fragments: Dict[str, str]) -> Iterator[bytes]:
+    values = iter(fragments.values())
+    sep = "{"
+    while True:
+        part = ",".join(islice(values, ENCODE_SLICE))
+        if not part:
+            break
+        yield (sep + part).encode("utf-8")
+        sep = ","
+    yield b"}" if sep == "," else b"{}"
+
+
+class AsyncJsonWriter:
+    """Writes JSON documents off-loop; saves of the same path coalesce.
+
+    save() hands over a whole snapshot() the caller no longer touches;
+    update() only the top-level entries that changed since, which the worker
+    re-encodes and splices into the encoding it kept of the rest. While a
+    write for a path is in flight, further saves merge into the pending
+    payload, so any burst of saves costs at most one extra write.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vrtex-persist")
+        self._pending: Dict[str, Tuple[bool, dict]] = {}   # path -> (whole document?, entries)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # path -> top-level key -> its '"key":value' encoding; only touched by
+        # the one job writing that path at a time
+        self._fragments: Dict[str, Dict[str, str]] = {}
+
+    def save(self, path: str, data: dict) -> asyncio.Task:
+        self._pending[path] = (True, data)
+        return self._schedule(path)
+
+    def update(self, path: str, entries: dict) -> asyncio.Task:
+        """Write the last saved document of `path` with `entries` replaced (DELETED drops one)."""
+        pending = self._pending.get(path)
+        if pending is None:
+            self._pending[path] = (False, entries)
+        else:
+            pending[1].update(entries)
+        return self._schedule(path)
+
+    def _schedule(self, path: str) -> asyncio.Task:
+        task = self._tasks.get(path)
+        if task is None or task.done():
+            task = self._tasks[path] = asyncio.get_running_loop().create_task(self._drain(path))
+        return task
+
+    def _write_job(self, path: str, whole: bool, entries: dict) -> float:
+        start = time.perf_counter()
+        fragments = self._fragments.get(path)
+        if not whole and fragments is None:
+            raise RuntimeError(f"{path}: update() before any save()")
+        if whole:
+            fragments = self._fragments[path] = {}
+        for key, value in entries.items():
+            if value is DELETED:
+                fragments.pop(key, None)
+            else:
+                key = str(key)
+                fragments[key] = f"{_ENCODER.encode(key)}:{_ENCODER.encode(value)}"
+        atomic_write(path, _join(fragments))
+        return time.perf_counter() - start
+
+    async def _drain(self, path: str):
+        loop = asyncio.get_running_loop()
+        doc = os.path.splitext(os.path.basename(path))[0]
+        while path in self._pending:
+            whole, entries = self._pending.pop(path)
+            # timed in the worker, recorded back on the loop
+            elapsed = await loop.run_in_executor(self.executor, self._write_job, path, whole, entries)
+            STORAGE_LATENCY.observe(elapsed, op="write", doc=doc)
+
+    def forget(self, path: str):
+        """Drop the kept encoding of `path` (it was written some other way); the next write must be a save()."""
+        self._fragments.pop(path, None)
+
+    def close(self):
+        """Wait for in-flight writes and write anything still queued."""
+        self.executor.shutdown(wait=True)
+        for path, (whole, entries) in list(self._pending.items()):
+            self._write_job(path, whole, entries)
+        self._pending.clear()
@@ -0,0 +1,194 @@
+# records.py
+# Typed, slotted user records.
+#
+# Records are stored as compact dicts: only fields that differ from their
+# defaults are written, plus "v" (the schema version). Timestamps are epoch
+# seconds and item / job names are interned, so a resident record is a small
+# fixed-size object instead of a dict of ISO strings.
+#
+# Schema versions:
+#   1  legacy, unversioned: ISO timestamps; items either as an "items" dict
+#      (get_user) or as an "inventory" list (the old create_user / buy path)
+#   2  epoch timestamps, items as {item: count} only
+#   3  "work_claims" / "daily_claimed" replaced by "cooldowns": {key: deadline},
+#      see cooldowns.py
+import copy
+import datetime
+import sys
+from typing import Dict, Optional, Tuple
+
+SCHEMA_VERSION = 3
+
+# cooldowns the v2 stamps were checked against, for turning them into deadlines
+LEGACY_WORK_COOLDOWN = 3600
+LEGACY_DAILY_COOLDOWN = 86400
+
+
+def _epoch(value) -> int:
+    """ISO string / number / None -> epoch seconds (0 when unset or unreadable)."""
+    if not value:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        dt = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return 0
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)   # legacy stamps are naive UTC
+    return int(dt.timestamp())
+
+
+def _int(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def migrate(data: dict) -> dict:
+    """Bring a stored user dict up to SCHEMA_VERSION (returns a new dict)."""
+    data = dict(data)
+    version = data.get("v", 1)
+    if version < 2:
+        data["daily_claimed"] = _epoch(data.get("daily_claimed"))
+        data["work_claims"] = {gk: _epoch(ts) for gk, ts in (data.get("work_claims") or {}).items()}
+        items = dict(data.get("items") or {})
+        for item in data.pop("inventory", None) or ():
+            items[item] = items.get(item, 0) + 1
+        data["items"] = items
+        businesses = {}
+        for name, info in (data.get("businesses") or {}).items():
+            info = dict(info)
+            if "last_claimed" in info:
+                info["last_claimed"] = _epoch(info["last_claimed"])
+            businesses[name] = info
+        data["businesses"] = businesses
+    if version < 3:
+        cooldowns = dict(data.get("cooldowns") or {})
+        for gk, ts in (data.pop("work_claims", None) or {}).items():
+            if ts:
+                cooldowns[f"work:{gk}"] = ts + LEGACY_WORK_COOLDOWN
+        daily = data.pop("daily_claimed", None)
+        if daily:
+            cooldowns["daily"] = daily + LEGACY_DAILY_COOLDOWN
+        data["cooldowns"] = cooldowns
+    data["v"] = SCHEMA_VERSION
+    return data
+
+
+class UserRecord:
+    __slots__ = ("wallet", "bank", "xp", "level", "job", "job_rank", "job_streak", "membership",
+                 "cooldowns", "stats", "items", "businesses", "extra")
+
+    # field -> default, in serialization order (containers handled separately)
+    SCALARS = (("wallet", 0), ("bank", 0), ("xp", 0), ("level", 1), ("job", None), ("job_rank", 1),
+               ("job_streak", 0), ("membership", False))
+    CONTAINERS = ("cooldowns", "stats", "items", "businesses")
+
+    def __init__(self):
+        self.wallet = 0
+        self.bank = 0
+        self.xp = 0
+        self.level = 1
+        self.job: Optional[str] = None
+        self.job_rank = 1
+        self.job_streak = 0
+        self.membership = False
+        self.cooldowns: Dict[str, int] = {}   # "action[:guild id]" -> epoch deadline
+        self.stats: Dict[str, int] = {}   # action -> times done; "quest:<id>" -> 1 once completed
+        self.items: Dict[str, int] = {}   # item id -> count
+        self.businesses: Dict[str, dict] = {}
+        self.extra: Optional[dict] = None   # unknown fields, kept verbatim
+
+    # -----------------------------
+    # (De)serialization
+    # -----------------------------
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserRecord":
+        if data.get("v", 1) < SCHEMA_VERSION:
+            data = migrate(data)
+        rec = cls()
+        rec.wallet = _int(data.get("wallet"))
+        rec.bank = _int(data.get("bank"))
+        rec.xp = _int(data.get("xp"))
+        rec.level = _int(data.get("level"), 1)
+        job = data.get("job")
+        rec.job = sys.intern(job) if job else None
+        rec.job_rank = _int(data.get("job_rank"), 1)
+        rec.job_streak = _int(data.get("job_streak"))
+        rec.membership = bool(data.get("membership"))
+        rec.cooldowns = {sys.intern(k): _int(ts) for k, ts in (data.get("cooldowns") or {}).items()}
+        rec.stats = {sys.intern(k): _int(n) for k, n in (data.get("stats") or {}).items()}
+        rec.items = {sys.intern(item): _int(n) for item, n in (data.get("items") or {}).items() if _int(n) > 0}
+        rec.businesses = {sys.intern(name): info for name, info in (data.get("businesses") or {}).items()}
+        known = {"v", *cls.__slots__}
+        extra = {k: v for k, v in data.items() if k not in known}
+        rec.extra = extra or None
+        return rec
+
+    def to_dict(self) -> dict:
+        out = {"v": SCHEMA_VERSION, "wallet": self.wallet, "bank": self.bank}
+        for name, default in self.SCALARS[2:]:
+            value = getattr(self, name)
+            if value != default:
+                out[name] = value
+        for name in self.CONTAINERS:
+            value = getattr(self, name)
+            if value:
+                out[name] = value
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    # -----------------------------
+    # Transaction support
+    # -----------------------------
+    def copy(self) -> "UserRecord":
+        rec = UserRecord.__new__(UserRecord)
+        for name, _ in self.SCALARS:
+            setattr(rec, name, getattr(self, name))
+        rec.cooldowns = dict(self.cooldowns)
+        rec.stats = dict(self.stats)
+        rec.items = dict(self.items)
+        rec.businesses = {name: dict(info) for name, info in self.businesses.items()}
+        rec.extra = copy.deepcopy(self.extra) if self.extra else None
+        return rec
+
+    def __eq__(self, other):
+        if not isinstance(other, UserRecord):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    __hash__ = None
+
+    # -----------------------------
+    # Helpers
+    # -----------------------------
+    @property
+    def total(self) -> int:
+        return self.wallet + self.bank
+
+    def add_item(self, item: str, count: int = 1):
+        item = sys.intern(item)
+        self.items[item] = self.items.get(item, 0) + count
+
+    def take_item(self, item: str, count: int = 1) -> bool:
+        have = self.items.get(item, 0)
+        if have < count:
+            return False
+        if have == count:
+            del self.items[item]
+        else:
+            self.items[item] = have - count
+        return True
+
+    def __repr__(self):
+        return f"UserRecord(wallet={self.wallet}, bank={self.bank}, level={self.level})"
+
+
+def balances(value) -> Tuple[int, int]:
+    """(wallet, bank) from a UserRecord or a not-yet-loaded stored dict."""
+    if isinstance(value, UserRecord):
+        return value.wallet, value.bank
+    return _int(value.get("wallet")), _int(value.get("bank"))
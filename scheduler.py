@@ -0,0 +1,50 @@
+# scheduler.py
+# Heap of (due time, kind, key) expirations for the maintenance loop.
+#
+# Each (kind, key) has at most one live deadline. Scheduling an earlier
+# deadline supersedes the current one; a later one is ignored, because the
+# handler that runs at the earlier deadline reschedules whatever is left.
+# Superseded heap entries are skipped lazily when they surface.
+import heapq
+from typing import Dict, Hashable, List, Tuple
+
+Job = Tuple[str, Hashable]
+
+
+class ExpiryScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, str, Hashable]] = []
+        self._due: Dict[Job, float] = {}
+
+    def schedule(self, kind: str, key: Hashable, due: float):
+        job = (kind, key)
+        current = self._due.get(job)
+        if current is not None and current <= due:
+            return
+        self._due[job] = due
+        heapq.heappush(self._heap, (due, kind, key))
+
+    def cancel(self, kind: str, key: Hashable):
+        self._due.pop((kind, key), None)
+
+    def pop_due(self, now: float, limit: int) -> List[Job]:
+        """Remove and return up to `limit` jobs whose deadline has passed."""
+        out = []
+        heap = self._heap
+        while heap and len(out) < limit and heap[0][0] <= now:
+            due, kind, key = heapq.heappop(heap)
+            if self._due.get((kind, key)) != due:
+                continue   # superseded or cancelled
+            del self._due[(kind, key)]
+            out.append((kind, key))
+        # drop superseded entries piling up ahead of live ones
+        if len(heap) > 2 * len(self._due) + 64:
+            self._heap = [(d, k, key) for (k, key), d in self._due.items()]
+            heapq.heapify(self._heap)
+        return out
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, job: Job):
+        return job in self._due
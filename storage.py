@@ -0,0 +1,565 @@
+# storage.py
+# Pluggable storage backends behind the user / server / economy helpers.
+#
+#   JsonBackend   - the original users.json / servers.json / economy.json
+#                   documents, served from the resident DocumentStore
+#   SqliteBackend - one row per user and per guild in a WAL-mode database,
+#                   with an index on wallet + bank for the leaderboard; it is
+#                   also the shared state when several shard processes run
+#
+# Run `python storage.py import-json` once to copy the JSON files into SQLite.
+import asyncio
+import json
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from market import Order
+from persistence import STORAGE_LATENCY
+from records import UserRecord, balances
+from store import DocumentStore
+
+
+class StorageBackend:
+    """Interface used by main.py. Ids are always passed as strings."""
+    name = "base"
+
+    def get_user(self, user_id: str) -> Optional[UserRecord]:
+        raise NotImplementedError
+
+    def put_user(self, user_id: str, data: UserRecord):
+        raise NotImplementedError
+
+    def create_user(self, user_id: str) -> UserRecord:
+        """Store an empty record unless one exists (another process may have just made it); return the stored one."""
+        raise NotImplementedError
+
+    def iter_balances(self) -> Iterator[Tuple[str, int]]:
+        """Yield (user_id, wallet + bank) for every stored user."""
+        raise NotImplementedError
+
+    def get_server(self, guild_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def put_server(self, guild_id: str, data: dict):
+        raise NotImplementedError
+
+    def iter_servers(self) -> Iterator[Tuple[str, dict]]:
+        """Yield (guild_id, entry) for every stored server entry."""
+        raise NotImplementedError
+
+    def get_economy(self, guild_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def put_economy(self, guild_id: str, data: dict):
+        raise NotImplementedError
+
+    def iter_orders(self) -> Iterator[Order]:
+        """Yield every open market order."""
+        raise NotImplementedError
+
+    def insert_order(self, order: Order) -> int:
+        """Store a new order and return the id assigned to it."""
+        raise NotImplementedError
+
+    def update_order(self, order: Order):
+        raise NotImplementedError
+
+    def delete_order(self, order_id: int):
+        raise NotImplementedError
+
+    def restore_order(self, order_id: int, row: Optional[list]):
+        """Put an order back exactly as logged (None removes it); used by ledger replay."""
+        raise NotImplementedError
+
+    def market_version(self) -> Optional[int]:
+        """Counter bumped by every order write, or None if only this process writes."""
+        return None
+
+    def market_changes(self, since: int) -> Optional[List[Tuple[int, Optional[Order]]]]:
+        """(order id, current order or None if gone) for orders written after version `since`.
+
+        None when the change log no longer reaches back that far; the caller
+        then reloads the whole book.
+        """
+        return None
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Small bookkeeping values (e.g. the last synced command tree hash)."""
+        raise NotImplementedError
+
+    def put_meta(self, key: str, value: str):
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Make the writes inside the block atomic for other processes (no-op by default)."""
+        yield
+
+    def close(self):
+        pass
+
+
+# -----------------------------
+# JSON documents
+# -----------------------------
+class JsonBackend(StorageBackend):
+    name = "json"
+
+    def __init__(self, store: DocumentStore):
+        self.store = store
+
+    def _get(self, file_key: str, key: str) -> Optional[dict]:
+        with STORAGE_LATENCY.time(op="get", doc=file_key):
+            return self.store.get(file_key).get(key)
+
+    def _put(self, file_key: str, key: str, data: dict):
+        with STORAGE_LATENCY.time(op="put", doc=file_key):
+            self.store.get(file_key)[key] = data
+            self.store.mark_dirty(file_key, key)
+
+    def get_user(self, user_id: str) -> Optional[UserRecord]:
+        # parsed dicts are upgraded to resident records on first access
+        with STORAGE_LATENCY.time(op="get", doc="users"):
+            users = self.store.get("users")
+            value = users.get(user_id)
+            if value is None or isinstance(value, UserRecord):
+                return value
+            record = users[user_id] = UserRecord.from_dict(value)
+            return record
+
+    def put_user(self, user_id: str, data: UserRecord):
+        self._put("users", user_id, data)
+
+    def create_user(self, user_id: str) -> UserRecord:
+        user = self.get_user(user_id)
+        if user is None:
+            user = UserRecord()
+            self.put_user(user_id, user)
+        return user
+
+    def iter_balances(self) -> Iterator[Tuple[str, int]]:
+        for uid, data in self.store.get("users").items():
+            wallet, bank = balances(data)
+            yield uid, wallet + bank
+
+    def get_server(self, guild_id: str) -> Optional[dict]:
+        return self._get("servers", guild_id)
+
+    def put_server(self, guild_id: str, data: dict):
+        self._put("servers", guild_id, data)
+
+    def iter_servers(self) -> Iterator[Tuple[str, dict]]:
+        yield from list(self.store.get("servers").items())
+
+    def get_economy(self, guild_id: str) -> Optional[dict]:
+        return self._get("economy", guild_id)
+
+    def put_economy(self, guild_id: str, data: dict):
+        self._put("economy", guild_id, data)
+
+    def _orders(self) -> dict:
+        doc = self.store.get("market")
+        orders = doc.get("orders")
+        if orders is None:
+            orders = doc["orders"] = {}
+        return orders
+
+    def iter_orders(self) -> Iterator[Order]:
+        # rows are upgraded to resident Order objects, as users are to records
+        orders = self._orders()
+        for key, value in list(orders.items()):
+            if not isinstance(value, Order):
+                value = orders[key] = Order.from_row(value)
+            yield value
+
+    def insert_order(self, order: Order) -> int:
+        doc = self.store.get("market")
+        order.id = doc.get("next_id", 1)
+        doc["next_id"] = order.id + 1
+        self._orders()[str(order.id)] = order
+        self.store.mark_dirty("market")
+        return order.id
+
+    def update_order(self, order: Order):
+        self._orders()[str(order.id)] = order
+        self.store.mark_dirty("market")
+
+    def delete_order(self, order_id: int):
+        if self._orders().pop(str(order_id), None) is not None:
+            self.store.mark_dirty("market")
+
+    def restore_order(self, order_id: int, row: Optional[list]):
+        if row is None:
+            self.delete_order(order_id)
+            return
+        doc = self.store.get("market")
+        self._orders()[str(order_id)] = Order.from_row(row)
+        doc["next_id"] = max(doc.get("next_id", 1), order_id + 1)
+        self.store.mark_dirty("market")
+
+    def get_meta(self, key: str) -> Optional[str]:
+        return self._get("meta", key)
+
+    def put_meta(self, key: str, value: str):
+        self._put("meta", key, value)
+
+
+# -----------------------------
+# SQLite
+# -----------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id     TEXT PRIMARY KEY,
+    wallet INTEGER NOT NULL DEFAULT 0,
+    bank   INTEGER NOT NULL DEFAULT 0,
+    data   TEXT NOT NULL
+);
+DROP INDEX IF EXISTS users_total;
+CREATE INDEX IF NOT EXISTS users_rank ON users ((wallet + bank) DESC, id);
+CREATE TABLE IF NOT EXISTS servers (
+    id   TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS economy (
+    id   TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS market_orders (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    side     TEXT NOT NULL,
+    item     TEXT NOT NULL,
+    user_id  TEXT NOT NULL,
+    price    INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    created  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS market_log (
+    version  INTEGER PRIMARY KEY,   -- meta market_version after the write
+    order_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+INSERT OR IGNORE INTO tags (key, value) SELECT key, value FROM meta WHERE typeof(value) = 'text';
+DELETE FROM meta WHERE typeof(value) = 'text';
+"""
+
+
+def _split_user(data) -> Tuple[int, int, str]:
+    # plain dicts (imports) go through the record type so they're migrated too
+    record = data if isinstance(data, UserRecord) else UserRecord.from_dict(data)
+    rest = record.to_dict()
+    del rest["wallet"], rest["bank"]
+    return record.wallet, record.bank, json.dumps(rest, separators=(",", ":"))
+
+
+class SqliteBackend(StorageBackend):
+    name = "sqlite"
+    BUSY_TIMEOUT_MS = 20   # longest a single statement may stall the loop on a lock
+    LOCK_WAIT = 5.0        # how long transaction() keeps retrying BEGIN IMMEDIATE
+    MARKET_LOG_KEEP = 5000   # order changes other processes can catch up on incrementally
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path, isolation_level=None)  # autocommit; explicit BEGIN for batches
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        # other shard processes may hold the write lock briefly. Waiting here
+        # blocks the event loop, so keep it short: transaction() waits for the
+        # lock itself, asynchronously
+        self.db.execute(f"PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS}")
+        self.db.executescript(SCHEMA)
+        self._txn_lock: Optional[asyncio.Lock] = None
+        self._market_writes = 0
+
+    def get_user(self, user_id: str) -> Optional[UserRecord]:
+        with STORAGE_LATENCY.time(op="get", doc="users"):
+            row = self.db.execute("SELECT wallet, bank, data FROM users WHERE id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user = json.loads(row[2])
+        user["wallet"] = row[0]
+        user["bank"] = row[1]
+        return UserRecord.from_dict(user)
+
+    def put_user(self, user_id: str, data: UserRecord):
+        wallet, bank, blob = _split_user(data)
+        with STORAGE_LATENCY.time(op="put", doc="users"):
+            self.db.execute(
+                "INSERT INTO users (id, wallet, bank, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET wallet = excluded.wallet, bank = excluded.bank, data = excluded.data",
+                (user_id, wallet, bank, blob),
+            )
+
+    def create_user(self, user_id: str) -> UserRecord:
+        # one statement, so a concurrent first write from another process is
+        # never replaced by the empty record; read back whichever row won
+        wallet, bank, blob = _split_user(UserRecord())
+        with STORAGE_LATENCY.time(op="put", doc="users"):
+            self.db.execute("INSERT OR IGNORE INTO users (id, wallet, bank, data) VALUES (?, ?, ?, ?)",
+                            (user_id, wallet, bank, blob))
+        return self.get_user(user_id)
+
+    def iter_balances(self) -> Iterator[Tuple[str, int]]:
+        yield from self.db.execute("SELECT id, wallet + bank FROM users")
+
+    def _get_doc(self, table: str, key: str) -> Optional[dict]:
+        with STORAGE_LATENCY.time(op="get", doc=table):
+            row = self.db.execute(f"SELECT data FROM {table} WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put_doc(self, table: str, key: str, data: dict):
+        blob = json.dumps(data, separators=(",", ":"))
+        with STORAGE_LATENCY.time(op="put", doc=table):
+            self.db.execute(
+                f"INSERT INTO {table} (id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                (key, blob),
+            )
+
+    def get_server(self, guild_id: str) -> Optional[dict]:
+        return self._get_doc("servers", guild_id)
+
+    def put_server(self, guild_id: str, data: dict):
+        self._put_doc("servers", guild_id, data)
+
+    def iter_servers(self) -> Iterator[Tuple[str, dict]]:
+        for gid, blob in self.db.execute("SELECT id, data FROM servers").fetchall():
+            yield gid, json.loads(blob)
+
+    def get_economy(self, guild_id: str) -> Optional[dict]:
+        return self._get_doc("economy", guild_id)
+
+    def put_economy(self, guild_id: str, data: dict):
+        self._put_doc("economy", guild_id, data)
+
+    def iter_orders(self) -> Iterator[Order]:
+        for row in self.db.execute(
+                "SELECT id, side, item, user_id, price, quantity, created FROM market_orders").fetchall():
+            yield Order.from_row(row)
+
+    def _bump_market(self, order_id: int):
+        self.db.execute("INSERT INTO meta (key, value) VALUES ('market_version', 1) "
+                        "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+        self.db.execute("INSERT INTO market_log (version, order_id) "
+                        "SELECT value, ? FROM meta WHERE key = 'market_version'", (order_id,))
+        self._market_writes += 1
+        if self._market_writes % 500 == 0:
+            self.db.execute("DELETE FROM market_log WHERE version <= "
+                            "(SELECT value FROM meta WHERE key = 'market_version') - ?", (self.MARKET_LOG_KEEP,))
+
+    def insert_order(self, order: Order) -> int:
+        cur = self.db.execute(
+            "INSERT INTO market_orders (side, item, user_id, price, quantity, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (order.side, order.item, order.user_id, order.price, order.quantity, order.created),
+        )
+        order.id = cur.lastrowid
+        self._bump_market(order.id)
+        return order.id
+
+    def update_order(self, order: Order):
+        self.db.execute("UPDATE market_orders SET quantity = ? WHERE id = ?", (order.quantity, order.id))
+        self._bump_market(order.id)
+
+    def delete_order(self, order_id: int):
+        self.db.execute("DELETE FROM market_orders WHERE id = ?", (order_id,))
+        self._bump_market(order_id)
+
+    def restore_order(self, order_id: int, row: Optional[list]):
+        if row is None:
+            self.delete_order(order_id)
+            return
+        self.db.execute(
+            "INSERT OR REPLACE INTO market_orders (id, side, item, user_id, price, quantity, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", row,
+        )
+        self._bump_market(order_id)
+
+    def market_version(self) -> Optional[int]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'market_version'").fetchone()
+        return row[0] if row else 0
+
+    def market_changes(self, since: int) -> Optional[List[Tuple[int, Optional[Order]]]]:
+        oldest = self.db.execute("SELECT MIN(version) FROM market_log").fetchone()[0]
+        if oldest is None or oldest > since + 1:
+            # pruned past `since` (or never logged, e.g. a database from before the log)
+            return None if self.market_version() != since else []
+        rows = self.db.execute(
+            "SELECT c.order_id, o.id, o.side, o.item, o.user_id, o.price, o.quantity, o.created "
+            "FROM (SELECT DISTINCT order_id FROM market_log WHERE version > ?) c "
+            "LEFT JOIN market_orders o ON o.id = c.order_id", (since,),
+        ).fetchall()
+        return [(row[0], Order.from_row(row[1:]) if row[1] is not None else None) for row in rows]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM tags WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_meta(self, key: str, value: str):
+        self.db.execute("INSERT OR REPLACE INTO tags (key, value) VALUES (?, ?)", (key, value))
+
+    @asynccontextmanager
+    async def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT around the block.
+
+        IMMEDIATE takes the database write lock up front, so a read-modify-write
+        inside the block can't interleave with one from another process. While
+        another process holds the lock, BEGIN is retried with an asyncio sleep
+        between attempts instead of blocking the loop. The connection is shared
+        by the whole process, hence the asyncio lock.
+        """
+        if self._txn_lock is None:
+            self._txn_lock = asyncio.Lock()
+        async with self._txn_lock:
+            with STORAGE_LATENCY.time(op="begin", doc="*"):
+                await self._begin_immediate()
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            with STORAGE_LATENCY.time(op="commit", doc="*"):
+                self.db.execute("COMMIT")
+
+    async def _begin_immediate(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.LOCK_WAIT
+        delay = 0.002
+        while True:
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                if loop.time() + delay > deadline:
+                    raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def ranking(self, member_ids: Optional[Iterable[str]] = None) -> "SqliteRanking":
+        return SqliteRanking(self.db, member_ids)
+
+    def close(self):
+        self.db.close()
+
+
+class SqliteRanking:
+    """RankIndex-compatible read view over the users table.
+
+    Used instead of the in-process index when several processes share the
+    database, so every query sees every process's committed writes. With
+    `member_ids` the ranking covers only those users (a guild leaderboard).
+    Ties are ordered by user id, as in RankIndex.
+    """
+
+    def __init__(self, db: sqlite3.Connection, member_ids: Optional[Iterable[str]] = None):
+        self.db = db
+        self.members = None if member_ids is None else json.dumps(list(member_ids))
+
+    def _scope(self, where: str = "", params: tuple = ()) -> Tuple[str, tuple]:
+        clauses = [where] if where else []
+        if self.members is not None:
+            clauses.append("id IN (SELECT value FROM json_each(?))")
+            params = params + (self.members,)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def score(self, user_id: str) -> Optional[int]:
+        where, params = self._scope("id = ?", (user_id,))
+        row = self.db.execute(f"SELECT wallet + bank FROM users{where}", params).fetchone()
+        return row[0] if row else None
+
+    def rank(self, user_id: str) -> Optional[int]:
+        total = self.score(user_id)
+        if total is None:
+            return None
+        where, params = self._scope("(wallet + bank > ? OR (wallet + bank = ? AND id < ?))", (total, total, user_id))
+        return self.db.execute(f"SELECT COUNT(*) FROM users{where}", params).fetchone()[0] + 1
+
+    def page(self, offset: int, limit: int) -> List[Tuple[str, int]]:
+        where, params = self._scope()
+        return self.db.execute(
+            f"SELECT id, wallet + bank FROM users{where} ORDER BY wallet + bank DESC, id LIMIT ? OFFSET ?",
+            params + (limit, offset),
+        ).fetchall()
+
+    def top(self, limit: int) -> List[Tuple[str, int]]:
+        return self.page(0, limit)
+
+    def __len__(self):
+        where, params = self._scope()
+        return self.db.execute(f"SELECT COUNT(*) FROM users{where}", params).fetchone()[0]
+
+    def __contains__(self, user_id):
+        return self.score(user_id) is not None
+
+
+def open_backend(kind: str, store: DocumentStore, sqlite_path: str) -> StorageBackend:
+    kind = (kind or "json").lower()
+    if kind == "json":
+        return JsonBackend(store)
+    if kind == "sqlite":
+        return SqliteBackend(sqlite_path)
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+# -----------------------------
+# One-shot JSON -> SQLite import
+# -----------------------------
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} does not contain a JSON object")
+    return data
+
+
+def import_json(backend: SqliteBackend, files: Dict[str, str]) -> Dict[str, int]:
+    """Copy users / servers / economy from the JSON files in one transaction."""
+    users = _read_json(files["users"])
+    servers = _read_json(files["servers"])
+    econ = _read_json(files["economy"])
+    db = backend.db
+    db.execute("BEGIN")
+    try:
+        db.executemany(
+            "INSERT OR REPLACE INTO users (id, wallet, bank, data) VALUES (?, ?, ?, ?)",
+            ((uid, *_split_user(data)) for uid, data in users.items()),
+        )
+        for table, docs in (("servers", servers), ("economy", econ)):
+            db.executemany(
+                f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)",
+                ((key, json.dumps(data, separators=(",", ":"))) for key, data in docs.items()),
+            )
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return {"users": len(users), "servers": len(servers), "economy": len(econ)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="VRTEX storage tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import-json", help="copy users/servers/economy JSON files into SQLite")
+    imp.add_argument("--db", default="vrtex.db")
+    imp.add_argument("--users", default="users.json")
+    imp.add_argument("--servers", default="servers.json")
+    imp.add_argument("--economy", default="economy.json")
+    args = parser.parse_args()
+
+    if args.cmd == "import-json":
+        target = SqliteBackend(args.db)
+        counts = import_json(target, {"users": args.users, "servers": args.servers, "economy": args.economy})
+        target.close()
+        print(f"Imported {counts['users']} users, {counts['servers']} servers, {counts['economy']} economy entries into {args.db}")
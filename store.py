@@ -0,0 +1,135 @@
+# store.py
+# Resident write-back store for the bot's JSON documents.
+#
+# Each entry of FILES is parsed once and kept in memory. Helpers mutate the
+# resident dicts and mark the document dirty; dirty documents are written back
+# when the periodic flush (or a ledger checkpoint) runs. Every commit is
+# already durable in the ledger, so nothing forces an earlier write.
+#
+# For flat documents the store also tracks which top-level keys changed, and
+# a flush hands the writer only those entries; the rest of the document keeps
+# the encoding the writer made last time.
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional, Set
+
+from persistence import DELETED, STORAGE_LATENCY, AsyncJsonWriter, atomic_write_json, snapshot
+
+
+class DocumentStore:
+    def __init__(self, files: Dict[str, str], flush_interval: float = 30.0,
+                 writer: Optional[AsyncJsonWriter] = None, flat_docs=()):
+        self.files = files
+        self.flat_docs = frozenset(flat_docs)     # see persistence.snapshot()
+        self.flush_interval = flush_interval      # seconds between periodic flushes
+        self._docs: Dict[str, dict] = {}
+        # file key -> top-level keys changed since the last flush, or None
+        # when the whole document has to be written
+        self._dirty: Dict[str, Optional[Set[str]]] = {}
+        self._based: Set[str] = set()   # flat documents the writer holds a full encoding of
+        self.writer = writer or AsyncJsonWriter()
+        self.last_flush = time.monotonic()
+
+    def _read(self, file_key: str) -> dict:
+        path = self.files[file_key]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            data = e
+        if isinstance(data, dict):
+            return data
+        # never silently overwrite an unreadable document; keep it for inspection
+        aside = f"{path}.corrupt-{int(time.time())}"
+        os.replace(path, aside)
+        print(f"[STORE] {path} was unreadable ({data!r:.80}); moved to {aside}")
+        return {}
+
+    def get(self, file_key: str) -> dict:
+        """Return the resident document, loading it from disk on first use."""
+        doc = self._docs.get(file_key)
+        if doc is None:
+            with STORAGE_LATENCY.time(op="load", doc=file_key):
+                doc = self._docs[file_key] = self._read(file_key)
+        return doc
+
+    def put(self, file_key: str, data: dict):
+        """Replace (or re-register) a document and mark it dirty."""
+        self._docs[file_key] = data
+        self.mark_dirty(file_key)
+
+    def mark_dirty(self, file_key: str, key: Optional[str] = None):
+        """Note a change to the document, or only to its entry `key` if it is flat."""
+        changed = self._dirty.get(file_key, ())
+        if changed is None:
+            return
+        if key is None or file_key not in self._based:
+            self._dirty[file_key] = None
+        else:
+            self._dirty.setdefault(file_key, set()).add(key)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._dirty)
+
+    def flush_async(self, also: Iterable[str] = ()) -> "asyncio.Task[bool]":
+        """Snapshot dirty documents now and write them off-loop.
+
+        The snapshot is taken before this returns; await the task to wait for
+        the writes (True if all of them succeeded). Loaded documents named in
+        `also` are written even when clean, which also waits out any earlier
+        write of them still in flight.
+        """
+        dirty = self._dirty
+        self._dirty = {}
+        for k in also:
+            if k in self._docs and k not in dirty:
+                dirty[k] = set() if k in self._based else None
+        saves = {}
+        for k, changed in dirty.items():
+            doc, path = self._docs[k], self.files[k]
+            if changed is not None:
+                # records are replaced, never edited, so the references are a snapshot
+                saves[k] = self.writer.update(path, {key: doc.get(key, DELETED) for key in changed})
+                continue
+            flat = k in self.flat_docs
+            saves[k] = self.writer.save(path, snapshot(doc, flat))
+            if flat:
+                self._based.add(k)
+        return asyncio.get_running_loop().create_task(self._settle(saves))
+
+    async def _settle(self, saves: Dict[str, asyncio.Task]) -> bool:
+        results = await asyncio.gather(*saves.values(), return_exceptions=True)
+        ok = True
+        for key, result in zip(saves, results):
+            if isinstance(result, BaseException):
+                # the changed keys were handed over already; rewrite it whole
+                self._dirty[key] = None
+                self._based.discard(key)
+                ok = False
+                print(f"[STORE] failed to write {self.files[key]}: {result!r}")
+        self.last_flush = time.monotonic()
+        return ok
+
+    def flush(self, file_key: Optional[str] = None):
+        """Synchronously write dirty documents (or just `file_key`) back to disk."""
+        keys = [file_key] if file_key is not None else list(self._dirty)
+        for key in keys:
+            if key not in self._dirty:
+                continue
+            atomic_write_json(self.files[key], self._docs[key])
+            del self._dirty[key]
+            # the writer's encoding of it is behind the file now
+            self.writer.forget(self.files[key])
+            self._based.discard(key)
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """Drain the writer and flush everything; called once on shutdown."""
+        self.writer.close()
+        self.flush()
+
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    """main.py imported inside a scratch directory (it creates its documents in the cwd).
+
+    The JSON backend and resident store are shared by every test that uses
+    this fixture, so tests pick user ids of their own.
+    """
+    home = tmp_path_factory.mktemp("bot")
+    cwd = os.getcwd()
+    os.chdir(home)
+    try:
+        import main
+        main.prepare_state()
+        yield main
+        main.ledger.close()
+        main.store.close()
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+from ledger import Ledger
+from records import UserRecord
+
+
+def record(wallet: int, bank: int = 0, **items) -> UserRecord:
+    rec = UserRecord()
+    rec.wallet = wallet
+    rec.bank = bank
+    for item, count in items.items():
+        rec.add_item(item, count)
+    return rec
+
+
+def commit(ledger: Ledger, uid: str, before: UserRecord, after: UserRecord, orders=None, reason="test"):
+    ledger.commit({uid: (before, after)}, orders or {}, reason)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    led = Ledger(str(tmp_path / "ledger"))
+    assert led.recover() is None   # fresh directory: nothing to replay
+    yield led
+    led.close()
+
+
+def reopen(led: Ledger) -> Ledger:
+    led.close()
+    return Ledger(led.directory)
+
+
+def test_recover_without_checkpoint_only_restores_seq(ledger):
+    commit(ledger, "1", record(0), record(10))
+    commit(ledger, "1", record(10), record(25))
+    again = reopen(ledger)
+    assert again.recover() is None   # the documents as loaded are the baseline
+    assert again.seq == 2
+    again.close()
+
+
+def test_replay_after_checkpoint(ledger):
+    commit(ledger, "1", record(0), record(10))
+    ledger.checkpoint(ledger.seq)
+    commit(ledger, "2", record(0), record(5, gem=2), orders={7: [7, "ask", "gem", "2", 40, 1, 0]})
+    commit(ledger, "2", record(5, gem=2), record(3, 4, gem=1))
+    again = reopen(ledger)
+    users, orders = again.recover()
+    # "1" is already in the checkpointed documents; "2" comes back as last committed
+    assert users == {"2": record(3, 4, gem=1).to_dict()}
+    assert orders == {"7": [7, "ask", "gem", "2", 40, 1, 0]}
+    assert again.seq == 3 and again.checkpoint_seq == 1
+    again.close()
+
+
+def test_replay_spans_rotated_segments(ledger):
+    commit(ledger, "1", record(0), record(10))
+    ledger.checkpoint(ledger.seq)
+    commit(ledger, "1", record(10), record(20))
+    commit(ledger, "3", record(0), record(1), orders={9: [9, "bid", "gem", "3", 5, 2, 0]})
+    ledger.rotate()   # e.g. a compaction whose flush failed: no checkpoint followed
+    commit(ledger, "3", record(1), record(2), orders={9: None})
+    assert sorted(os.listdir(ledger.directory)) == ["checkpoint.json", "ledger-1.jsonl", "ledger-3.jsonl",
+                                                    "ledger.jsonl"]
+    again = reopen(ledger)
+    users, orders = again.recover()
+    assert users == {"1": record(20).to_dict(), "3": record(2).to_dict()}
+    assert orders == {"9": None}
+    assert again.seq == 4
+    again.close()
+
+
+def test_torn_last_line_is_dropped_and_cut(ledger):
+    ledger.checkpoint(0)
+    commit(ledger, "1", record(0), record(10))
+    ledger.close()
+    with open(ledger.log_path, "a", encoding="utf-8") as f:
+        f.write('{"seq":2,"ts":1,"reason":"test","users":{"1":{"v":3,"wal')   # crash mid-append
+    again = Ledger(ledger.directory)
+    users, _ = again.recover()
+    assert users == {"1": record(10).to_dict()}
+    assert again.seq == 1
+    # the next entry starts on a line of its own, so it survives the next recovery
+    commit(again, "1", record(10), record(30))
+    third = reopen(again)
+    users, _ = third.recover()
+    assert users == {"1": record(30).to_dict()}
+    assert third.seq == 2
+    third.close()
+
+
+def test_entry_logs_full_records_and_balance_delta(ledger):
+    commit(ledger, "5", record(100, 50), record(70, 80, gem=1), reason="deposit")
+    ledger.flush()
+    with open(ledger.log_path, "r", encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    assert entry["seq"] == 1 and entry["reason"] == "deposit"
+    assert entry["users"] == {"5": record(70, 80, gem=1).to_dict()}
+    assert entry["delta"] == {"5": [-30, 30]}
+
+
+def test_recover_ledger_restores_users_and_orders(bot, tmp_path, monkeypatch):
+    logged = Ledger(str(tmp_path / "replay"))
+    logged.recover()
+    logged.checkpoint(0)
+    stale = bot.backend.get_user("9001")
+    assert stale is None
+    commit(logged, "9001", record(0), record(40, 2, relic=3), orders={
+        8001: [8001, "ask", "relic", "9001", 15, 1, 0],
+        8002: [8002, "ask", "relic", "9001", 16, 1, 0],
+    })
+    commit(logged, "9001", record(40, 2, relic=3), record(55, 2, relic=3), orders={8002: None})
+    logged.close()
+
+    monkeypatch.setattr(bot, "ledger", Ledger(logged.directory))
+    try:
+        bot.recover_ledger()
+        assert bot.backend.get_user("9001") == record(55, 2, relic=3)
+        orders = {o.id: o.to_dict() for o in bot.backend.iter_orders() if o.item == "relic"}
+        assert orders == {8001: [8001, "ask", "relic", "9001", 15, 1, 0]}
+        assert bot.ledger.seq == 2
+    finally:
+        bot.ledger.close()
+        bot.market.loaded = False   # the backend's book changed under it
@@ -0,0 +1,184 @@
+import asyncio
+import random
+
+from market import ASK, BID, Market, Order
+
+
+def book(*orders) -> Market:
+    market = Market()
+    market.load(Order(*o) for o in orders)
+    return market
+
+
+# -----------------------------
+# Market (matching only; no escrow)
+# -----------------------------
+def test_match_walks_best_price_then_oldest():
+    market = book((1, ASK, "gem", "a", 10, 1), (2, ASK, "gem", "b", 9, 1), (3, ASK, "gem", "c", 9, 1),
+                  (4, ASK, "gem", "d", 12, 1))
+    fills = market.match(BID, "gem", "t", 11, 5)
+    assert [(f.maker.id, f.quantity, f.price) for f in fills] == [(2, 1, 9), (3, 1, 9), (1, 1, 10)]
+    assert not market.crosses(BID, "gem", 11, fills)   # only the 12 is left
+
+
+def test_bids_match_highest_first():
+    market = book((1, BID, "gem", "a", 5, 2), (2, BID, "gem", "b", 7, 1), (3, BID, "gem", "c", 3, 4))
+    fills = market.match(ASK, "gem", "t", 4, 10)
+    assert [(f.maker.id, f.quantity) for f in fills] == [(2, 1), (1, 2)]
+
+
+def test_partial_fill_leaves_maker_resting():
+    market = book((1, ASK, "gem", "a", 10, 5))
+    fills = market.match(BID, "gem", "t", 10, 2)
+    assert [(f.maker.id, f.quantity) for f in fills] == [(1, 2)]
+    updated, closed = market.settle(fills)
+    assert [o.id for o in updated] == [1] and closed == []
+    assert market.orders[1].quantity == 3
+    assert market.page("gem", ASK, 0, 10) == [market.orders[1]]
+
+
+def test_settle_removes_filled_makers():
+    market = book((1, ASK, "gem", "a", 10, 1), (2, ASK, "gem", "a", 11, 1))
+    updated, closed = market.settle(market.match(BID, "gem", "t", 20, 2))
+    assert updated == [] and [o.id for o in closed] == [1, 2]
+    assert len(market) == 0 and market.books == {} and market.user_order_count("a") == 0
+
+
+def test_match_stops_at_own_order():
+    market = book((1, ASK, "gem", "b", 9, 1), (2, ASK, "gem", "t", 10, 1), (3, ASK, "gem", "c", 11, 1))
+    fills = market.match(BID, "gem", "t", 12, 3)
+    # the 9 trades; the taker's own 10 stops matching before the 11 is reached
+    assert [f.maker.id for f in fills] == [1]
+    assert market.crosses(BID, "gem", 12, fills)
+    assert not market.crosses(BID, "gem", 9, fills)
+
+
+def test_apply_replaces_and_removes_changed_orders():
+    market = book((1, ASK, "gem", "a", 10, 3), (2, BID, "gem", "b", 8, 1))
+    market.apply([(1, Order(1, ASK, "gem", "a", 10, 1)), (2, None), (5, Order(5, BID, "gem", "c", 9, 2))])
+    assert {oid: o.quantity for oid, o in market.orders.items()} == {1: 1, 5: 2}
+    assert market.books["gem"].best(BID) == 9
+
+
+# -----------------------------
+# main.place_order / cancel_order (escrow and settlement)
+# -----------------------------
+ITEM = "test_ore"
+
+
+async def seed(bot, uid: int, wallet: int, ore: int = 0):
+    async with bot.user_txn(uid) as user:
+        user.wallet = wallet
+        user.bank = 0
+        user.items.pop(ITEM, None)
+        if ore:
+            user.add_item(ITEM, ore)
+
+
+def holdings(bot, uids):
+    """(coins, ore) held by `uids` plus what their open orders have in escrow."""
+    coins = ore = 0
+    for uid in uids:
+        user = bot.backend.get_user(str(uid))
+        coins += user.total
+        ore += user.items.get(ITEM, 0)
+    for order in bot.market.orders.values():
+        if order.item == ITEM:
+            if order.side == BID:
+                coins += order.price * order.quantity
+            else:
+                ore += order.quantity
+    return coins, ore
+
+
+def test_partial_fill_settles_at_maker_price(bot):
+    async def go():
+        await seed(bot, 7101, 0, ore=5)
+        await seed(bot, 7102, 1000)
+        _, resting, error = await bot.place_order(7101, ASK, ITEM, 10, 5)
+        assert error is None and resting.quantity == 5
+        fills, rest, error = await bot.place_order(7102, BID, ITEM, 12, 2)
+        assert error is None and rest is None
+        assert [(f.maker.id, f.quantity, f.price) for f in fills] == [(resting.id, 2, 10)]
+        maker, taker = bot.backend.get_user("7101"), bot.backend.get_user("7102")
+        assert (maker.wallet, maker.items.get(ITEM, 0)) == (20, 0)
+        assert (taker.wallet, taker.items.get(ITEM, 0)) == (980, 2)
+        assert bot.market.orders[resting.id].quantity == 3
+        assert await bot.cancel_order(7101, resting.id) is not None
+        assert bot.backend.get_user("7101").items[ITEM] == 3
+    asyncio.run(go())
+
+
+def test_price_time_priority_across_makers(bot):
+    async def go():
+        for uid in (7201, 7202, 7203):
+            await seed(bot, uid, 0, ore=1)
+        await seed(bot, 7204, 1000)
+        _, late, _ = await bot.place_order(7201, ASK, ITEM, 30, 1)
+        _, early, _ = await bot.place_order(7202, ASK, ITEM, 31, 1)
+        _, second, _ = await bot.place_order(7203, ASK, ITEM, 30, 1)
+        fills, _, _ = await bot.place_order(7204, BID, ITEM, 31, 2)
+        assert [f.maker.id for f in fills] == [late.id, second.id]
+        assert bot.backend.get_user("7204").wallet == 1000 - 60
+        await bot.cancel_order(7202, early.id)
+    asyncio.run(go())
+
+
+def test_self_trade_is_refused(bot):
+    async def go():
+        await seed(bot, 7301, 500, ore=2)
+        _, ask, error = await bot.place_order(7301, ASK, ITEM, 40, 1)
+        assert error is None
+        fills, rest, error = await bot.place_order(7301, BID, ITEM, 45, 1)
+        assert fills == [] and rest is None and "your own" in error
+        user = bot.backend.get_user("7301")
+        assert (user.wallet, user.items[ITEM]) == (500, 1)   # nothing charged or escrowed
+        # a bid that doesn't reach the own ask may rest
+        _, bid, error = await bot.place_order(7301, BID, ITEM, 39, 1)
+        assert error is None and bid is not None
+        await bot.cancel_order(7301, ask.id)
+        await bot.cancel_order(7301, bid.id)
+    asyncio.run(go())
+
+
+def test_cancel_refunds_escrow(bot):
+    async def go():
+        await seed(bot, 7401, 300, ore=4)
+        _, bid, _ = await bot.place_order(7401, BID, ITEM, 25, 3)
+        _, ask, _ = await bot.place_order(7401, ASK, ITEM, 90, 4)
+        user = bot.backend.get_user("7401")
+        assert (user.wallet, user.items.get(ITEM, 0)) == (225, 0)
+        assert await bot.cancel_order(7402, bid.id) is None   # not the owner
+        assert (await bot.cancel_order(7401, bid.id)).id == bid.id
+        assert (await bot.cancel_order(7401, ask.id)).id == ask.id
+        assert await bot.cancel_order(7401, ask.id) is None   # already gone
+        user = bot.backend.get_user("7401")
+        assert (user.wallet, user.items[ITEM]) == (300, 4)
+    asyncio.run(go())
+
+
+def test_mixed_orders_conserve_coins_and_items(bot):
+    uids = list(range(7501, 7507))
+    rng = random.Random(18)
+
+    async def go():
+        for uid in uids:
+            await seed(bot, uid, 2000, ore=10)
+        start = holdings(bot, uids)
+        for _ in range(300):
+            uid = rng.choice(uids)
+            mine = [o for o in bot.market.user_orders(str(uid), 0, 100) if o.item == ITEM]
+            if mine and rng.random() < 0.25:
+                assert await bot.cancel_order(uid, rng.choice(mine).id) is not None
+            else:
+                side = rng.choice((BID, ASK))
+                await bot.place_order(uid, side, ITEM, rng.randint(8, 14), rng.randint(1, 4))
+            assert holdings(bot, uids) == start
+            book = bot.market.books.get(ITEM)
+            if book is not None and book.best(BID) is not None and book.best(ASK) is not None:
+                assert book.best(BID) < book.best(ASK)   # never left crossed
+        for uid in uids:
+            for order in bot.market.user_orders(str(uid), 0, 100):
+                await bot.cancel_order(uid, order.id)
+        assert holdings(bot, uids) == start
+    asyncio.run(go())
@@ -1,15 +1,109 @@
-from flask import Flask
-from threading import Thread
+# web_server.py
+# Keep-alive / health / metrics HTTP server running on the bot's own event loop.
+#
+# aiohttp ships with discord.py, so the server shares the loop (and the
+# in-memory economy state) instead of running Flask in a separate thread.
+import hmac
+from typing import Callable, Optional, Tuple
 
-app = Flask('')
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "Bot is alive!"
+from metrics import REGISTRY
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+class EconomyAPI:
+    """Read-side hooks the HTTP endpoints call; implemented in main.py."""
+
+    def balance(self, user_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def leaderboard(self, limit: int, offset: int, guild_id: Optional[str]) -> Optional[list]:
+        raise NotImplementedError
+
+    def user_record(self, user_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def guild_settings(self, guild_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def flush(self) -> dict:
+        raise NotImplementedError
+
+
+def _int_param(request: web.Request, name: str, default: int, lo: int, hi: int) -> int:
+    try:
+        value = int(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+    return max(lo, min(hi, value))
+
+
+def create_app(health_check: Callable[[], Tuple[bool, dict]], api: EconomyAPI,
+               admin_token: Optional[str] = None) -> web.Application:
+    app = web.Application()
+
+    def require_admin(request: web.Request):
+        if not admin_token:
+            raise web.HTTPNotFound()
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {admin_token}".encode()):
+            raise web.HTTPUnauthorized()
+
+    async def home(request):
+        return web.Response(text="Bot is alive!")
+
+    async def healthz(request):
+        healthy, detail = health_check()
+        return web.json_response(detail, status=200 if healthy else 503)
+
+    async def metrics(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    async def balance(request):
+        data = api.balance(request.match_info["user_id"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.json_response(data)
+
+    async def leaderboard(request):
+        limit = _int_param(request, "limit", 10, 1, 100)
+        offset = _int_param(request, "offset", 0, 0, 10 ** 9)
+        rows = api.leaderboard(limit, offset, request.query.get("guild"))
+        if rows is None:
+            raise web.HTTPNotFound(text="unknown guild")
+        return web.json_response({"offset": offset, "entries": rows})
+
+    async def guild(request):
+        data = api.guild_settings(request.match_info["guild_id"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.json_response(data)
+
+    async def admin_user(request):
+        require_admin(request)
+        data = api.user_record(request.match_info["user_id"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.json_response(data)
+
+    async def admin_flush(request):
+        require_admin(request)
+        return web.json_response(await api.flush())
+
+    app.router.add_get("/", home)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/api/balance/{user_id}", balance)
+    app.router.add_get("/api/leaderboard", leaderboard)
+    app.router.add_get("/api/guild/{guild_id}", guild)
+    app.router.add_get("/admin/user/{user_id}", admin_user)
+    app.router.add_post("/admin/flush", admin_flush)
+    return app
+
+
+async def start_web_server(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner